@@ -44,6 +44,7 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'django.middleware.http.ConditionalGetMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -89,6 +90,10 @@ DATABASES = {
 
 
 
+# Bearer token of the bulk signup API (blogs/api/bulk-signup/), disabled when empty
+BLOG_BULK_SIGNUP_TOKEN = os.environ.get('BLOG_BULK_SIGNUP_TOKEN', '')
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
 
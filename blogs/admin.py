@@ -2,4 +2,10 @@ from django.contrib import admin
 
 from .models import Blog
 
-admin.site.register(Blog)
\ No newline at end of file
+
+@admin.register(Blog)
+class BlogAdmin(admin.ModelAdmin):
+    list_display = ('title', 'hostname', 'status', 'created_at', 'ready_at')
+    list_filter = ('status',)
+    search_fields = ('title', 'hostname')
+    readonly_fields = ('created_at', 'claimed_at', 'provisioning_at', 'ready_at', 'failed_at')
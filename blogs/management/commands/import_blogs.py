@@ -0,0 +1,49 @@
+import csv
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from blogs.models import blog_hostname, create_blogs, valid_blog
+
+
+class Command(BaseCommand):
+    help = ("Signs up the blogs of a CSV file (a 'title' column, optionally 'hostname') in chunks; "
+            "the rows without a title, with a title or hostname too long or a hostname taken are skipped.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('csv_file', help="path of the CSV file, '-' for stdin")
+        parser.add_argument('--chunk-size', type=int, default=1000, help="rows inserted per bulk_create")
+
+    def handle(self, csv_file, chunk_size, **options):
+        start = time.monotonic()
+        created = skipped = 0
+        try:
+            f = sys.stdin if csv_file == '-' else open(csv_file, newline='', encoding='utf-8')
+        except OSError as e:
+            raise CommandError(e)
+        with f:
+            reader = csv.DictReader(f)
+            if 'title' not in (reader.fieldnames or ()):
+                raise CommandError("the CSV file needs a 'title' column")
+            chunk = {}
+            for row in reader:
+                title = (row['title'] or '').strip()
+                hostname = (row.get('hostname') or '').strip() or blog_hostname(title)
+                if hostname in chunk or not valid_blog(title, hostname):
+                    skipped += 1
+                    continue
+                chunk[hostname] = title
+                if len(chunk) >= chunk_size:
+                    created, skipped = self.insert(chunk, created, skipped)
+                    chunk = {}
+            if chunk:
+                created, skipped = self.insert(chunk, created, skipped)
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {created} blogs ({skipped} skipped) in {time.monotonic() - start:.1f}s"))
+
+    def insert(self, chunk, created, skipped):
+        """Inserts one chunk, skipping the hostnames already taken."""
+        hostnames, taken = create_blogs(chunk, batch_size=len(chunk))
+        self.stdout.write(f"{created + len(hostnames)} blogs imported")
+        return created + len(hostnames), skipped + len(taken)
@@ -0,0 +1,48 @@
+from django.db import migrations
+
+# Sends a NOTIFY on the 'blog_pending' channel (see operator/listener.py)
+# when a blog that still has to be provisioned is inserted or reset.
+CREATE_TRIGGER = """
+CREATE OR REPLACE FUNCTION blogs_blog_notify() RETURNS trigger AS $$
+BEGIN
+    PERFORM pg_notify('blog_pending', json_build_object(
+        'id', NEW.id,
+        'title', NEW.title,
+        'hostname', NEW.hostname,
+        'created', extract(epoch from clock_timestamp())
+    )::text);
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER blogs_blog_notify
+    AFTER INSERT OR UPDATE OF init ON blogs_blog
+    FOR EACH ROW WHEN (NOT NEW.init)
+    EXECUTE FUNCTION blogs_blog_notify();
+"""
+
+DROP_TRIGGER = """
+DROP TRIGGER IF EXISTS blogs_blog_notify ON blogs_blog;
+DROP FUNCTION IF EXISTS blogs_blog_notify();
+"""
+
+
+def create_trigger(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(CREATE_TRIGGER)
+
+
+def drop_trigger(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(DROP_TRIGGER)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blogs', '0002_blog_init'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_trigger, drop_trigger),
+    ]
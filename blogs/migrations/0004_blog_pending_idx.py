@@ -0,0 +1,17 @@
+# Generated by Django 4.2.16 on 2026-10-18 18:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blogs', '0003_blog_notify'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='blog',
+            index=models.Index(condition=models.Q(('init', False)), fields=['id'], name='blogs_blog_pending_idx'),
+        ),
+    ]
@@ -0,0 +1,106 @@
+# Generated by Django 4.2.16 on 2026-10-18 18:25
+
+from importlib import import_module
+
+from django.db import migrations, models
+import django.utils.timezone
+
+notify_0003 = import_module('blogs.migrations.0003_blog_notify')
+
+# Same channel and payload as 0003, sent for the blogs that are (back) in the 'pending' status.
+CREATE_TRIGGER = """
+CREATE OR REPLACE FUNCTION blogs_blog_notify() RETURNS trigger AS $$
+BEGIN
+    PERFORM pg_notify('blog_pending', json_build_object(
+        'id', NEW.id,
+        'title', NEW.title,
+        'hostname', NEW.hostname,
+        'created', extract(epoch from NEW.created_at)
+    )::text);
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER blogs_blog_notify
+    AFTER INSERT OR UPDATE OF status ON blogs_blog
+    FOR EACH ROW WHEN (NEW.status = 'pending')
+    EXECUTE FUNCTION blogs_blog_notify();
+"""
+
+
+def create_trigger(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(CREATE_TRIGGER)
+
+
+def status_from_init(apps, schema_editor):
+    # The operator set init once it had created the Wordpress resource, without the blog-id
+    # annotation it now reports the status with: nothing would move these blogs to 'ready'.
+    Blog = apps.get_model('blogs', 'Blog')
+    Blog.objects.filter(init=True).update(status='ready', ready_at=django.utils.timezone.now())
+
+
+def init_from_status(apps, schema_editor):
+    Blog = apps.get_model('blogs', 'Blog')
+    Blog.objects.filter(status__in=['provisioning', 'ready']).update(init=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blogs', '0004_blog_pending_idx'),
+    ]
+
+    operations = [
+        migrations.RunPython(notify_0003.drop_trigger, notify_0003.create_trigger),
+        migrations.AddField(
+            model_name='blog',
+            name='claimed_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='blog',
+            name='created_at',
+            field=models.DateTimeField(auto_now_add=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='blog',
+            name='failed_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='blog',
+            name='provisioning_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='blog',
+            name='ready_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='blog',
+            name='status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('claimed', 'Claimed'), ('provisioning', 'Provisioning'), ('ready', 'Ready'), ('failed', 'Failed')], db_index=True, default='pending', max_length=20),
+        ),
+        migrations.AddField(
+            model_name='blog',
+            name='status_message',
+            field=models.TextField(blank=True, default=''),
+        ),
+        migrations.RunPython(status_from_init, init_from_status),
+        migrations.RemoveIndex(
+            model_name='blog',
+            name='blogs_blog_pending_idx',
+        ),
+        migrations.RemoveField(
+            model_name='blog',
+            name='init',
+        ),
+        migrations.AddIndex(
+            model_name='blog',
+            index=models.Index(condition=models.Q(('status', 'pending')), fields=['id'], name='blogs_blog_pending_idx'),
+        ),
+        migrations.RunPython(create_trigger, notify_0003.drop_trigger),
+    ]
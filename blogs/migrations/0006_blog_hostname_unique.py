@@ -0,0 +1,30 @@
+# Generated by Django 4.2.16 on 2026-10-18 18:27
+
+from django.db import migrations, models
+
+
+def dedupe_hostnames(apps, schema_editor):
+    """Keeps the oldest blog on a duplicated hostname and prefixes the others with their id."""
+    Blog = apps.get_model('blogs', 'Blog')
+    duplicated = (Blog.objects.values('hostname').annotate(count=models.Count('id'))
+                  .filter(count__gt=1).values_list('hostname', flat=True))
+    for hostname in list(duplicated):
+        for blog in Blog.objects.filter(hostname=hostname).order_by('id')[1:]:
+            blog.hostname = f"{blog.id}-{hostname}"[:200]
+            blog.save(update_fields=['hostname'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blogs', '0005_blog_status'),
+    ]
+
+    operations = [
+        migrations.RunPython(dedupe_hostnames, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='blog',
+            name='hostname',
+            field=models.CharField(max_length=200, unique=True),
+        ),
+    ]
@@ -1,7 +1,79 @@
-from django.db import models
+from django.db import IntegrityError, models, transaction
+
+BLOG_DOMAIN = 'example.com'
+
+
+def blog_hostname(title: str) -> str:
+    """The hostname a blog is served on, derived from its title."""
+    return title.lower().replace(" ", "") + "." + BLOG_DOMAIN
+
 
 # Create your models here.
 class Blog(models.Model):
+
+    class Status(models.TextChoices):
+        # signed up, waiting for the operator
+        PENDING = 'pending'
+        # picked up by an operator replica
+        CLAIMED = 'claimed'
+        # Wordpress resource created, waiting for its deployments
+        PROVISIONING = 'provisioning'
+        # all the deployments of the blog are available
+        READY = 'ready'
+        # the Wordpress resource could not be created (see status_message)
+        FAILED = 'failed'
+
     title = models.CharField(max_length=200)
-    hostname = models.CharField(max_length=200)
-    init= models.BooleanField(default=False)
+    hostname = models.CharField(max_length=200, unique=True)
+    status = models.CharField(max_length=20, choices=Status.choices, default=Status.PENDING, db_index=True)
+    status_message = models.TextField(blank=True, default='')
+    created_at = models.DateTimeField(auto_now_add=True)
+    claimed_at = models.DateTimeField(null=True, blank=True)
+    provisioning_at = models.DateTimeField(null=True, blank=True)
+    ready_at = models.DateTimeField(null=True, blank=True)
+    failed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # the operator's work queue: pending blogs claimed in id order
+            models.Index(fields=['id'], condition=models.Q(status='pending'), name='blogs_blog_pending_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.title} ({self.status})"
+
+
+def valid_blog(title: str, hostname: str) -> bool:
+    """Whether a blog's title and hostname fit their columns."""
+    return (0 < len(title) <= Blog._meta.get_field('title').max_length
+            and len(hostname) <= Blog._meta.get_field('hostname').max_length)
+
+
+# inserts retried after hostnames were taken by concurrent signups
+CREATE_RETRIES = 3
+
+
+def _taken(hostnames) -> set:
+    return set(Blog.objects.filter(hostname__in=list(hostnames)).values_list('hostname', flat=True))
+
+
+def create_blogs(blogs: dict, batch_size: int = 1000) -> tuple:
+    """Creates the blogs ``{hostname: title}`` whose hostname is free.
+
+    Returns the hostnames created and the ones taken, also by blogs signed up concurrently:
+    the insert is retried without them, up to ``CREATE_RETRIES`` times. An IntegrityError
+    with no hostname taken since (another constraint) is raised.
+    """
+    taken = _taken(blogs)
+    for attempt in range(CREATE_RETRIES + 1):
+        new_blogs = [Blog(title=title, hostname=hostname) for hostname, title in blogs.items() if hostname not in taken]
+        try:
+            with transaction.atomic():
+                Blog.objects.bulk_create(new_blogs, batch_size=batch_size)
+        except IntegrityError:
+            taken_since = _taken(blogs)
+            if taken_since == taken or attempt == CREATE_RETRIES:
+                raise
+            taken = taken_since
+            continue
+        return [blog.hostname for blog in new_blogs], taken
@@ -1,3 +1,151 @@
-from django.test import TestCase
+import contextlib
+import json
+import os
+import tempfile
+from io import StringIO
+from types import SimpleNamespace
+from unittest import mock
 
-# Create your tests here.
+from django.core.management import CommandError, call_command
+from django.db import IntegrityError, connection, transaction
+from django.db.migrations.executor import MigrationExecutor
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+
+from blogs.models import Blog, blog_hostname, create_blogs
+
+
+class SignupTests(TestCase):
+
+    def test_signup_creates_pending_blog(self):
+        response = self.client.post(reverse('signup'), {'blog_name': 'My Blog'})
+        self.assertRedirects(response, reverse('signup_success'))
+        blog = Blog.objects.get()
+        self.assertEqual((blog.hostname, blog.status), ('myblog.example.com', Blog.Status.PENDING))
+
+    def test_signup_rejects_taken_hostname(self):
+        Blog.objects.create(title='My Blog', hostname='myblog.example.com')
+        response = self.client.post(reverse('signup'), {'blog_name': 'my blog'})
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'myblog.example.com is already taken.')
+        self.assertEqual(Blog.objects.count(), 1)
+
+
+class LandingPageTests(TestCase):
+
+    def test_etag_not_modified(self):
+        response = self.client.get('/')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.has_header('ETag'))
+        response = self.client.get('/', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+
+@override_settings(BLOG_BULK_SIGNUP_TOKEN='secret')
+class BulkSignupTests(TestCase):
+
+    def post(self, body, token='secret'):
+        headers = {'HTTP_AUTHORIZATION': f"Bearer {token}"} if token else {}
+        return self.client.post(reverse('bulk_signup'), json.dumps(body), content_type='application/json', **headers)
+
+    def test_requires_token(self):
+        self.assertEqual(self.post({'blogs': []}, token=None).status_code, 403)
+        self.assertEqual(self.post({'blogs': []}, token='wrong').status_code, 403)
+
+    @override_settings(BLOG_BULK_SIGNUP_TOKEN='')
+    def test_disabled_without_token(self):
+        self.assertEqual(self.post({'blogs': []}, token='').status_code, 403)
+
+    def test_rejects_malformed_body(self):
+        for body in ({}, {'blogs': [{'name': 'a'}]}, {'blogs': [{'blog_name': 1}]}, {'blogs': 'a'}):
+            self.assertEqual(self.post(body).status_code, 400, body)
+
+    def test_reports_taken_and_invalid(self):
+        Blog.objects.create(title='Taken', hostname='taken.example.com')
+        long_name = 'x' * 195  # fits the title, not the hostname
+        response = self.post({'blogs': [{'blog_name': 'New One'}, {'blog_name': 'new one'}, {'blog_name': 'Taken'},
+                                        {'blog_name': ' '}, {'blog_name': long_name}]})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json(), {'created': 1, 'taken': ['taken.example.com'], 'invalid': ['', long_name]})
+        self.assertEqual(set(Blog.objects.values_list('hostname', flat=True)),
+                         {'taken.example.com', 'newone.example.com'})
+
+
+class CreateBlogsTests(TestCase):
+
+    def test_counts_only_created(self):
+        Blog.objects.create(title='A', hostname='a.example.com')
+        created, taken = create_blogs({'a.example.com': 'A', 'b.example.com': 'B'})
+        self.assertEqual((created, taken), (['b.example.com'], {'a.example.com'}))
+
+    def racing_signups(self, *hostnames):
+        """A ``transaction`` whose atomic blocks each start after a concurrent signup of the next hostname."""
+        pending = list(hostnames)
+
+        @contextlib.contextmanager
+        def atomic():
+            if pending:
+                hostname = pending.pop(0)
+                Blog.objects.create(title=hostname, hostname=hostname)
+            with transaction.atomic():
+                yield
+        return mock.patch('blogs.models.transaction', SimpleNamespace(atomic=atomic))
+
+    def test_retries_without_hostnames_taken_since(self):
+        with self.racing_signups('b.example.com'):
+            created, taken = create_blogs({'a.example.com': 'A', 'b.example.com': 'B'})
+        self.assertEqual((created, taken), (['a.example.com'], {'b.example.com'}))
+        self.assertEqual(Blog.objects.get(hostname='a.example.com').title, 'A')
+
+    def test_bounded_retries(self):
+        blogs = {f"{c}.example.com": c for c in 'abcdef'}
+        with self.racing_signups(*blogs), self.assertRaises(IntegrityError):
+            create_blogs(blogs)
+
+    def test_other_integrity_errors_raised(self):
+        with self.assertRaises(IntegrityError):
+            create_blogs({'a.example.com': None})
+
+
+class ImportBlogsTests(TestCase):
+
+    def import_csv(self, content, *args):
+        with tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False, encoding='utf-8') as f:
+            f.write(content)
+        self.addCleanup(os.remove, f.name)
+        out = StringIO()
+        call_command('import_blogs', f.name, *args, stdout=out)
+        return out.getvalue()
+
+    def test_skips_invalid_rows(self):
+        Blog.objects.create(title='Taken', hostname='taken.example.com')
+        rows = ['title,hostname', 'First,', 'Second,second.example.net', ',empty.example.com', 'First,',
+                'Taken,', f"{'x' * 195},", f"Custom,{'h' * 201}", 'Last,']
+        out = self.import_csv('\n'.join(rows) + '\n', '--chunk-size', '2')
+        self.assertIn('Imported 3 blogs (5 skipped)', out)
+        self.assertEqual(set(Blog.objects.values_list('hostname', flat=True)),
+                         {'taken.example.com', 'first.example.com', 'second.example.net', blog_hostname('Last')})
+
+    def test_requires_title_column(self):
+        with self.assertRaisesMessage(CommandError, "needs a 'title' column"):
+            self.import_csv('name\nA\n')
+
+
+class StatusMigrationTests(TransactionTestCase):
+
+    def migrate(self, target):
+        executor = MigrationExecutor(connection)
+        executor.migrate([('blogs', target)])
+        return executor.loader.project_state([('blogs', target)]).apps.get_model('blogs', 'Blog')
+
+    def tearDown(self):
+        self.migrate('0006_blog_hostname_unique')
+
+    def test_initialized_blogs_become_ready(self):
+        Blog = self.migrate('0004_blog_pending_idx')
+        Blog.objects.create(title='Old', hostname='old.example.com', init=True)
+        Blog.objects.create(title='New', hostname='new.example.com', init=False)
+        Blog = self.migrate('0005_blog_status')
+        self.assertEqual(dict(Blog.objects.values_list('hostname', 'status')),
+                         {'old.example.com': 'ready', 'new.example.com': 'pending'})
+        self.assertIsNotNone(Blog.objects.get(hostname='old.example.com').ready_at)
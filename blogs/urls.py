@@ -5,5 +5,6 @@ urlpatterns = [
     # ... other URL patterns ...
     path('signup/', views.signup, name='signup'),
     path('signup/success/', views.signup_success, name='signup_success'),
+    path('api/bulk-signup/', views.bulk_signup, name='bulk_signup'),
     path('', views.landing_page, name='landing_page'),
 ]
\ No newline at end of file
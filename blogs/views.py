@@ -1,27 +1,83 @@
+import json
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import IntegrityError
+from django.http import HttpResponseNotAllowed, JsonResponse
 from django.shortcuts import render, redirect
+from django.views.decorators.cache import cache_page
 
-from blogs.models import Blog
+from blogs.models import Blog, blog_hostname, create_blogs, valid_blog
 from .forms import SignupForm
 
-def signup(request):
+# Maximum number of blogs accepted by one bulk signup request
+BULK_SIGNUP_LIMIT = 10000
+
+
+async def signup(request):
     if request.method == 'POST':
         form = SignupForm(request.POST)
         if form.is_valid():
-            # Process the form data (e.g., save to database)
             blog_name = form.cleaned_data['blog_name']
-            # ... your logic here ...
-            blog = Blog(title=blog_name, hostname=blog_name.lower().replace(" ", "") + ".example.com") 
-            blog.save()
-            return render(request, 'blogs/signup_success.html', {'blog_hostname': blog.hostname})
+            hostname = blog_hostname(blog_name)
+            if await Blog.objects.filter(hostname=hostname).aexists():
+                form.add_error('blog_name', f"{hostname} is already taken.")
+            else:
+                try:
+                    blog = await Blog.objects.acreate(title=blog_name, hostname=hostname)
+                except IntegrityError:  # signed up concurrently
+                    form.add_error('blog_name', f"{hostname} is already taken.")
+                else:
+                    await sync_to_async(request.session.__setitem__)('blog_hostname', blog.hostname)
+                    return redirect('signup_success')
 
     else:
         form = SignupForm()
     return render(request, 'blogs/signup.html', {'form': form})
 
-def signup_success(request):
+async def signup_success(request):
     """Renders a success page after signup, including a link to the blog's hostname."""
-    blog_hostname = request.session.get('blog_hostname', None)  # Retrieve from session
+    blog_hostname = await sync_to_async(request.session.get)('blog_hostname', None)  # Retrieve from session
     return render(request, 'blogs/signup_success.html', {'blog_hostname': blog_hostname})
 
+# static page: the whole response is cached, ConditionalGetMiddleware answers If-None-Match with 304
+@cache_page(60 * 15)
 def landing_page(request):
-    return render(request, 'blogs/landing.html')
\ No newline at end of file
+    return render(request, 'blogs/landing.html')
+
+
+async def bulk_signup(request):
+    """Signs up a batch of blogs from a JSON body ``{"blogs": [{"blog_name": ...}, ...]}``.
+
+    Requires ``Authorization: Bearer <BLOG_BULK_SIGNUP_TOKEN>``. Blogs whose hostname is
+    already taken, or whose name or hostname is too long, are skipped and reported back.
+    """
+    if request.method != 'POST':
+        return HttpResponseNotAllowed(['POST'])
+    token = getattr(settings, 'BLOG_BULK_SIGNUP_TOKEN', '')
+    if not token or request.headers.get('Authorization') != f"Bearer {token}":
+        return JsonResponse({'error': 'forbidden'}, status=403)
+    try:
+        entries = json.loads(request.body)['blogs']
+        names = [entry['blog_name'].strip() for entry in entries]
+    except (ValueError, KeyError, TypeError, AttributeError):
+        return JsonResponse({'error': 'expected {"blogs": [{"blog_name": ...}, ...]}'}, status=400)
+    if len(names) > BULK_SIGNUP_LIMIT:
+        return JsonResponse({'error': f"at most {BULK_SIGNUP_LIMIT} blogs per request"}, status=400)
+
+    blogs, invalid = {}, []
+    for name in names:
+        hostname = blog_hostname(name)
+        if valid_blog(name, hostname):
+            blogs.setdefault(hostname, name)
+        else:
+            invalid.append(name)
+    created, taken = await sync_to_async(create_blogs)(blogs)
+    return JsonResponse({
+        'created': len(created),
+        'taken': sorted(taken),
+        'invalid': invalid,
+    }, status=201)
+
+# token-authenticated API; Django 4.2's csrf_exempt decorator does not support async views
+bulk_signup.csrf_exempt = True
@@ -0,0 +1,453 @@
+"""Load test of the operator against the stand-in API server of ``fake_apiserver.py``.
+
+Starts the fake API server, runs ``wordpress_operator.py`` under kopf in a subprocess
+pointed to it, submits ``--crs`` Wordpress resources (like ``test/blog.yaml``) and, with
+a PostgreSQL database migrated by the blog platform, inserts ``--blogs`` pending
+``blogs_blog`` rows. It waits until every Wordpress resource is Ready, then reports the
+throughput, the p50/p99 times to create each Wordpress resource and each sub-resource,
+the operator's event-loop lag and peak memory, and appends the results to ``--output``,
+compared with the last run with the same parameters. With ``--replicas`` several operators
+share the resources (see ``sharding.py``), and with ``--warm-pool`` the blogs are signed up
+once the operator's warm pool is Ready (see ``warm_pool.py``).
+
+    python benchmark.py --crs 200 --latency 0.02 --throttle 0.01 --conflict 0.01
+    python benchmark.py --crs 300 --replicas 3
+    python benchmark.py --crs 0 --blogs 200 --db-host localhost --db-name blogp --db-user blogp --db-password ...
+    python benchmark.py --crs 0 --blogs 20 --warm-pool 20 --db-host localhost ... --ready-delay 30
+"""
+import argparse
+import asyncio
+import base64
+import datetime
+import json
+import os
+import pathlib
+import resource
+import signal
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+
+import yaml
+
+import rendering
+from fake_apiserver import FakeApiServer
+
+HERE = pathlib.Path(__file__).parent
+WORDPRESS = ('gdgitalia.dev', 'v1', 'wordpress')
+SECRETS = ('', 'v1', 'secrets')
+LEASES = ('coordination.k8s.io', 'v1', 'leases')
+# interval of the event-loop lag probe in the operator process, in seconds
+LAG_INTERVAL = 0.05
+# seconds without API calls after which restarted operators are deemed resynced
+RESYNC_QUIET = 3.0
+STARTUP_PHASES = ('import', 'startup', 'resync')
+
+
+def summary(values) -> dict:
+    """Count, p50, p99 and max of a list of durations in seconds."""
+    values = sorted(values)
+    if not values:
+        return {'count': 0}
+    if len(values) == 1:
+        quantiles = values * 99
+    else:
+        quantiles = statistics.quantiles(values, n=100, method='inclusive')
+    return {'count': len(values), 'p50': round(quantiles[49], 4), 'p99': round(quantiles[98], 4),
+            'max': round(values[-1], 4)}
+
+
+def write_kubeconfig(path: pathlib.Path, server: str):
+    path.write_text(yaml.safe_dump({
+        'apiVersion': 'v1', 'kind': 'Config', 'current-context': 'fake',
+        'clusters': [{'name': 'fake', 'cluster': {'server': server}}],
+        'users': [{'name': 'fake', 'user': {'token': 'fake'}}],
+        'contexts': [{'name': 'fake', 'context': {'cluster': 'fake', 'user': 'fake', 'namespace': 'default'}}],
+    }))
+
+
+def run_operator(stats_path: str):
+    """Runs the operator until SIGINT/SIGTERM, then writes its event-loop lag and peak memory."""
+    import kopf
+    import prometheus_client
+    import wordpress_operator  # noqa: F401 (registers the handlers)
+
+    kopf.configure(quiet=True)
+    lags = []
+
+    async def probe():
+        loop = asyncio.get_running_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(LAG_INTERVAL)
+            lags.append(loop.time() - start - LAG_INTERVAL)
+
+    async def operate():
+        task = asyncio.create_task(probe())
+        try:
+            await kopf.operator(standalone=True, clusterwide=True)
+        finally:
+            task.cancel()
+
+    asyncio.run(operate())
+    pathlib.Path(stats_path).write_text(json.dumps({
+        'loop_lag': summary(lags),
+        'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        'startup': {phase: prometheus_client.REGISTRY.get_sample_value('wordpress_operator_startup_seconds',
+                                                                       {'phase': phase})
+                    for phase in STARTUP_PHASES},
+        'resumed': {outcome: prometheus_client.REGISTRY.get_sample_value('wordpress_operator_resumed_total',
+                                                                         {'outcome': outcome}) or 0
+                    for outcome in ('converged', 'reconciled')},
+    }))
+
+
+def wordpress_body(name: str, namespace: str) -> dict:
+    return {
+        'apiVersion': 'gdgitalia.dev/v1', 'kind': 'Wordpress',
+        'metadata': {'name': name, 'namespace': namespace},
+        'spec': {'name': name, 'hostname': f"{name}.example.com", 'wp_size': '2Gi', 'mysql_size': '2Gi'},
+    }
+
+
+class Tracker:
+    """Records when each Wordpress resource and each of its sub-resources appear in the fake API."""
+
+    def __init__(self, server: FakeApiServer):
+        self.server = server
+        self.submitted = {}  # Wordpress name -> monotonic time it was submitted (or its blog signed up)
+        self.blogs = set()   # the Wordpress names created for a blogs_blog row
+        self.ready = {}      # Wordpress name -> monotonic time its phase became Ready
+        self.all_ready = asyncio.Event()
+        server.listeners.append(self.on_change)
+
+    def on_change(self, plural, event_type, obj):
+        name = obj['metadata']['name']
+        if plural == 'wordpress' and name not in self.submitted:
+            name = (obj.get('spec') or {}).get('name')  # a warm pool instance, claimed by a blog
+        if plural != 'wordpress' or name in self.ready or name not in self.submitted:
+            return
+        if (obj.get('status') or {}).get('phase') == 'Ready':
+            self.ready[name] = time.monotonic()
+            if len(self.ready) == len(self.submitted):
+                self.all_ready.set()
+
+    def results(self, namespace: str) -> dict:
+        created = self.server.created
+        children = {}
+        reconciled = []
+        for (_, _, plural), objects in self.server.objects.items():
+            for obj in objects.values():
+                owner = next((ref['name'] for ref in obj['metadata'].get('ownerReferences', [])
+                              if ref.get('kind') == 'Wordpress'), None)
+                if owner in self.submitted and obj['metadata'].get('namespace') == namespace:
+                    base = created[('wordpress', namespace, owner)]
+                    children.setdefault(owner, {})[plural] = created[(plural, namespace, obj['metadata']['name'])] - base
+        per_kind = {}
+        for owner, times in children.items():
+            reconciled.append(max(times.values()) + created[('wordpress', namespace, owner)] - self.submitted[owner])
+            for plural, seconds in times.items():
+                per_kind.setdefault(plural, []).append(seconds)
+        ready = [self.ready[name] - self.submitted[name] for name in self.ready]
+        start = min(self.submitted.values(), default=0)
+        elapsed = max(self.ready.values(), default=start) - start
+        return {
+            'ready': len(self.ready),
+            'submitted': len(self.submitted),
+            'elapsed': round(elapsed, 3),
+            'throughput': round(len(self.ready) / elapsed, 2) if elapsed else 0,
+            'blog_to_wordpress': summary([created[('wordpress', namespace, name)] - self.submitted[name]
+                                          for name in self.blogs if ('wordpress', namespace, name) in created]),
+            'wordpress_reconciled': summary(reconciled),
+            'wordpress_ready': summary(ready),
+            'children': {plural: summary(times) for plural, times in sorted(per_kind.items())},
+        }
+
+
+async def insert_blogs(args, names, tracker: Tracker, namespace: str, server: FakeApiServer):
+    """Creates the credentials Secret, waits for the operator to LISTEN (and its warm pool), then signs up the blogs."""
+    import psycopg2
+
+    credentials = dict(host=args.db_host, port=args.db_port, dbname=args.db_name,
+                       user=args.db_user, password=args.db_password)
+    data = {'DB_HOST': args.db_host, 'DB_PORT': str(args.db_port), 'DB_NAME': args.db_name,
+            'DB_USER': args.db_user, 'DB_PASSWORD': args.db_password}
+    server.create(SECRETS, namespace, {'metadata': {
+        'name': 'benchmark-blog-platform', 'annotations': {'blog-platform-credentials': 'true'},
+    }, 'data': {key: base64.b64encode(value.encode()).decode() for key, value in data.items()}})
+
+    conn = await asyncio.to_thread(psycopg2.connect, **credentials)
+    try:
+        with conn.cursor() as cur:
+            for _ in range(int(args.timeout / 0.1)):
+                cur.execute("SELECT count(*) FROM pg_stat_activity WHERE query LIKE 'LISTEN blog_pending%%';")
+                conn.commit()
+                if cur.fetchone()[0]:
+                    break
+                await asyncio.sleep(0.1)
+            else:
+                raise RuntimeError("the operator is not listening for blogs")
+            if args.warm_pool:
+                await wait_warm_pool(args, server)
+            cur.execute("INSERT INTO blogs_blog (title, hostname, status, status_message, created_at) "
+                        "SELECT title, title || '.example.com', 'pending', '', now() FROM unnest(%s::text[]) AS title "
+                        "RETURNING id, hostname;", (names,))
+            rows = cur.fetchall()
+            signed_up = time.monotonic()
+            await asyncio.to_thread(conn.commit)
+        for blog_id, hostname in rows:
+            name = rendering.blog_resource_name(hostname, blog_id)
+            tracker.submitted[name] = signed_up
+            tracker.blogs.add(name)
+    finally:
+        conn.close()
+
+
+async def blogs_live(args, names) -> list:
+    """Waits until the operator reported the blogs ready, and returns their signup -> ready times."""
+    import psycopg2
+
+    conn = await asyncio.to_thread(psycopg2.connect, host=args.db_host, port=args.db_port, dbname=args.db_name,
+                                   user=args.db_user, password=args.db_password)
+    try:
+        with conn.cursor() as cur:
+            for _ in range(int(args.timeout / 0.1)):
+                cur.execute("SELECT extract(epoch from ready_at - created_at) FROM blogs_blog "
+                            "WHERE title = ANY(%s) AND status = 'ready';", (names,))
+                conn.commit()
+                live = [float(seconds) for seconds, in cur.fetchall()]
+                if len(live) == len(names):
+                    break
+                await asyncio.sleep(0.1)
+            return live
+    finally:
+        conn.close()
+
+
+async def wait_warm_pool(args, server: FakeApiServer):
+    """Waits until the operator's warm pool has ``--warm-pool`` Ready instances."""
+    for _ in range(int(args.timeout / 0.1)):
+        ready = [obj for obj in server.objects.get(WORDPRESS, {}).values()
+                 if obj['metadata'].get('labels', {}).get('gdgitalia.dev/warm-pool') == 'idle'
+                 and (obj.get('status') or {}).get('phase') == 'Ready']
+        if len(ready) >= args.warm_pool:
+            return
+        await asyncio.sleep(0.1)
+    raise RuntimeError("the warm pool is not Ready")
+
+
+async def start_operators(args, server: FakeApiServer, env: dict, stats_paths) -> list:
+    """Starts the operator replicas, and waits until they watch the Wordpress resources (and hold their Lease)."""
+    watches = server.requests.get(('watch', 'wordpress', 200), 0)
+    operators = [await asyncio.create_subprocess_exec(
+        sys.executable, str(HERE / 'benchmark.py'), '--run-operator', str(stats_path), cwd=HERE,
+        env=dict(env, WORDPRESS_SHARD_ID=f"bench-{i}")) for i, stats_path in enumerate(stats_paths)]
+    for _ in range(int(args.timeout / 0.1)):
+        if (server.requests.get(('watch', 'wordpress', 200), 0) >= watches + args.replicas and
+                (args.replicas == 1 or len(server.objects.get(LEASES, {})) >= args.replicas)):
+            break
+        await asyncio.sleep(0.1)
+    return operators
+
+
+async def wait_resynced(args, server: FakeApiServer, started: float) -> dict:
+    """Waits until restarted operators stop calling the API server, and reports what they called.
+
+    Returns the seconds from the restart to their last call (the Leases aside) and the calls.
+    """
+    before = dict(server.requests)
+
+    def calls():
+        return {key: count - before.get(key, 0) for key, count in server.requests.items()
+                if key[0] != 'watch' and key[1] not in ('leases', 'events') and count > before.get(key, 0)}
+
+    last, last_call = calls(), time.monotonic()
+    while time.monotonic() - last_call < RESYNC_QUIET and time.monotonic() - started < args.timeout:
+        await asyncio.sleep(0.05)
+        current = calls()
+        if current != last:
+            last, last_call = current, time.monotonic()
+    return {'seconds': round(last_call - started, 3), 'api_requests': sum(last.values()),
+            'calls': {f"{verb} {plural} {status}": count for (verb, plural, status), count in sorted(last.items())}}
+
+
+async def stop_operators(operators):
+    for operator in operators:
+        if operator.returncode is None:
+            operator.send_signal(signal.SIGINT)
+    for operator in operators:
+        try:
+            await asyncio.wait_for(operator.wait(), 30)
+        except asyncio.TimeoutError:
+            operator.kill()
+
+
+async def benchmark(args) -> dict:
+    server = FakeApiServer(latency=args.latency, jitter=args.jitter, throttle=args.throttle,
+                           retry_after=args.retry_after, conflict=args.conflict, ready_delay=args.ready_delay)
+    url = await server.start()
+    tracker = Tracker(server)
+    run_id = uuid.uuid4().hex[:6]
+    workdir = pathlib.Path(tempfile.mkdtemp(prefix='wordpress-benchmark-'))
+    write_kubeconfig(workdir / 'kubeconfig', url)
+    stats_paths = [workdir / f"operator-{i}.json" for i in range(args.replicas)]
+    restart_paths = [path.with_suffix('.restart.json') for path in stats_paths]
+
+    env = dict(os.environ, KUBECONFIG=str(workdir / 'kubeconfig'), METRICS_PORT='0',
+               WORDPRESS_RESYNC_INTERVAL=str(args.resync))
+    if args.replicas > 1:
+        env.update(WORDPRESS_SHARDING='true', WORDPRESS_SHARD_LEASE=str(args.shard_lease))
+    if args.warm_pool:
+        env.update(WARM_POOL_SIZE=str(args.warm_pool), WARM_POOL_INTERVAL='1')
+    operators = await start_operators(args, server, env, stats_paths)
+    restart = None
+    live = []
+    try:
+        if args.blogs:
+            names = [f"bench-{run_id}-blog-{i}" for i in range(args.blogs)]
+            await insert_blogs(args, names, tracker, args.namespace, server)
+        for i in range(args.crs):
+            name = f"bench-{run_id}-{i}"
+            tracker.submitted[name] = time.monotonic()
+            server.create(WORDPRESS, args.namespace, wordpress_body(name, args.namespace))
+            if args.rate:
+                await asyncio.sleep(1 / args.rate)
+
+        try:
+            await asyncio.wait_for(tracker.all_ready.wait(), args.timeout)
+        except asyncio.TimeoutError:
+            print(f"Timed out: {len(tracker.ready)} of {len(tracker.submitted)} Wordpress resources Ready",
+                  file=sys.stderr)
+        if args.blogs:
+            live = await blogs_live(args, names)
+        if args.restart and len(tracker.ready) == len(tracker.submitted):
+            await stop_operators(operators)
+            started = time.monotonic()
+            operators = await start_operators(args, server, env, restart_paths)
+            restart = await wait_resynced(args, server, started)
+    finally:
+        await stop_operators(operators)
+        await server.stop()
+
+    results = tracker.results(args.namespace)
+    results['blog_live'] = summary(live)
+    stats = [json.loads(path.read_text()) for path in stats_paths if path.exists()]
+    if stats:
+        # the worst event-loop lag of the replicas, and the memory of them all
+        results['loop_lag'] = {key: max(s['loop_lag'][key] for s in stats) for key in stats[0]['loop_lag']}
+        results['peak_rss_mb'] = round(sum(s['peak_rss_mb'] for s in stats), 1)
+    if restart is not None:
+        # the slowest replica, and the resources resumed by them all
+        stats = [json.loads(path.read_text()) for path in restart_paths if path.exists()]
+        restart['startup'] = {phase: max((s['startup'][phase] or 0 for s in stats), default=0)
+                              for phase in STARTUP_PHASES}
+        restart['resumed'] = {outcome: sum(s['resumed'][outcome] for s in stats)
+                              for outcome in ('converged', 'reconciled')}
+        results['restart'] = restart
+    results['api_requests'] = sum(server.requests.values())
+    results['api_throttled'] = sum(count for (_, _, status), count in server.requests.items() if status == 429)
+    results['api_conflicts'] = sum(count for (_, _, status), count in server.requests.items() if status == 409)
+    return results
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=HERE, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def report(results: dict):
+    print(f"{results['ready']}/{results['submitted']} Wordpress resources Ready in {results['elapsed']:.2f}s: "
+          f"{results['throughput']:.2f}/s")
+    rows = [('blog signup -> Wordpress', results['blog_to_wordpress']),
+            ('blog signup -> live', results.get('blog_live', {'count': 0})),
+            ('Wordpress -> all sub-resources', results['wordpress_reconciled']),
+            ('Wordpress -> Ready', results['wordpress_ready'])]
+    rows += [(f"  {plural}", times) for plural, times in results['children'].items()]
+    rows += [('event-loop lag', results.get('loop_lag', {'count': 0}))]
+    print(f"{'':32} {'count':>6} {'p50':>9} {'p99':>9} {'max':>9}")
+    for label, times in rows:
+        if times['count']:
+            print(f"{label:32} {times['count']:6} {times['p50']:9.4f} {times['p99']:9.4f} {times['max']:9.4f}")
+    print(f"peak memory: {results.get('peak_rss_mb', '?')} MB; API requests: {results['api_requests']} "
+          f"({results['api_throttled']} throttled, {results['api_conflicts']} conflicts)")
+    restart = results.get('restart')
+    if restart:
+        startup = restart['startup']
+        print(f"restart: loaded in {startup['import']:.2f}s, started in {startup['startup']:.2f}s, "
+              f"resumed {restart['resumed']['converged']:.0f} converged and {restart['resumed']['reconciled']:.0f} "
+              f"other Wordpress resources in {startup['resync']:.2f}s; "
+              f"API calls until {restart['seconds']:.2f}s: {restart['api_requests']}")
+        for call, count in restart['calls'].items():
+            print(f"  {call:30} {count:6}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--run-operator', metavar='STATS', help=argparse.SUPPRESS)
+    parser.add_argument('--crs', type=int, default=100, help="Wordpress resources to submit")
+    parser.add_argument('--rate', type=float, default=0, help="Wordpress resources submitted per second (0: all at once)")
+    parser.add_argument('--namespace', default='default')
+    parser.add_argument('--latency', type=float, default=0.01, help="mean delay of each API request, in seconds")
+    parser.add_argument('--jitter', type=float, default=0.5, help="relative spread of the delay")
+    parser.add_argument('--throttle', type=float, default=0.0, help="ratio of the API requests answered with 429")
+    parser.add_argument('--retry-after', type=int, default=1, help="Retry-After of the 429 responses, in seconds")
+    parser.add_argument('--conflict', type=float, default=0.0, help="ratio of the creations answered with 409")
+    parser.add_argument('--ready-delay', type=float, default=0.5, help="seconds until a Deployment is available")
+    parser.add_argument('--replicas', type=int, default=1, help="operator replicas, sharding the resources when more than 1")
+    parser.add_argument('--shard-lease', type=int, default=15, help="seconds of the replicas' Leases")
+    parser.add_argument('--warm-pool', type=int, default=0, help="idle instances of the warm pool, Ready before the blogs sign up")
+    parser.add_argument('--restart', action='store_true',
+                        help="then restart the operator and measure its startup and resync")
+    parser.add_argument('--resync', type=float, default=30,
+                        help="seconds before an unreconciled Wordpress resource is resynced (WORDPRESS_RESYNC_INTERVAL)")
+    parser.add_argument('--timeout', type=float, default=300, help="seconds to wait for every Wordpress to be Ready")
+    parser.add_argument('--blogs', type=int, default=0, help="pending blogs_blog rows to insert (needs --db-*)")
+    parser.add_argument('--db-host', default='localhost')
+    parser.add_argument('--db-port', type=int, default=5432)
+    parser.add_argument('--db-name', default='blogp')
+    parser.add_argument('--db-user', default='blogp')
+    parser.add_argument('--db-password', default='')
+    parser.add_argument('--output', default=str(HERE / 'benchmark-results.jsonl'),
+                        help="JSON lines file the results are appended to")
+    parser.add_argument('--max-regression', type=float, default=0.2,
+                        help="fail when the throughput drops by more than this ratio from the last comparable run")
+    args = parser.parse_args()
+    if args.run_operator:
+        run_operator(args.run_operator)
+        return
+
+    params = {key: getattr(args, key) for key in ('crs', 'rate', 'latency', 'jitter', 'throttle', 'retry_after',
+                                                   'conflict', 'ready_delay', 'blogs', 'replicas', 'restart',
+                                                   'warm_pool')}
+    results = asyncio.run(benchmark(args))
+    report(results)
+
+    output = pathlib.Path(args.output)
+    previous = None
+    if output.exists():
+        for line in output.read_text().splitlines():
+            record = json.loads(line)
+            if record['params'] == params:
+                previous = record
+    with output.open('a') as f:
+        f.write(json.dumps({'date': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+                            'revision': git_revision(), 'params': params, 'results': results}) + '\n')
+
+    if previous is not None and previous['results']['throughput']:
+        change = results['throughput'] / previous['results']['throughput'] - 1
+        print(f"throughput {change:+.1%} since {previous['revision'] or previous['date']} "
+              f"({previous['results']['throughput']:.2f}/s)")
+        if change < -args.max_regression:
+            sys.exit(1)
+    if results['ready'] < results['submitted']:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,131 @@
+"""Long-lived PostgreSQL connection pools for the blog platform credentials Secrets.
+
+The decoded credentials of each Secret are cached by its ``resourceVersion`` and
+one pool is kept per distinct set of credentials, so a timer tick reuses open
+connections instead of a new TCP + auth handshake. psycopg2 is blocking, so the
+statements run on worker threads and the pools are used through ``await``.
+"""
+import asyncio
+import contextlib
+import logging
+import os
+import threading
+import time
+
+import psycopg2.pool
+
+import metrics
+
+POOL_MIN = int(os.environ.get('BLOG_DB_POOL_MIN', '1'))
+POOL_MAX = int(os.environ.get('BLOG_DB_POOL_MAX', '4'))
+
+
+class _TimedConnectionPool(psycopg2.pool.ThreadedConnectionPool):
+    """Records the time of every new connection, including the ones opened after a disconnect."""
+
+    def _connect(self, key=None):
+        with metrics.POSTGRES_CONNECT_SECONDS.time():
+            return super()._connect(key)
+
+
+class Pool:
+    """A psycopg2 ``ThreadedConnectionPool`` used from the event loop."""
+
+    def __init__(self, credentials: dict):
+        self.credentials = credentials
+        self._pool = None
+        self._lock = threading.Lock()
+        self._slots = asyncio.Semaphore(POOL_MAX)
+        self._in_use = 0
+        self._retired = False
+
+    def _connect(self):
+        with self._lock:
+            if self._pool is None:
+                start = time.monotonic()
+                self._pool = _TimedConnectionPool(POOL_MIN, POOL_MAX, **self.credentials)
+                logging.info("Connected to PostgreSQL database %s in %.3fs",
+                             self.credentials['database'], time.monotonic() - start)
+        return self._pool.getconn()
+
+    @contextlib.asynccontextmanager
+    async def connection(self):
+        """Borrows a connection; the transaction is committed on exit, or rolled back on error."""
+        await self._slots.acquire()
+        self._in_use += 1
+        conn = None
+        try:
+            conn = await asyncio.to_thread(self._connect)
+            yield conn
+            await asyncio.to_thread(conn.commit)
+        except BaseException:
+            if conn is not None and not conn.closed:
+                await asyncio.to_thread(conn.rollback)
+            raise
+        finally:
+            self._in_use -= 1
+            if conn is not None:
+                self._pool.putconn(conn, close=bool(conn.closed))
+            self._slots.release()
+            if self._retired and not self._in_use:
+                self.close()
+
+    async def run(self, fn, *args):
+        """Runs ``fn(cursor, *args)`` in one transaction on a worker thread and returns its result."""
+        async with self.connection() as conn:
+            def run_in_cursor():
+                with conn.cursor() as cur:
+                    return fn(cur, *args)
+            return await asyncio.to_thread(run_in_cursor)
+
+    def retire(self):
+        """Closes the pool as soon as no connection is borrowed anymore."""
+        self._retired = True
+        if not self._in_use:
+            self.close()
+
+    def close(self):
+        if self._pool is not None and not self._pool.closed:
+            self._pool.closeall()
+
+
+# (namespace, name) -> (resourceVersion, credentials key) of each credentials Secret
+_secrets = {}
+# credentials key -> Pool
+_pools = {}
+
+
+def _release(key):
+    if key not in (k for _, k in _secrets.values()):
+        pool = _pools.pop(key, None)
+        if pool is not None:
+            pool.retire()
+
+
+def get_pool(namespace: str, name: str, resource_version: str, data, read_credentials) -> Pool:
+    """Returns the pool of a credentials Secret, decoding ``data`` only when the Secret changed."""
+    cached = _secrets.get((namespace, name))
+    if cached is not None and cached[0] == resource_version:
+        return _pools[cached[1]]
+    credentials = read_credentials(data)
+    key = tuple(sorted(credentials.items()))
+    _secrets[(namespace, name)] = (resource_version, key)
+    if key not in _pools:
+        _pools[key] = Pool(credentials)
+    if cached is not None and cached[1] != key:
+        _release(cached[1])
+    return _pools[key]
+
+
+def forget(namespace: str, name: str):
+    """Drops a deleted credentials Secret, closing its pool if no other Secret uses it."""
+    cached = _secrets.pop((namespace, name), None)
+    if cached is not None:
+        _release(cached[1])
+
+
+def close_all():
+    for pool in _pools.values():
+        pool.close()
+    _pools.clear()
+    _secrets.clear()
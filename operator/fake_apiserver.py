@@ -0,0 +1,474 @@
+"""A stand-in Kubernetes API server to load-test the operator without a cluster.
+
+The objects are kept in memory and the server speaks the part of the REST API used by
+kopf and the operator: discovery, list and watch, get, create, replace, merge/JSON/apply
+patches and delete (one object, or a collection by label selector, honouring finalizers).
+Every request can be delayed (``latency``) and answered with a 429 (``throttle``); a
+creation can be answered with a 409 although the object was stored (``conflict``), as
+when the response to a first attempt is lost. The Deployments become available
+``ready_delay`` seconds after each change, as if their pods started, and the Jobs and
+VolumeSnapshots complete ``ready_delay`` seconds after their creation.
+
+Run ``python fake_apiserver.py --port 8001 --latency 0.02`` to serve it on its own
+(``kubectl --server http://localhost:8001 get wordpress``).
+"""
+import argparse
+import asyncio
+import bisect
+import copy
+import datetime
+import json
+import pathlib
+import random
+import time
+import uuid
+
+import yaml
+from aiohttp import web
+
+CRDS = pathlib.Path(__file__).parent / 'crds'
+
+# (group, version) -> {plural: (kind, namespaced)} of the built-in resources served
+RESOURCES = {
+    ('', 'v1'): {
+        'configmaps': ('ConfigMap', True),
+        'events': ('Event', True),
+        'namespaces': ('Namespace', False),
+        'persistentvolumeclaims': ('PersistentVolumeClaim', True),
+        'secrets': ('Secret', True),
+        'services': ('Service', True),
+    },
+    ('apps', 'v1'): {'deployments': ('Deployment', True)},
+    ('batch', 'v1'): {'jobs': ('Job', True)},
+    ('autoscaling', 'v2'): {'horizontalpodautoscalers': ('HorizontalPodAutoscaler', True)},
+    ('coordination.k8s.io', 'v1'): {'leases': ('Lease', True)},
+    ('networking.k8s.io', 'v1'): {'ingresses': ('Ingress', True)},
+    ('snapshot.storage.k8s.io', 'v1'): {'volumesnapshots': ('VolumeSnapshot', True)},
+    ('apiextensions.k8s.io', 'v1'): {'customresourcedefinitions': ('CustomResourceDefinition', False)},
+}
+
+VERBS = ['create', 'delete', 'deletecollection', 'get', 'list', 'patch', 'update', 'watch']
+
+
+class ApiError(Exception):
+    def __init__(self, code: int, reason: str, message: str):
+        super().__init__(message)
+        self.code, self.reason, self.message = code, reason, message
+
+    def response(self, headers=None):
+        return web.json_response({
+            'kind': 'Status', 'apiVersion': 'v1', 'metadata': {}, 'status': 'Failure',
+            'reason': self.reason, 'message': self.message, 'code': self.code,
+        }, status=self.code, headers=headers)
+
+
+def group_version(group: str, version: str) -> str:
+    return f"{group}/{version}" if group else version
+
+
+def merge_patch(target, patch):
+    """Applies an RFC 7386 merge patch, without modifying ``target``."""
+    if not isinstance(patch, dict):
+        return patch
+    result = dict(target) if isinstance(target, dict) else {}
+    for key, value in patch.items():
+        if value is None:
+            result.pop(key, None)
+        else:
+            result[key] = merge_patch(result.get(key), value)
+    return result
+
+
+def json_patch(target, operations):
+    """Applies an RFC 6902 JSON patch (add, replace, remove and test operations)."""
+    doc = copy.deepcopy(target)
+    try:
+        for op in operations:
+            *parents, last = [p.replace('~1', '/').replace('~0', '~') for p in op['path'].split('/')[1:]]
+            container = doc
+            for part in parents:
+                container = container[int(part)] if isinstance(container, list) else container[part]
+            if isinstance(container, list):
+                last = len(container) if last == '-' else int(last)
+            if op['op'] == 'test':
+                if container[last] != op['value']:
+                    raise ApiError(422, 'Invalid', f"test failed at {op['path']}")
+            elif op['op'] == 'remove':
+                del container[last]
+            elif op['op'] == 'add' and isinstance(container, list):
+                container.insert(last, op['value'])
+            elif op['op'] in ('add', 'replace'):
+                container[last] = op['value']
+            else:
+                raise ApiError(422, 'Invalid', f"unsupported operation {op['op']}")
+    except (KeyError, IndexError, ValueError, TypeError) as e:
+        raise ApiError(422, 'Invalid', f"invalid JSON patch: {e}")
+    return doc
+
+
+def matches(obj: dict, selector: str) -> bool:
+    """Whether the labels of an object match an equality-based label selector."""
+    labels = obj['metadata'].get('labels') or {}
+    for term in filter(None, (term.strip() for term in selector.split(','))):
+        if '!=' in term:
+            key, value = term.split('!=', 1)
+            if labels.get(key) == value:
+                return False
+        elif '=' in term:
+            key, _, value = term.partition('=')
+            if labels.get(key) != value.lstrip('='):
+                return False
+        elif term.startswith('!'):
+            if term[1:] in labels:
+                return False
+        elif term not in labels:
+            return False
+    return True
+
+
+def now() -> str:
+    return datetime.datetime.now(datetime.timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+class FakeApiServer:
+    """In-memory Kubernetes API server; see the module docstring."""
+
+    def __init__(self, latency=0.0, jitter=0.5, throttle=0.0, retry_after=1, conflict=0.0,
+                 ready_delay=0.5, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.throttle = throttle
+        self.retry_after = retry_after
+        self.conflict = conflict
+        self.ready_delay = ready_delay
+        self.random = random.Random(seed)
+        self.resources = copy.deepcopy(RESOURCES)
+        # (group, version, plural) -> {(namespace, name): object}; stored objects are never modified
+        self.objects = {}
+        # (group, version, plural) -> [(resourceVersion, type, object)], in resourceVersion order
+        self.events = {}
+        self.resource_version = 0
+        # (plural, namespace, name) -> monotonic time the object was first stored
+        self.created = {}
+        # (verb, plural, status code) -> number of requests
+        self.requests = {}
+        # functions called with (plural, event type, object) on every change
+        self.listeners = []
+        self._changed = asyncio.Event()
+        self._runner = None
+        for path in sorted(CRDS.glob('*.yaml')):
+            self.add_crd(yaml.safe_load(path.read_text()))
+
+    def add_crd(self, crd: dict):
+        """Serves a custom resource and stores its definition."""
+        names = crd['spec']['names']
+        for version in crd['spec']['versions']:
+            self.resources.setdefault((crd['spec']['group'], version['name']), {})[names['plural']] = (
+                names['kind'], crd['spec']['scope'] == 'Namespaced')
+        self.create(('apiextensions.k8s.io', 'v1', 'customresourcedefinitions'), None, copy.deepcopy(crd))
+
+    # --- storage
+
+    def _store(self, key, obj: dict, event_type: str):
+        self.resource_version += 1
+        obj['metadata']['resourceVersion'] = str(self.resource_version)
+        ident = (obj['metadata'].get('namespace'), obj['metadata']['name'])
+        if event_type == 'DELETED':
+            self.objects.setdefault(key, {}).pop(ident, None)
+        else:
+            self.objects.setdefault(key, {})[ident] = obj
+        self.events.setdefault(key, []).append((self.resource_version, event_type, obj))
+        for listener in self.listeners:
+            listener(key[2], event_type, obj)
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    def get(self, key, namespace, name) -> dict:
+        obj = self.objects.get(key, {}).get((namespace, name))
+        if obj is None:
+            raise ApiError(404, 'NotFound', f"{key[2]} \"{name}\" not found")
+        return obj
+
+    def list(self, key, namespace=None, selector='') -> list:
+        return [obj for (ns, _), obj in self.objects.get(key, {}).items()
+                if (namespace is None or ns == namespace) and matches(obj, selector)]
+
+    def create(self, key, namespace, body: dict) -> dict:
+        """Stores a new object (without the injected latency and errors)."""
+        group, version, plural = key
+        kind, namespaced = self.resources[(group, version)][plural]
+        meta = body.setdefault('metadata', {})
+        if not meta.get('name') and meta.get('generateName'):
+            meta['name'] = meta['generateName'] + uuid.uuid4().hex[:5]
+        if not meta.get('name'):
+            raise ApiError(422, 'Invalid', "metadata.name is required")
+        if namespaced:
+            meta['namespace'] = namespace
+        if (meta.get('namespace'), meta['name']) in self.objects.get(key, {}):
+            raise ApiError(409, 'AlreadyExists', f"{plural} \"{meta['name']}\" already exists")
+        body.setdefault('apiVersion', group_version(group, version))
+        body.setdefault('kind', kind)
+        meta.update(uid=str(uuid.uuid4()), creationTimestamp=now(), generation=1)
+        for field in ('deletionTimestamp', 'resourceVersion'):
+            meta.pop(field, None)
+        self.created.setdefault((plural, meta.get('namespace'), meta['name']), time.monotonic())
+        self._store(key, body, 'ADDED')
+        if kind in ('Deployment', 'Job', 'VolumeSnapshot'):
+            self._schedule_rollout(key, body)
+        return body
+
+    def update(self, key, old: dict, new: dict) -> dict:
+        """Stores a new version of an object; it is deleted once its last finalizer is removed."""
+        meta, old_meta = new.setdefault('metadata', {}), old['metadata']
+        if meta.get('resourceVersion') not in (None, old_meta['resourceVersion']):
+            raise ApiError(409, 'Conflict', f"the object has been modified: {old_meta['name']}")
+        for field in ('name', 'namespace', 'uid', 'creationTimestamp', 'deletionTimestamp'):
+            if field in old_meta:
+                meta[field] = old_meta[field]
+            else:
+                meta.pop(field, None)
+        changed_spec = new.get('spec') != old.get('spec')
+        meta['generation'] = old_meta.get('generation', 1) + (1 if changed_spec else 0)
+        if meta.get('deletionTimestamp') and not meta.get('finalizers'):
+            self._store(key, new, 'DELETED')
+        else:
+            self._store(key, new, 'MODIFIED')
+            if changed_spec and new.get('kind') == 'Deployment':
+                self._schedule_rollout(key, new)
+        return new
+
+    def delete(self, key, namespace, name) -> dict:
+        old = self.get(key, namespace, name)
+        new = copy.deepcopy(old)
+        if old['metadata'].get('finalizers'):
+            if not old['metadata'].get('deletionTimestamp'):
+                new['metadata']['deletionTimestamp'] = now()
+                self._store(key, new, 'MODIFIED')
+            return new
+        self._store(key, new, 'DELETED')
+        return new
+
+    def _schedule_rollout(self, key, obj: dict):
+        if self.ready_delay >= 0:
+            asyncio.get_running_loop().call_later(
+                self.ready_delay, self._roll_out, key, obj['metadata']['namespace'], obj['metadata']['name'])
+
+    def _roll_out(self, key, namespace, name):
+        obj = self.objects.get(key, {}).get((namespace, name))
+        if obj is None or obj['metadata'].get('deletionTimestamp'):
+            return
+        if obj['kind'] == 'Job':
+            status = {'succeeded': 1, 'conditions': [{'type': 'Complete', 'status': 'True'}]}
+        elif obj['kind'] == 'VolumeSnapshot':
+            source = self.objects.get(('', 'v1', 'persistentvolumeclaims'), {}).get(
+                (namespace, obj['spec']['source'].get('persistentVolumeClaimName')))
+            status = {'readyToUse': source is not None}
+            if source is not None:
+                status['restoreSize'] = source['spec']['resources']['requests']['storage']
+        else:
+            replicas = obj.get('spec', {}).get('replicas', 1)
+            status = {'observedGeneration': obj['metadata']['generation'], 'replicas': replicas,
+                      'readyReplicas': replicas, 'availableReplicas': replicas, 'updatedReplicas': replicas}
+        if obj.get('status') != status:
+            new = copy.deepcopy(obj)
+            new['status'] = status
+            self._store(key, new, 'MODIFIED')
+
+    # --- HTTP
+
+    def app(self) -> web.Application:
+        app = web.Application(client_max_size=16 * 1024 * 1024)
+        app.router.add_route('*', '/{path:.*}', self.handle)
+        return app
+
+    async def start(self, host='127.0.0.1', port=0) -> str:
+        """Serves the API in the running event loop and returns its URL."""
+        self._runner = web.AppRunner(self.app(), access_log=None, shutdown_timeout=1)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, port).start()
+        return f"http://{host}:{self._runner.addresses[0][1]}"
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+    def _count(self, verb, plural, status):
+        self.requests[(verb, plural, status)] = self.requests.get((verb, plural, status), 0) + 1
+
+    async def handle(self, request: web.Request) -> web.StreamResponse:
+        parts = [part for part in request.path.split('/') if part]
+        if parts in (['version'], ['api'], ['apis']) or parts[:1] == ['openapi']:
+            return self.discovery(parts)
+        try:
+            if parts[0] == 'api' and len(parts) >= 2:
+                group, version, rest = '', parts[1], parts[2:]
+            elif parts[0] == 'apis' and len(parts) >= 3:
+                group, version, rest = parts[1], parts[2], parts[3:]
+            else:
+                raise ApiError(404, 'NotFound', f"no route for {request.path}")
+            if (group, version) not in self.resources:
+                raise ApiError(404, 'NotFound', f"unknown API {group_version(group, version)}")
+            if not rest:
+                return self.discovery(parts, group, version)
+            namespace = None
+            if rest[0] == 'namespaces' and len(rest) >= 3:
+                namespace, rest = rest[1], rest[2:]
+            plural, name = rest[0], rest[1] if len(rest) > 1 else None
+            if plural not in self.resources[(group, version)]:
+                raise ApiError(404, 'NotFound', f"unknown resource {plural}")
+        except ApiError as e:
+            return e.response()
+
+        key = (group, version, plural)
+        verb = {'GET': 'get' if name else 'list', 'POST': 'create', 'PUT': 'update', 'PATCH': 'patch',
+                'DELETE': 'delete' if name else 'deletecollection'}.get(request.method, request.method)
+        if verb == 'list' and request.query.get('watch') in ('true', '1'):
+            self._count('watch', plural, 200)
+            return await self.watch(request, key, namespace)
+
+        if self.latency:
+            await asyncio.sleep(self.latency * self.random.uniform(1 - self.jitter, 1 + self.jitter))
+        if self.throttle and self.random.random() < self.throttle:
+            self._count(verb, plural, 429)
+            return ApiError(429, 'TooManyRequests', "throttled by the fake API server").response(
+                headers={'Retry-After': str(self.retry_after)})
+        try:
+            status, body = await self.dispatch(request, verb, key, namespace, name)
+            response = web.json_response(body, status=status)
+        except ApiError as e:
+            response = e.response()
+        self._count(verb, plural, response.status)
+        return response
+
+    def discovery(self, parts, group=None, version=None) -> web.Response:
+        if parts == ['version']:
+            return web.json_response({'major': '1', 'minor': '30', 'gitVersion': 'v1.30.0-fake', 'platform': 'fake'})
+        if parts == ['api']:
+            return web.json_response({'kind': 'APIVersions', 'versions': ['v1'], 'serverAddressByClientCIDRs': []})
+        if parts == ['apis']:
+            groups = {}
+            for g, v in self.resources:
+                if g:
+                    groups.setdefault(g, []).append({'groupVersion': f"{g}/{v}", 'version': v})
+            return web.json_response({'kind': 'APIGroupList', 'apiVersion': 'v1', 'groups': [
+                {'name': g, 'versions': versions, 'preferredVersion': versions[0]} for g, versions in groups.items()
+            ]})
+        if group is None:
+            return ApiError(404, 'NotFound', "no OpenAPI schema").response()
+        return web.json_response({
+            'kind': 'APIResourceList', 'apiVersion': 'v1', 'groupVersion': group_version(group, version),
+            'resources': [{'name': plural, 'singularName': '', 'namespaced': namespaced, 'kind': kind, 'verbs': VERBS}
+                          for plural, (kind, namespaced) in self.resources[(group, version)].items()],
+        })
+
+    async def dispatch(self, request, verb, key, namespace, name):
+        group, version, plural = key
+        kind, _ = self.resources[(group, version)][plural]
+        selector = request.query.get('labelSelector', '')
+        if verb == 'get':
+            return 200, self.get(key, namespace, name)
+        if verb == 'list':
+            return 200, {'apiVersion': group_version(group, version), 'kind': f"{kind}List",
+                         'metadata': {'resourceVersion': str(self.resource_version)},
+                         'items': self.list(key, namespace, selector)}
+        if verb == 'delete':
+            return 200, self.delete(key, namespace, name)
+        if verb == 'deletecollection':
+            return 200, {'apiVersion': group_version(group, version), 'kind': f"{kind}List", 'metadata': {},
+                         'items': [self.delete(key, namespace, obj['metadata']['name'])
+                                   for obj in self.list(key, namespace, selector)]}
+
+        raw = await request.read()
+        try:
+            body = json.loads(raw) if raw else None
+        except ValueError:
+            body = yaml.safe_load(raw)
+        if verb == 'create':
+            if plural == 'events':
+                return 201, body  # kopf's event posts are not kept
+            obj = self.create(key, namespace, body)
+            if self.conflict and self.random.random() < self.conflict:
+                raise ApiError(409, 'AlreadyExists', f"{plural} \"{obj['metadata']['name']}\" already exists")
+            return 201, obj
+        content_type = request.content_type
+        if verb == 'patch' and content_type == 'application/apply-patch+yaml':
+            try:
+                old = self.get(key, namespace, name)
+            except ApiError:
+                return 201, self.create(key, namespace, body)
+            return 200, self.update(key, old, copy.deepcopy(merge_patch(old, body)))
+        old = self.get(key, namespace, name)
+        if verb == 'update':
+            return 200, self.update(key, old, body)
+        if content_type == 'application/json-patch+json':
+            return 200, self.update(key, old, json_patch(old, body))
+        return 200, self.update(key, old, copy.deepcopy(merge_patch(old, body)))
+
+    async def watch(self, request, key, namespace) -> web.StreamResponse:
+        """Streams the events after ``resourceVersion`` (or all the objects as ADDED without one)."""
+        selector = request.query.get('labelSelector', '')
+        timeout = request.query.get('timeoutSeconds')
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + float(timeout) if timeout else None
+        response = web.StreamResponse(headers={'Content-Type': 'application/json'})
+        await response.prepare(request)
+
+        def relevant(obj):
+            return (namespace is None or obj['metadata'].get('namespace') == namespace) and matches(obj, selector)
+
+        since = int(request.query.get('resourceVersion') or 0)
+        backlog = []
+        if not since:
+            since = self.resource_version
+            backlog = [('ADDED', obj) for obj in self.list(key, namespace, selector)]
+        events = self.events.setdefault(key, [])
+        position = bisect.bisect_right(events, since, key=lambda event: event[0])
+        try:
+            while True:
+                changed = self._changed
+                lines = [json.dumps({'type': event_type, 'object': obj}) for event_type, obj in backlog]
+                backlog = []
+                while position < len(events):
+                    _, event_type, obj = events[position]
+                    position += 1
+                    if relevant(obj):
+                        lines.append(json.dumps({'type': event_type, 'object': obj}))
+                if lines:
+                    await response.write(('\n'.join(lines) + '\n').encode())
+                remaining = None if deadline is None else deadline - loop.time()
+                if remaining is not None and remaining <= 0:
+                    break
+                try:
+                    await asyncio.wait_for(changed.wait(), remaining)
+                except asyncio.TimeoutError:
+                    break
+        except (ConnectionResetError, asyncio.CancelledError):
+            return response
+        await response.write_eof()
+        return response
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8001)
+    parser.add_argument('--latency', type=float, default=0.0, help="mean delay of each request, in seconds")
+    parser.add_argument('--jitter', type=float, default=0.5, help="relative spread of the delay")
+    parser.add_argument('--throttle', type=float, default=0.0, help="ratio of the requests answered with 429")
+    parser.add_argument('--retry-after', type=int, default=1, help="Retry-After of the 429 responses, in seconds")
+    parser.add_argument('--conflict', type=float, default=0.0, help="ratio of the creations answered with 409")
+    parser.add_argument('--ready-delay', type=float, default=0.5,
+                        help="seconds until a Deployment is available (negative: never)")
+    args = parser.parse_args()
+
+    async def serve():
+        server = FakeApiServer(latency=args.latency, jitter=args.jitter, throttle=args.throttle,
+                               retry_after=args.retry_after, conflict=args.conflict, ready_delay=args.ready_delay)
+        print(f"Serving on {await server.start(args.host, args.port)}")
+        await asyncio.Event().wait()
+
+    asyncio.run(serve())
+
+
+if __name__ == '__main__':
+    main()
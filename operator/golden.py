@@ -0,0 +1,171 @@
+"""Golden volumes: the volumes of new blogs cloned from pre-seeded VolumeSnapshots.
+
+With ``GOLDEN_SNAPSHOT_CLASS`` set (a VolumeSnapshotClass of the CSI driver provisioning the
+blogs' volumes) the operator keeps, in each namespace with blogs and for each image, a
+VolumeSnapshot of a WordPress volume with the core files already unpacked and one of a MySQL
+data directory already initialized with the ``wordpress`` database and user. The
+PersistentVolumeClaims of a new blog are created with them as ``dataSource``, so its pods
+neither copy WordPress nor initialize MySQL on their first start.
+
+A missing snapshot is seeded when a blog needs it: a Job fills a ``<snapshot>-seed`` PVC, which
+is snapshotted once the Job succeeded, and the Job and PVC are deleted once the snapshot is
+ready to use. The blogs created in the meantime start from empty volumes, as without golden
+volumes: they never wait for a seed. The snapshot a volume is cloned from is chosen when it is
+created and kept in ``status.golden``, a PVC's ``dataSource`` being immutable.
+"""
+import hashlib
+import logging
+import os
+import secrets
+import time
+
+import kubernetes
+
+import k8s
+import rendering
+
+SNAPSHOT_CLASS = os.environ.get('GOLDEN_SNAPSHOT_CLASS', '')
+ENABLED = bool(SNAPSHOT_CLASS)
+# size of the seeded volumes: only the blogs' volumes at least as large are cloned
+SEED_SIZE = os.environ.get('GOLDEN_SEED_SIZE', '1Gi')
+# seconds before a seed that failed is tried again
+SEED_RETRY = 600
+
+LABEL = 'gdgitalia.dev/golden'
+SEED_SUFFIX = '-seed'
+
+# the volumes cloned: manifest key -> kind of golden volume, PVC name and size in the spec
+VOLUMES = {
+    'mysql-volume': ('mysql', 'mysql-{name}-pv-claim', 'mysql_size'),
+    'wordpress-volume': ('wordpress', '{name}-pv-claim', 'wp_size'),
+}
+
+# the steps of the MySQL image's entrypoint on an empty data directory, without starting the
+# server afterwards; the server UUID is left for each clone to generate
+MYSQL_SEED = (
+    'source /usr/local/bin/docker-entrypoint.sh && docker_setup_env mysqld && docker_create_db_directories mysqld'
+    ' && docker_verify_minimum_env && docker_init_database_dir mysqld && docker_temp_server_start mysqld'
+    ' && mysql_socket_fix && docker_setup_db && docker_temp_server_stop && rm -f "$DATADIR/auto.cnf"'
+)
+
+# how each kind of golden volume is seeded: mount path, command and pod security context
+SEEDS = {
+    'wordpress': ('/var/www/html', ['sh', '-c', 'cp -a /usr/src/wordpress/. /var/www/html/'
+                                                ' && chown -R www-data:www-data /var/www/html'], None),
+    'mysql': ('/var/lib/mysql', ['bash', '-c', MYSQL_SEED], {'runAsUser': 999, 'runAsGroup': 999, 'fsGroup': 999}),
+}
+
+# (namespace, snapshot) of the seeds started by this process, of the ones it deleted, and of
+# the failed ones by failure time
+_seeding = set()
+_cleaned = set()
+_failed = {}
+
+
+def image_of(kind: str, spec) -> str:
+    return rendering.MYSQL_IMAGE if kind == 'mysql' else rendering.wordpress_image(spec)
+
+
+def snapshot_name(kind: str, image: str) -> str:
+    """The golden snapshot of a kind of volume for an image (and the seed size)."""
+    return f"golden-{kind}-{hashlib.sha1(f'{image} {SEED_SIZE}'.encode('utf-8')).hexdigest()[:10]}"
+
+
+def _bytes(quantity) -> int:
+    return int(kubernetes.utils.parse_quantity(quantity))
+
+
+def choose(namespace: str, name: str, spec, status, steps, existing: dict, golden_snapshots) -> tuple:
+    """The snapshot each volume of a Wordpress resource is cloned from, by manifest key ('' for none).
+
+    ``steps`` are the sub-resources of the blog, ``existing`` its indexed sub-resources and
+    ``golden_snapshots`` the indexed snapshots. A volume that exists already (e.g. created before
+    the golden mode) is not cloned, nor a volume whose snapshot is not ready or too large.
+    Returns the choice and the (kind, image) of the snapshots missing, to ``seed``.
+    """
+    chosen = dict(status.get('golden') or {})
+    missing = []
+    for key, (kind, claim, size_field) in VOLUMES.items():
+        if key not in steps or key in chosen:
+            continue
+        chosen[key] = ''
+        if ('PersistentVolumeClaim', claim.format(name=name)) in existing:
+            continue
+        image = image_of(kind, spec)
+        snapshot = snapshot_name(kind, image)
+        found = list(golden_snapshots.get((namespace, snapshot), []))
+        if not found:
+            missing.append((kind, image))
+        elif found[0]['ready'] and _bytes(found[0]['size'] or SEED_SIZE) <= _bytes(spec.get(size_field, '1Gi')):
+            chosen[key] = snapshot
+    return chosen, missing
+
+
+def _password() -> str:
+    return secrets.token_urlsafe(16)
+
+
+def _seed_env(kind: str) -> list:
+    if kind != 'mysql':
+        return []
+    # replaced by the blog's passwords on each clone (see rendering.GOLDEN_MYSQL_COMMAND)
+    return [{'name': 'MYSQL_ROOT_PASSWORD', 'value': _password()},
+            {'name': 'MYSQL_DATABASE', 'value': 'wordpress'},
+            {'name': 'MYSQL_USER', 'value': 'wordpress'},
+            {'name': 'MYSQL_PASSWORD', 'value': _password()}]
+
+
+async def seed(namespace: str, kind: str, image: str):
+    """Starts seeding a golden volume, unless this process already did (or it failed recently).
+
+    Never raises: a seed that cannot be started (e.g. without the RBAC on Jobs) is tried again
+    after ``SEED_RETRY``, the blogs going on with empty volumes meanwhile.
+    """
+    snapshot = snapshot_name(kind, image)
+    if (namespace, snapshot) in _seeding or time.monotonic() - _failed.get((namespace, snapshot), -SEED_RETRY) < SEED_RETRY:
+        return
+    _seeding.add((namespace, snapshot))
+    mount_path, command, security_context = SEEDS[kind]
+    try:
+        await k8s.create(k8s.core_v1().create_namespaced_persistent_volume_claim, namespace, rendering.render(
+            'golden/golden-seed-volume.yaml', name=snapshot, kind=kind, size=SEED_SIZE))
+        await k8s.create(k8s.batch_v1().create_namespaced_job, namespace, rendering.render(
+            'golden/golden-seed-job.yaml', name=snapshot, kind=kind, image=image, command=command,
+            env=_seed_env(kind), mount_path=mount_path, security_context=security_context))
+    except kubernetes.client.rest.ApiException as e:
+        _seeding.discard((namespace, snapshot))
+        _failed[(namespace, snapshot)] = time.monotonic()
+        logging.warning("Golden %s volume %s not seeded in %s: %s", kind, snapshot, namespace, e)
+        return
+    logging.info("Golden %s volume %s seeding in %s (%s)", kind, snapshot, namespace, image)
+
+
+async def snapshot(namespace: str, snapshot: str, kind: str):
+    """Snapshots a seeded golden volume."""
+    body = rendering.render('golden/golden-snapshot.yaml', name=snapshot, kind=kind, snapshot_class=SNAPSHOT_CLASS)
+    try:
+        await k8s.call(k8s.custom_objects().create_namespaced_custom_object, 'snapshot.storage.k8s.io', 'v1',
+                       namespace, 'volumesnapshots', body)
+    except kubernetes.client.rest.ApiException as e:
+        if e.status != 409:
+            raise e
+        return
+    logging.info("Golden %s volume %s snapshotted in %s", kind, snapshot, namespace)
+
+
+async def clean_up(namespace: str, snapshot: str, failed: bool = False):
+    """Deletes the seed Job and PVC of a golden snapshot, once ready or when the seed failed."""
+    if not failed and (namespace, snapshot) in _cleaned:
+        return
+    for method, name in ((k8s.batch_v1().delete_namespaced_job, f"{snapshot}{SEED_SUFFIX}"),
+                         (k8s.core_v1().delete_namespaced_persistent_volume_claim, f"{snapshot}{SEED_SUFFIX}")):
+        try:
+            await k8s.call(method, name, namespace, propagation_policy='Background')
+        except kubernetes.client.rest.ApiException as e:
+            if e.status != 404:
+                raise e
+    _seeding.discard((namespace, snapshot))
+    if failed:
+        _failed[(namespace, snapshot)] = time.monotonic()
+    else:
+        _cleaned.add((namespace, snapshot))
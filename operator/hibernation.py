@@ -0,0 +1,236 @@
+"""Hibernation: the blogs without traffic scaled to zero, and woken up by their next request.
+
+A Wordpress resource with ``hibernation`` in its spec is hibernated after ``idle_after``
+(default ``30m``) without requests: the operator annotates it ``gdgitalia.dev/hibernated``,
+which scales its Deployments to zero and points its Ingress at the activator. The requests are
+read from the ingress controllers' metrics (``INGRESS_METRICS_URL``, the Prometheus endpoints
+of the ingress-nginx controller pods, comma-separated): ``nginx_ingress_controller_requests``
+of the blog's Ingress, scraped every ``HIBERNATION_CHECK_SECONDS``. The blogs are idle from the
+operator's start at the earliest.
+
+The activator is an HTTP server in the operator (``HIBERNATION_ACTIVATOR_PORT``), which a
+hibernated blog's Ingress reaches through its ``<name>-activator`` ExternalName Service
+pointing to ``HIBERNATION_ACTIVATOR_HOST`` (the operator's own Service). It holds the requests
+for the blog, removes the annotation, which scales the blog back up and points its Ingress
+back to it, and forwards them to the blog once its Deployments are available, or answers 503
+after ``HIBERNATION_WAKE_TIMEOUT`` seconds.
+"""
+import asyncio
+import logging
+import os
+import time
+
+import aiohttp
+import kubernetes
+from aiohttp import web
+from prometheus_client.parser import text_string_to_metric_families
+
+import k8s
+import sharding
+
+ACTIVATOR_HOST = os.environ.get('HIBERNATION_ACTIVATOR_HOST', '')
+METRICS_URLS = [url for url in os.environ.get('INGRESS_METRICS_URL', '').split(',') if url]
+# without the requests counted by the ingress controllers, every blog would look idle
+ENABLED = bool(ACTIVATOR_HOST and METRICS_URLS)
+
+ACTIVATOR_PORT = int(os.environ.get('HIBERNATION_ACTIVATOR_PORT', '8081'))
+CHECK_SECONDS = float(os.environ.get('HIBERNATION_CHECK_SECONDS', '60'))
+WAKE_TIMEOUT = float(os.environ.get('HIBERNATION_WAKE_TIMEOUT', '120'))
+IDLE_AFTER = '30m'
+
+ANNOTATION = 'gdgitalia.dev/hibernated'
+REQUESTS_METRIC = 'nginx_ingress_controller_requests'
+UNITS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+# not forwarded by the activator
+HOP_BY_HOP = {'connection', 'keep-alive', 'proxy-authenticate', 'proxy-authorization', 'te', 'trailer',
+              'transfer-encoding', 'upgrade', 'content-length'}
+
+# (namespace, name) -> monotonic time of the last request seen (or of the blog seen first)
+_active = {}
+# (namespace, ingress) -> requests counted by the ingress controllers at the last scrape
+_requests = {}
+# (namespace, name) of the blogs hibernated at the last check
+_hibernated = set()
+_task = None
+_runner = None
+
+
+def enabled(spec) -> bool:
+    return ENABLED and spec.get('hibernation') is not None
+
+
+def hibernated(spec, annotations) -> bool:
+    """Whether a Wordpress resource is hibernated (turning hibernation off wakes it up)."""
+    return enabled(spec) and annotations.get(ANNOTATION) == 'true'
+
+
+def idle_after(spec) -> float:
+    """Seconds without requests before a blog is hibernated."""
+    ttl = (spec.get('hibernation') or {}).get('idle_after', IDLE_AFTER)
+    return int(ttl[:-1]) * UNITS[ttl[-1]]
+
+
+def touch(namespace: str, name: str):
+    _active[(namespace, name)] = time.monotonic()
+
+
+def ingress_requests(text: str) -> dict:
+    """The requests counted for each Ingress in an ingress-nginx metrics page, by (namespace, ingress)."""
+    requests = {}
+    for family in text_string_to_metric_families(text):
+        if family.name != REQUESTS_METRIC:
+            continue
+        for sample in family.samples:
+            key = (sample.labels.get('namespace'), sample.labels.get('ingress'))
+            requests[key] = requests.get(key, 0) + sample.value
+    return requests
+
+
+async def scrape(session: aiohttp.ClientSession) -> dict:
+    """The requests counted by all the ingress controllers."""
+    requests = {}
+    for url in METRICS_URLS:
+        async with session.get(url) as response:
+            response.raise_for_status()
+            for key, count in ingress_requests(await response.text()).items():
+                requests[key] = requests.get(key, 0) + count
+    return requests
+
+
+async def set_hibernated(namespace: str, name: str, value: bool):
+    body = {'metadata': {'annotations': {ANNOTATION: 'true' if value else None}}}
+    await k8s.call(k8s.custom_objects().patch_namespaced_custom_object, group="gdgitalia.dev", version="v1",
+                   namespace=namespace, plural="wordpress", name=name, body=body)
+    logging.info("WordPress installation %s %s", name, 'hibernated' if value else 'waking up')
+
+
+def awake(blog, wordpress_children) -> bool:
+    """Whether all the Deployments of an indexed blog are available."""
+    available = {child['name'] for child in wordpress_children.get(('app', blog['namespace'], blog['name']), [])
+                 if child['kind'] == 'Deployment' and child['available']}
+    return all(deployment in available for deployment in blog['deployments'])
+
+
+async def check(hibernating_blogs, wordpress_children, requests: dict):
+    """Records the blogs' requests, and hibernates this replica's blogs idle for long enough."""
+    now = time.monotonic()
+    # the Ingresses with requests since the last scrape (or whose controller restarted)
+    active = {key for key, count in requests.items() if _requests.get(key) != count}
+    _requests.clear()
+    _requests.update(requests)
+    blogs = [blog for key, blogs in list(hibernating_blogs.items()) if key[0] == 'blog' for blog in blogs]
+    for blog in blogs:
+        key = (blog['namespace'], blog['name'])
+        if blog['hibernated']:
+            _hibernated.add(key)
+            continue
+        if key in _hibernated:  # woken up (by any replica's activator) since the last check
+            _hibernated.discard(key)
+            _active[key] = now
+        if key not in _active or (blog['namespace'], f"{blog['name']}-ingress") in active:
+            _active[key] = now
+        # a blog waking up (or still provisioning) is not idle
+        if now - _active[key] > blog['idle_after'] and awake(blog, wordpress_children) and sharding.owns(*key):
+            try:
+                await set_hibernated(*key, True)
+                _hibernated.add(key)
+            except kubernetes.client.rest.ApiException as e:
+                if e.status != 404:
+                    raise e
+
+
+async def run(hibernating_blogs, wordpress_children):
+    """Scrapes the ingress controllers' metrics and hibernates the idle blogs until cancelled."""
+    async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=CHECK_SECONDS / 2)) as session:
+        while True:
+            try:
+                await check(hibernating_blogs, wordpress_children, await scrape(session))
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                # without the requests, no blog is known to be idle
+                logging.warning("Ingress metrics not available: %s", e)
+            except kubernetes.client.rest.ApiException as e:
+                logging.warning("Hibernation check failed: %s", e)
+            await asyncio.sleep(CHECK_SECONDS)
+
+
+class Activator:
+    """Holds the requests for the hibernated blogs while they wake up, then forwards them."""
+
+    def __init__(self, hibernating_blogs, wordpress_children):
+        self.hibernating_blogs = hibernating_blogs
+        self.wordpress_children = wordpress_children
+        self.session = None
+        self._waking = {}  # (namespace, name) -> the task waking the blog up
+
+    async def wake(self, blog):
+        """Wakes a blog up and waits for its Deployments, for ``WAKE_TIMEOUT`` seconds at most."""
+        key = (blog['namespace'], blog['name'])
+        try:
+            if blog['hibernated']:
+                await set_hibernated(*key, False)
+            deadline = time.monotonic() + WAKE_TIMEOUT
+            while not awake(blog, self.wordpress_children) and time.monotonic() < deadline:
+                await asyncio.sleep(0.5)
+        finally:
+            self._waking.pop(key, None)
+
+    async def handle(self, request: web.Request) -> web.StreamResponse:
+        blog = next(iter(self.hibernating_blogs.get(('host', request.host.partition(':')[0]), [])), None)
+        if blog is None:
+            return web.Response(status=404, text="Unknown blog\n")
+        key = (blog['namespace'], blog['name'])
+        touch(*key)
+        if not awake(blog, self.wordpress_children):
+            task = self._waking.get(key)
+            if task is None:
+                task = self._waking[key] = asyncio.ensure_future(self.wake(blog))
+            try:
+                await asyncio.wait_for(asyncio.shield(task), WAKE_TIMEOUT)
+            except asyncio.TimeoutError:
+                return web.Response(status=503, headers={'Retry-After': '10'}, text="The blog is waking up\n")
+            except kubernetes.client.rest.ApiException as e:
+                logging.warning("WordPress installation %s not woken up: %s", blog['name'], e)
+                return web.Response(status=503, headers={'Retry-After': '10'}, text="The blog is waking up\n")
+            if not awake(blog, self.wordpress_children):  # joined a wake-up that timed out
+                return web.Response(status=503, headers={'Retry-After': '10'}, text="The blog is waking up\n")
+        return await self.forward(request, blog)
+
+    async def forward(self, request: web.Request, blog) -> web.StreamResponse:
+        url = f"http://{blog['name']}.{blog['namespace']}.svc:{blog['port']}{request.path_qs}"
+        headers = {name: value for name, value in request.headers.items() if name.lower() not in HOP_BY_HOP}
+        try:
+            async with self.session.request(request.method, url, headers=headers, data=await request.read(),
+                                            allow_redirects=False) as response:
+                body = await response.read()
+                headers = {name: value for name, value in response.headers.items()
+                           if name.lower() not in HOP_BY_HOP and name.lower() != 'content-encoding'}
+                return web.Response(status=response.status, headers=headers, body=body)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logging.warning("Request for %s not forwarded: %s", blog['name'], e)
+            return web.Response(status=502, text="The blog is not reachable\n")
+
+
+async def start(hibernating_blogs, wordpress_children):
+    """Serves the activator and checks the blogs' activity in the background."""
+    global _task, _runner
+    activator = Activator(hibernating_blogs, wordpress_children)
+    # the response bodies are forwarded as read: not decompressed
+    activator.session = aiohttp.ClientSession(auto_decompress=False, timeout=aiohttp.ClientTimeout(total=WAKE_TIMEOUT))
+    app = web.Application()
+    app.router.add_route('*', '/{path:.*}', activator.handle)
+    app.on_cleanup.append(lambda app: activator.session.close())
+    _runner = web.AppRunner(app, access_log=None)
+    await _runner.setup()
+    await web.TCPSite(_runner, port=ACTIVATOR_PORT).start()
+    _task = asyncio.create_task(run(hibernating_blogs, wordpress_children))
+    logging.info("Activator listening on port %d", ACTIVATOR_PORT)
+
+
+async def stop():
+    global _task, _runner
+    if _task is not None:
+        _task.cancel()
+        _task = None
+    if _runner is not None:
+        await _runner.cleanup()
+        _runner = None
@@ -0,0 +1,166 @@
+"""Shared, connection-pooled Kubernetes API client for the operator handlers.
+
+The ``kubernetes`` client is synchronous, so every call is run on a bounded
+thread pool instead of kopf's event loop, all through one ``ApiClient`` whose
+urllib3 pool is sized to that thread pool. The calls are paced and ordered by
+the operator-wide scheduler (see ``scheduler.py``), and retried when throttled.
+"""
+import asyncio
+import functools
+import itertools
+import logging
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+import kubernetes
+
+import metrics
+import scheduler
+
+# Maximum number of Kubernetes API calls in flight (and pooled connections)
+API_WORKERS = int(os.environ.get('K8S_API_WORKERS', '16'))
+
+_executor = None
+_api_client = None
+_scheduler = None
+_apis = {}
+
+
+def setup():
+    """Loads the cluster configuration and builds the shared ApiClient and executor."""
+    global _executor, _api_client, _scheduler
+    if _api_client is not None:
+        return
+    try:
+        kubernetes.config.load_incluster_config()
+    except kubernetes.config.ConfigException:
+        kubernetes.config.load_kube_config()  # Loads from your default kubeconfig
+    configuration = kubernetes.client.Configuration.get_default_copy()
+    configuration.connection_pool_maxsize = API_WORKERS
+    _api_client = kubernetes.client.ApiClient(configuration)
+    _executor = ThreadPoolExecutor(max_workers=API_WORKERS, thread_name_prefix='k8s-api')
+    _scheduler = scheduler.Scheduler(concurrency=API_WORKERS)
+    logging.info("Kubernetes API client ready: %s (%d workers, %g QPS)", configuration.host, API_WORKERS,
+                 _scheduler.qps)
+
+
+def close():
+    """Closes the pooled connections and stops the executor."""
+    global _executor, _api_client, _scheduler
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+    if _api_client is not None:
+        _api_client.close()
+    _executor = _api_client = _scheduler = None
+    _apis.clear()
+
+
+def _api(cls):
+    setup()
+    api = _apis.get(cls)
+    if api is None:
+        api = _apis[cls] = cls(_api_client)
+    return api
+
+
+def core_v1() -> kubernetes.client.CoreV1Api:
+    return _api(kubernetes.client.CoreV1Api)
+
+
+def apps_v1() -> kubernetes.client.AppsV1Api:
+    return _api(kubernetes.client.AppsV1Api)
+
+
+def networking_v1() -> kubernetes.client.NetworkingV1Api:
+    return _api(kubernetes.client.NetworkingV1Api)
+
+
+def autoscaling_v2() -> kubernetes.client.AutoscalingV2Api:
+    return _api(kubernetes.client.AutoscalingV2Api)
+
+
+def batch_v1() -> kubernetes.client.BatchV1Api:
+    return _api(kubernetes.client.BatchV1Api)
+
+
+def coordination_v1() -> kubernetes.client.CoordinationV1Api:
+    return _api(kubernetes.client.CoordinationV1Api)
+
+
+def custom_objects() -> kubernetes.client.CustomObjectsApi:
+    return _api(kubernetes.client.CustomObjectsApi)
+
+
+async def call(fn, *args, **kwargs):
+    """Runs a blocking API method on the executor without blocking the event loop."""
+    # e.g. create_namespaced_secret -> verb 'create', kind 'secret'
+    verb, _, kind = fn.__name__.partition('_namespaced_')
+    return await _call(verb, kind or 'unknown', fn, *args, **kwargs)
+
+
+async def _call(verb: str, kind: str, fn, *args, **kwargs):
+    setup()
+    loop = asyncio.get_running_loop()
+    for attempt in itertools.count():
+        metrics.API_CALLS.labels(verb, kind).inc()
+        try:
+            async with _scheduler.slot():
+                return await loop.run_in_executor(_executor, functools.partial(fn, *args, **kwargs))
+        except kubernetes.client.rest.ApiException as e:
+            metrics.API_ERRORS.labels(verb, kind, str(e.status)).inc()
+            if e.status not in scheduler.RETRY_STATUSES or attempt >= scheduler.RETRIES:
+                raise
+            status, delay = e.status, scheduler.backoff(attempt, (e.headers or {}).get('Retry-After'))
+        metrics.API_RETRIES.labels(verb, kind, str(status)).inc()
+        logging.info("%s %s answered %s, retrying in %.1fs", verb, kind, status, delay)
+        await asyncio.sleep(delay)
+
+
+async def create(create_fn, namespace: str, body: dict) -> str:
+    """Runs a ``create_namespaced_*`` call, tolerating an object left by a previous attempt."""
+    try:
+        obj = await call(create_fn, namespace=namespace, body=body)
+        return str(obj.metadata.name)
+    except kubernetes.client.rest.ApiException as e:
+        if e.status != 409:
+            raise e
+        logging.info("%s already exists: %s", body['kind'], body['metadata']['name'])
+        return str(body['metadata']['name'])
+
+
+# Name of the operator's field manager for server-side apply
+FIELD_MANAGER = 'wordpress-operator'
+
+# Plural resource name of the kinds the operator applies
+PLURALS = {
+    'ConfigMap': 'configmaps',
+    'Deployment': 'deployments',
+    'HorizontalPodAutoscaler': 'horizontalpodautoscalers',
+    'Ingress': 'ingresses',
+    'Lease': 'leases',
+    'PersistentVolumeClaim': 'persistentvolumeclaims',
+    'Secret': 'secrets',
+    'Service': 'services',
+}
+
+
+def resource_path(api_version: str, kind: str, namespace: str, name: str = None) -> str:
+    """The REST path of a namespaced object (or of its collection without ``name``)."""
+    group = '/api/' if '/' not in api_version else '/apis/'
+    path = f"{group}{api_version}/namespaces/{namespace}/{PLURALS.get(kind, kind.lower() + 's')}"
+    return f"{path}/{name}" if name else path
+
+
+async def apply(namespace: str, body: dict) -> dict:
+    """Server-side applies a manifest: creates the object, or patches in place the fields it sets."""
+    setup()
+    path = resource_path(body['apiVersion'], body['kind'], namespace, body['metadata']['name'])
+    kind = re.sub(r'(?<!^)(?=[A-Z])', '_', body['kind']).lower()
+    return await _call(
+        'apply', kind, _api_client.call_api, path, 'PATCH',
+        query_params=[('fieldManager', FIELD_MANAGER), ('force', True)],
+        header_params={'Content-Type': 'application/apply-patch+yaml', 'Accept': 'application/json'},
+        body=body, response_type='object', auth_settings=['BearerToken'],
+        _return_http_data_only=True,
+    )
@@ -0,0 +1,109 @@
+"""Event-driven provisioning: LISTEN for the NOTIFY sent when a blog is signed up.
+
+The ``blogs`` migration ``0005_blog_status`` installs a trigger on ``blogs_blog``
+that sends a JSON payload (``id``, ``title``, ``hostname`` and the ``created``
+epoch) on the ``blog_pending`` channel every time a row is inserted with, or
+moved back to, ``status = 'pending'``.
+
+Run ``python listener.py --host localhost --dbname blogp --user blogp --password ...``
+to print the notifications of a local PostgreSQL without touching Kubernetes.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import time
+
+import psycopg2
+
+import metrics
+
+CHANNEL = 'blog_pending'
+
+
+class BlogListener:
+    """An async iterator over the blogs notified on ``CHANNEL``, on its own connection.
+
+    Each iteration waits for a notification and returns it with all those already
+    received after it, up to ``batch`` blogs: a burst of signups is handled in a few
+    batches instead of one blog at a time. The connection is in autocommit mode and
+    can be used (``.conn``) for short statements between two batches.
+    """
+
+    def __init__(self, credentials: dict, batch: int = 50):
+        self.credentials = credentials
+        self.batch = batch
+        self.conn = None
+        self._queue = None
+
+    def _connect(self):
+        with metrics.POSTGRES_CONNECT_SECONDS.time():
+            conn = psycopg2.connect(**self.credentials)
+        conn.autocommit = True
+        with conn.cursor() as cur:
+            cur.execute(f"LISTEN {CHANNEL};")
+        return conn
+
+    async def __aenter__(self):
+        # off the event loop: a slow or unreachable database would stall every handler
+        self.conn = await asyncio.to_thread(self._connect)
+        self._queue = asyncio.Queue()
+        asyncio.get_running_loop().add_reader(self.conn.fileno(), self._on_readable)
+        return self
+
+    async def __aexit__(self, *exc_info):
+        asyncio.get_running_loop().remove_reader(self.conn.fileno())
+        self.conn.close()
+
+    def _on_readable(self):
+        try:
+            self.conn.poll()
+        except psycopg2.Error as e:
+            asyncio.get_running_loop().remove_reader(self.conn.fileno())
+            self._queue.put_nowait(e)
+            return
+        while self.conn.notifies:
+            self._queue.put_nowait(self.conn.notifies.pop(0).payload)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> list:
+        items = [await self._queue.get()]
+        while len(items) < self.batch and not self._queue.empty() and not isinstance(items[-1], Exception):
+            items.append(self._queue.get_nowait())
+        if isinstance(items[-1], Exception):
+            if len(items) == 1:
+                raise items[0]
+            self._queue.put_nowait(items.pop())  # raised on the next iteration
+        return [json.loads(item) for item in items]
+
+
+async def _print_notifications(credentials: dict):
+    async with BlogListener(credentials) as blogs:
+        print(f"Listening on {CHANNEL}...")
+        async for batch in blogs:
+            for blog in batch:
+                print(f"{blog['title']} ({blog['hostname']}) id={blog['id']}"
+                      f" notified {time.time() - blog['created']:.3f}s after signup")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=f"Print the blogs notified on {CHANNEL}.")
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', default='5432')
+    parser.add_argument('--dbname', default='blogp')
+    parser.add_argument('--user', default='blogp')
+    parser.add_argument('--password', default='')
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+    credentials = dict(host=args.host, port=args.port, database=args.dbname,
+                       user=args.user, password=args.password)
+    try:
+        asyncio.run(_print_notifications(credentials))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+"""Prometheus metrics of the operator's hot paths, served over HTTP on ``METRICS_PORT``."""
+import logging
+import os
+import time
+
+import prometheus_client
+
+METRICS_PORT = int(os.environ.get('METRICS_PORT', '9090'))
+
+# Buckets from a few milliseconds (cached/skipped calls) to minutes (bulk provisioning)
+LATENCY_BUCKETS = (.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+CHILD_SECONDS = prometheus_client.Histogram(
+    'wordpress_operator_child_seconds', "Time to create/update one sub-resource of a Wordpress resource",
+    ['resource'], buckets=LATENCY_BUCKETS)
+HANDLER_SECONDS = prometheus_client.Histogram(
+    'wordpress_operator_handler_seconds', "Duration of the Wordpress create/update/delete handlers",
+    ['handler'], buckets=LATENCY_BUCKETS)
+API_CALLS = prometheus_client.Counter(
+    'wordpress_operator_k8s_api_calls_total', "Kubernetes API calls", ['verb', 'kind'])
+API_ERRORS = prometheus_client.Counter(
+    'wordpress_operator_k8s_api_errors_total', "Kubernetes API calls that failed", ['verb', 'kind', 'status'])
+SWEEP_SECONDS = prometheus_client.Histogram(
+    'wordpress_operator_sweep_seconds', "Duration of a check_secrets_timer tick", buckets=LATENCY_BUCKETS)
+SWEEP_BLOGS_FOUND = prometheus_client.Counter(
+    'wordpress_operator_sweep_blogs_found_total', "Blogs claimed by check_secrets_timer")
+SWEEP_BLOGS_PROVISIONED = prometheus_client.Counter(
+    'wordpress_operator_sweep_blogs_provisioned_total', "Blogs provisioned by check_secrets_timer")
+API_RETRIES = prometheus_client.Counter(
+    'wordpress_operator_k8s_api_retries_total', "Kubernetes API calls retried after a 429 or 5xx",
+    ['verb', 'kind', 'status'])
+API_QUEUE_DEPTH = prometheus_client.Gauge(
+    'wordpress_operator_k8s_api_queue_depth', "Kubernetes API calls waiting for the QPS budget or a free slot")
+API_WAIT_SECONDS = prometheus_client.Histogram(
+    'wordpress_operator_k8s_api_wait_seconds', "Time a Kubernetes API call waited in the scheduler's queue",
+    ['priority'], buckets=LATENCY_BUCKETS)
+POSTGRES_CONNECT_SECONDS = prometheus_client.Histogram(
+    'wordpress_operator_postgres_connect_seconds', "Time to open a PostgreSQL connection",
+    buckets=LATENCY_BUCKETS)
+STARTUP_SECONDS = prometheus_client.Gauge(
+    'wordpress_operator_startup_seconds', "Seconds from the process start to the operator loaded (import), "
+    "started (startup) and done resuming the Wordpress resources (resync)", ['phase'])
+RESUMED = prometheus_client.Counter(
+    'wordpress_operator_resumed_total', "Wordpress resources resumed, already converged or reconciled",
+    ['outcome'])
+RESYNCED = prometheus_client.Counter(
+    'wordpress_operator_resynced_total', "Wordpress resources touched by the resync timer, left unreconciled by kopf")
+WARM_POOL_CLAIMS = prometheus_client.Counter(
+    'wordpress_operator_warm_pool_claims_total', "Blogs provisioned on an idle instance of the warm pool (claimed), "
+    "or on a new Wordpress resource with none Ready (empty)", ['outcome'])
+
+# the monotonic time this module was imported, the process start when /proc is not available
+_IMPORTED = time.monotonic()
+
+
+def uptime() -> float:
+    """Seconds since the process started."""
+    try:
+        with open('/proc/self/stat') as f:
+            # the 22nd field, after the parenthesized command name: clock ticks from boot to the start
+            started = int(f.read().rpartition(')')[2].split()[19]) / os.sysconf('SC_CLK_TCK')
+        with open('/proc/uptime') as f:
+            return float(f.read().split()[0]) - started
+    except (OSError, ValueError, IndexError):
+        return time.monotonic() - _IMPORTED
+
+
+def start_server():
+    """Serves the metrics on ``METRICS_PORT`` (0 disables the endpoint)."""
+    if METRICS_PORT:
+        prometheus_client.start_http_server(METRICS_PORT)
+        logging.info("Metrics served on port %d", METRICS_PORT)
+
@@ -0,0 +1,183 @@
+"""Per-blog object cache: Redis or Memcached for WordPress' options, transients and query results.
+
+With ``object_cache`` in its spec a blog gets its own cache Deployment and Service
+(``templates/cache``), or with ``host`` attaches to a shared instance, its keys prefixed with
+a salt of its own (its hostname). WordPress is configured through ``WORDPRESS_CONFIG_EXTRA``
+for the Redis Object Cache and Memcached Object Cache ``object-cache.php`` drop-ins, which the
+WordPress image does not include: an init container of the WordPress pods downloads the
+engine's plugin into ``wp-content/plugins``, installs it only if its sha256 is the pinned one,
+and writes an ``object-cache.php`` loading its drop-in (``DROPIN``). Memcached needs a WordPress
+``image`` with the PHP memcache extension (``validate``).
+
+Deleting a blog deletes its own cache, or removes its keys from a shared Redis (``flush``);
+on a shared Memcached they are left to expire.
+"""
+import asyncio
+import logging
+import math
+import os
+import re
+
+import kubernetes
+
+# image and port of each engine
+ENGINES = {
+    'redis': ('redis:7.2-alpine', 6379),
+    'memcached': ('memcached:1.6-alpine', 11211),
+}
+DEFAULT_MEMORY = '64Mi'
+
+# the plugin of each engine: directory in wp-content/plugins, download URL, drop-in in the plugin
+# and sha256 of the zip, without which (or when the download differs) the plugin is not installed
+PLUGINS = {
+    'redis': ('redis-cache', 'https://downloads.wordpress.org/plugin/redis-cache.2.5.4.zip', 'includes/object-cache.php',
+              os.environ.get('OBJECT_CACHE_REDIS_SHA256', '')),
+    'memcached': ('memcached', 'https://downloads.wordpress.org/plugin/memcached.4.0.0.zip', 'object-cache.php',
+                  os.environ.get('OBJECT_CACHE_MEMCACHED_SHA256', '')),
+}
+
+# wp-content/object-cache.php: the drop-in of the cache configured in wp-config.php, as long as it
+# is and PHP has its client (Predis, bundled with the Redis plugin; the memcache extension, which
+# the stock image lacks); defining no wp_cache_* function, it leaves WordPress to its own cache
+DROPIN = f"""<?php
+// written by the wordpress-operator (see object_cache.py)
+if (defined('WP_REDIS_HOST') && file_exists(WP_CONTENT_DIR . '/plugins/{PLUGINS['redis'][0]}/{PLUGINS['redis'][2]}')) {{
+    require_once WP_CONTENT_DIR . '/plugins/{PLUGINS['redis'][0]}/{PLUGINS['redis'][2]}';
+}} elseif (isset($GLOBALS['memcached_servers']) && class_exists('Memcache')
+          && file_exists(WP_CONTENT_DIR . '/plugins/{PLUGINS['memcached'][0]}/{PLUGINS['memcached'][2]}')) {{
+    require_once WP_CONTENT_DIR . '/plugins/{PLUGINS['memcached'][0]}/{PLUGINS['memcached'][2]}';
+}}
+"""
+
+# run by the init container with the WordPress image (curl, sha256sum, and PHP for the zip without
+# unzip): the plugin is downloaded once per URL and digest; a failed download, or one not matching
+# the pinned sha256, leaves WordPress without the cache
+DROPIN_SCRIPT = """cd /var/www/html && mkdir -p wp-content/plugins
+if [ "$(cat "wp-content/plugins/$PLUGIN/.wordpress-operator" 2>/dev/null)" != "$PLUGIN_URL $PLUGIN_SHA256" ]; then
+  if [ -n "$PLUGIN_SHA256" ] && curl -fsSL -o /tmp/plugin.zip "$PLUGIN_URL" &&
+      echo "$PLUGIN_SHA256  /tmp/plugin.zip" | sha256sum -c - >/dev/null 2>&1 && php -r '$zip = new ZipArchive();
+      exit($zip->open("/tmp/plugin.zip") === true && $zip->extractTo("wp-content/plugins") ? 0 : 1);'; then
+    echo "$PLUGIN_URL $PLUGIN_SHA256" > "wp-content/plugins/$PLUGIN/.wordpress-operator"
+  else
+    echo "$PLUGIN_URL not installed (no sha256 pinned, download failed or sha256 mismatch):" \\
+      "WordPress runs without the object cache" >&2
+  fi
+fi
+printf '%s' "$DROPIN" > wp-content/object-cache.php
+if [ -d "wp-content/plugins/$PLUGIN" ]; then chown -R www-data:www-data "wp-content/plugins/$PLUGIN"; fi
+chown www-data:www-data wp-content wp-content/plugins wp-content/object-cache.php
+"""
+# room for the engine itself above the cached data, in the container memory limit
+OVERHEAD_MIB = 32
+
+
+class CacheError(Exception):
+    pass
+
+
+def validate(spec):
+    """Raises CacheError for an ``object_cache`` a Wordpress spec cannot use."""
+    cache = spec.get('object_cache')
+    if cache is not None and cache.get('engine') == 'memcached' and not spec.get('image'):
+        raise CacheError("the memcached object cache needs an image with the PHP memcache extension")
+
+
+def settings(name: str, spec):
+    """The object cache of a Wordpress spec (see ``resolve``), or None without ``object_cache``."""
+    cache = spec.get('object_cache')
+    return None if cache is None else resolve(name, spec, cache)
+
+
+def dedicated(spec) -> bool:
+    """Whether a Wordpress spec has an object cache of its own, rather than a shared one."""
+    return spec.get('object_cache') is not None and not spec['object_cache'].get('host')
+
+
+def resolve(name: str, spec, cache) -> dict:
+    """Engine, image, host, port, memory (MiB) and key salt of the ``object_cache`` of a Wordpress spec."""
+    engine = cache.get('engine', 'redis')
+    image, port = ENGINES[engine]
+    memory = int(kubernetes.utils.parse_quantity(cache.get('memory', DEFAULT_MEMORY)))
+    return {
+        'engine': engine,
+        'host': cache.get('host') or f"{name}-cache",
+        'port': cache.get('port', port),
+        'image': image,
+        'memory_mib': max(1, math.ceil(memory / 2 ** 20)),
+        'salt': f"{spec.get('hostname', name)}:",
+    }
+
+
+def engine_args(cache: dict) -> list:
+    """The command line of a dedicated cache: an LRU cache of ``memory`` without persistence."""
+    if cache['engine'] == 'memcached':
+        return ['-m', str(cache['memory_mib'])]
+    return ['--maxmemory', f"{cache['memory_mib']}mb", '--maxmemory-policy', 'allkeys-lru',
+            '--save', '', '--appendonly', 'no']
+
+
+def _php(value: str) -> str:
+    return "'" + value.replace('\\', '\\\\').replace("'", "\\'") + "'"
+
+
+def wordpress_config(cache: dict) -> str:
+    """The ``wp-config.php`` lines pointing the object-cache drop-in at the cache."""
+    lines = [f"define('WP_CACHE_KEY_SALT', {_php(cache['salt'])});"]
+    if cache['engine'] == 'memcached':
+        lines.append(f"$memcached_servers = array('default' => array({_php(cache['host'])} . ':' . {cache['port']:d}));")
+    else:
+        lines += [f"define('WP_REDIS_HOST', {_php(cache['host'])});",
+                  f"define('WP_REDIS_PORT', {cache['port']:d});",
+                  f"define('WP_REDIS_PREFIX', {_php(cache['salt'])});"]
+    return '\n'.join(lines)
+
+
+def _encode(*args) -> bytes:
+    out = [b'*%d\r\n' % len(args)]
+    for arg in args:
+        arg = arg if isinstance(arg, bytes) else str(arg).encode('utf-8')
+        out.append(b'$%d\r\n%s\r\n' % (len(arg), arg))
+    return b''.join(out)
+
+
+async def _reply(reader):
+    line = (await reader.readline()).rstrip(b'\r\n')
+    kind, rest = line[:1], line[1:]
+    if kind == b'-':
+        raise CacheError(rest.decode('utf-8', 'replace'))
+    if kind == b':':
+        return int(rest)
+    if kind == b'$':
+        size = int(rest)
+        return None if size < 0 else (await reader.readexactly(size + 2))[:-2]
+    if kind == b'*':
+        size = int(rest)
+        return None if size < 0 else [await _reply(reader) for _ in range(size)]
+    if kind == b'+':
+        return rest
+    raise CacheError(f"Unexpected Redis reply: {line[:80]!r}")
+
+
+async def flush(cache: dict, timeout: float = 10.0) -> int:
+    """Deletes the keys of a blog (those starting with its salt) from a shared Redis.
+
+    Returns the number of keys deleted.
+    """
+    if cache['engine'] != 'redis':
+        logging.info("Keys %s* left to expire on the shared %s %s", cache['salt'], cache['engine'], cache['host'])
+        return 0
+    reader, writer = await asyncio.wait_for(asyncio.open_connection(cache['host'], cache['port']), timeout)
+    pattern = re.sub(r'([*?\[\]\\])', r'\\\1', cache['salt']) + '*'
+    deleted = 0
+    try:
+        cursor = b'0'
+        while True:
+            writer.write(_encode('SCAN', cursor, 'MATCH', pattern, 'COUNT', 1000))
+            cursor, keys = await asyncio.wait_for(_reply(reader), timeout)
+            if keys:
+                writer.write(_encode('UNLINK', *keys))
+                deleted += await asyncio.wait_for(_reply(reader), timeout)
+            if cursor == b'0':
+                return deleted
+    finally:
+        writer.close()
@@ -0,0 +1,478 @@
+"""Precompiled, cached rendering of the manifests under ``templates/``.
+
+Each template is read and parsed once into a tree of small render functions
+with the ``{placeholder}`` fields left open, and kept in memory until the
+file's mtime changes. Rendering a manifest then only fills in the fields and
+builds fresh dicts/lists, without any disk read or YAML parse.
+
+An unquoted placeholder that is a whole value keeps the type of what it is
+filled with (a number, a dict...); filled with ``None`` it drops its key.
+
+Run ``python rendering.py --blogs 1000`` to measure the per-blog rendering
+cost (add ``--legacy`` to compare with ``str.format`` + ``yaml.safe_load``).
+"""
+import argparse
+import base64
+import functools
+import hashlib
+import json
+import math
+import os
+import re
+import secrets
+import string
+import threading
+import time
+
+import kubernetes
+import yaml
+
+import hibernation
+import object_cache
+
+TEMPLATES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'templates')
+
+_TOKEN = '__wptpl{}__'
+_TOKEN_RE = re.compile(r'__wptpl(\d+)__')
+
+# rendered by a placeholder filled with None: the key or item is left out
+_OMIT = object()
+
+
+@functools.lru_cache(maxsize=1024)
+def _resolve_plain(value: str):
+    """Resolves a plain YAML scalar the way ``yaml.safe_load`` would (``"2"`` -> ``2``)."""
+    return yaml.safe_load(value) if value else None
+
+
+def _compile_scalar(text: str, plain: bool, fields: list):
+    """Compiles a scalar containing placeholder tokens into a render function."""
+    parts = _TOKEN_RE.split(text)
+    if plain and len(parts) == 3 and not parts[0] and not parts[2]:
+        # the whole scalar is one unquoted placeholder: keep the YAML typing
+        key, spec = fields[int(parts[1])]
+
+        def render_value(values):
+            if values[key] is None:
+                return _OMIT
+            value = format(values[key], spec) if spec else values[key]
+            return _resolve_plain(value) if isinstance(value, str) else value
+        return render_value
+
+    pieces = []
+    for i, part in enumerate(parts):
+        if i % 2:
+            pieces.append(fields[int(part)])
+        elif part:
+            pieces.append(part)
+
+    def render_text(values):
+        out = []
+        for piece in pieces:
+            if isinstance(piece, str):
+                out.append(piece)
+            else:
+                key, spec = piece
+                out.append(format(values[key], spec))
+        return ''.join(out)
+    return render_text
+
+
+def _compile_node(node: yaml.Node, data, fields: list):
+    """Compiles a composed YAML node (and its loaded value) into a render function."""
+    if isinstance(node, yaml.MappingNode):
+        items = [(_compile_node(k, key, fields), _compile_node(v, data[key], fields))
+                 for (k, v), key in zip(node.value, data)]
+        def render_mapping(values):
+            rendered = {k(values): v(values) for k, v in items}
+            return {k: v for k, v in rendered.items() if v is not _OMIT}
+        return render_mapping
+    if isinstance(node, yaml.SequenceNode):
+        items = [_compile_node(n, d, fields) for n, d in zip(node.value, data)]
+        return lambda values: [value for value in (item(values) for item in items) if value is not _OMIT]
+    if isinstance(data, str) and _TOKEN_RE.search(data):
+        return _compile_scalar(data, node.style is None, fields)
+    return lambda values: data
+
+
+class Template:
+    """A manifest template parsed once, with its placeholders left open."""
+
+    def __init__(self, path: str, text: str):
+        self.path = path
+        fields = []
+        source = []
+        for literal, field, spec, conversion in string.Formatter().parse(text):
+            source.append(literal)
+            if field is None:
+                continue
+            if not field or conversion:
+                raise ValueError(f"Unsupported placeholder {{{field}!{conversion}}} in {path}")
+            source.append(_TOKEN.format(len(fields)))
+            fields.append((field, spec))
+        source = ''.join(source)
+        self.fields = frozenset(field for field, _ in fields)
+        self._render = _compile_node(yaml.compose(source), yaml.safe_load(source), fields)
+
+    def render(self, **values) -> dict:
+        """Returns a new manifest dict with the placeholders filled from ``values``."""
+        missing = self.fields.difference(values)
+        if missing:
+            raise KeyError(f"Missing values for {self.path}: {', '.join(sorted(missing))}")
+        return self._render(values)
+
+
+_cache = {}
+_cache_lock = threading.Lock()
+
+
+def get_template(relpath: str) -> Template:
+    """Returns the compiled template, recompiling it only when the file changed on disk."""
+    path = os.path.join(TEMPLATES_DIR, relpath)
+    mtime = os.stat(path).st_mtime_ns
+    cached = _cache.get(path)
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+    with _cache_lock:
+        cached = _cache.get(path)
+        if cached is None or cached[0] != mtime:
+            with open(path, 'rt') as f:
+                cached = (mtime, Template(path, f.read()))
+            _cache[path] = cached
+    return cached[1]
+
+
+@functools.lru_cache(maxsize=1)
+def templates_digest() -> str:
+    """A digest of the templates and of the code filling them in, as loaded by this process.
+
+    The manifests rendered from the same spec only change when it does.
+    """
+    digest = hashlib.sha256()
+    sources = [os.path.abspath(__file__), object_cache.__file__]
+    for root, _, files in sorted(os.walk(TEMPLATES_DIR)):
+        sources += [os.path.join(root, f) for f in sorted(files)]
+    for path in sources:
+        with open(path, 'rb') as f:
+            digest.update(os.path.relpath(path, TEMPLATES_DIR).encode('utf-8') + b'\0' + f.read())
+    return digest.hexdigest()[:16]
+
+
+def render(relpath: str, **values) -> dict:
+    """Renders the template at ``templates/<relpath>`` into a manifest dict."""
+    return get_template(relpath).render(**values)
+
+
+def _mysql_password():
+    # random secure password
+    return base64.b64encode(secrets.token_urlsafe(16).encode('ascii')).decode('ascii')
+
+
+# WordPress image and container resources of a Wordpress CR without spec.image / spec.resources
+WORDPRESS_IMAGE = 'wordpress:6.2.1-apache'
+WORDPRESS_FPM_IMAGE = 'wordpress:6.2.1-fpm'
+WORDPRESS_RESOURCES = {'requests': {'cpu': '100m', 'memory': '128Mi'}}
+
+
+def performance_runtime(spec) -> bool:
+    """Whether WordPress runs on php-fpm behind nginx, rather than on Apache."""
+    return spec.get('runtime', 'apache') == 'performance'
+
+
+def wordpress_image(spec) -> str:
+    return spec.get('image', WORDPRESS_FPM_IMAGE if performance_runtime(spec) else WORDPRESS_IMAGE)
+
+
+def scales_out(spec) -> bool:
+    """Whether WordPress can run more than one pod, on a ReadWriteMany volume."""
+    return spec.get('wp_access_mode', 'ReadWriteOnce') == 'ReadWriteMany'
+
+
+def _autoscaling_values(name: str, autoscaling) -> dict:
+    return dict(name=name,
+                min_replicas=autoscaling.get('min_replicas', 1),
+                max_replicas=autoscaling.get('max_replicas', 1),
+                target_cpu_utilization=autoscaling.get('target_cpu_utilization', 80))
+
+
+def _object_cache_values(name: str, spec) -> dict:
+    cache = object_cache.resolve(name, spec, spec.get('object_cache') or {})
+    return dict(name=name, engine=cache['engine'], image=cache['image'], port=cache['port'],
+                args=object_cache.engine_args(cache), cache_replicas=None,
+                memory_limit=f"{cache['memory_mib'] + object_cache.OVERHEAD_MIB}Mi")
+
+
+def dropin_init_containers(name: str, spec):
+    """The init container installing the object cache drop-in of a Wordpress CR, or None."""
+    cache = object_cache.settings(name, spec)
+    if cache is None:
+        return None
+    plugin, url, _, sha256 = object_cache.PLUGINS[cache['engine']]
+    return [render('cache/object-cache-dropin.yaml', image=wordpress_image(spec),
+                   command=['sh', '-c', object_cache.DROPIN_SCRIPT], plugin=plugin, plugin_url=url,
+                   plugin_sha256=sha256, dropin=object_cache.DROPIN)['container']]
+
+
+def wordpress_config(name: str, spec):
+    """The ``WORDPRESS_CONFIG_EXTRA`` variable (PHP added to ``wp-config.php``) of a Wordpress CR, or None."""
+    lines = []
+    cache = object_cache.settings(name, spec)
+    if cache is not None:
+        lines.append(object_cache.wordpress_config(cache))
+    return {'name': 'WORDPRESS_CONFIG_EXTRA', 'value': '\n'.join(lines)} if lines else None
+
+
+# nginx image and cache of a Wordpress CR's page_cache without image / ttl / size
+PAGE_CACHE_IMAGE = 'nginx:1.27-alpine'
+PAGE_CACHE_TTL = '10m'
+PAGE_CACHE_SIZE = '1Gi'
+
+# set on the WordPress pods: hash of the nginx configuration, so changing it restarts them
+PAGE_CACHE_ANNOTATION = 'gdgitalia.dev/page-cache-config'
+
+
+def _page_cache_values(name: str, page_cache) -> dict:
+    size = int(kubernetes.utils.parse_quantity(page_cache.get('size', PAGE_CACHE_SIZE)))
+    return dict(name=name, max_size=f"{max(1, math.ceil(size / 2 ** 20))}m",
+                ttl=page_cache.get('ttl', PAGE_CACHE_TTL))
+
+
+# nginx image of the performance runtime, and its PHP settings (see ``_runtime_values``)
+RUNTIME_NGINX_IMAGE = 'nginx:1.27-alpine'
+RUNTIME_ACCELERATED_FILES = 20000
+RUNTIME_REVALIDATE_FREQ = 60
+RUNTIME_REALPATH_CACHE = ('4096K', 600)
+RUNTIME_MAX_REQUESTS = 1000
+# memory of a php-fpm child serving WordPress, outside the OPcache shared memory
+RUNTIME_CHILD_MIB = 48
+
+# set on the WordPress pods: hash of the php-fpm and nginx configuration, so changing it restarts them
+RUNTIME_ANNOTATION = 'gdgitalia.dev/runtime-config'
+
+
+def _memory_request_mib(spec) -> int:
+    """The memory request of the WordPress container, in MiB (a limit alone is the request)."""
+    resources = spec.get('resources', WORDPRESS_RESOURCES)
+    memory = ((resources.get('requests') or {}).get('memory') or (resources.get('limits') or {}).get('memory')
+              or WORDPRESS_RESOURCES['requests']['memory'])
+    return int(kubernetes.utils.parse_quantity(memory)) // 2 ** 20
+
+
+def _runtime_values(name: str, spec) -> dict:
+    """The PHP settings of the performance runtime, from the memory request of the WordPress container:
+    a quarter of it for the OPcache (32 to 256 MiB), the rest for as many php-fpm children as fit."""
+    memory = _memory_request_mib(spec)
+    opcache = min(max(memory // 4, 32), 256)
+    return dict(name=name, opcache_memory=opcache, interned_strings=max(opcache // 8, 8),
+                accelerated_files=RUNTIME_ACCELERATED_FILES, revalidate_freq=RUNTIME_REVALIDATE_FREQ,
+                realpath_cache_size=RUNTIME_REALPATH_CACHE[0], realpath_cache_ttl=RUNTIME_REALPATH_CACHE[1],
+                max_children=max((memory - opcache) // RUNTIME_CHILD_MIB, 2), max_requests=RUNTIME_MAX_REQUESTS)
+
+
+def _wordpress_values(name: str, spec, database: dict) -> dict:
+    values = dict(name=name,
+                  image=wordpress_image(spec),
+                  # left to the HorizontalPodAutoscaler
+                  replicas=None if spec.get('autoscaling') else spec.get('replicas', 1),
+                  strategy='RollingUpdate' if scales_out(spec) else 'Recreate',
+                  resources=spec.get('resources', WORDPRESS_RESOURCES),
+                  db_host=database['host'],
+                  db_name=database['name'],
+                  db_user=database['user'],
+                  config_extra=wordpress_config(name, spec),
+                  init_containers=dropin_init_containers(name, spec),
+                  pod_annotations=None,
+                  wordpress_port='wordpress',
+                  wordpress_container_port=80,
+                  page_cache_container=None,
+                  page_cache_volume=None,
+                  runtime_php_mount=None,
+                  runtime_pool_mount=None,
+                  runtime_container=None,
+                  runtime_volume=None)
+    page_cache = spec.get('page_cache')
+    if page_cache is not None:
+        # nginx takes over the 'wordpress' port the Service targets, in front of Apache
+        config = render('cache/page-cache-config.yaml', **_page_cache_values(name, page_cache))
+        sidecar = render('cache/page-cache-sidecar.yaml', name=name,
+                         image=page_cache.get('image', PAGE_CACHE_IMAGE),
+                         cache_size=page_cache.get('size', PAGE_CACHE_SIZE))
+        digest = hashlib.sha256(config['data']['default.conf'].encode('utf-8')).hexdigest()[:16]
+        values.update(pod_annotations={PAGE_CACHE_ANNOTATION: digest},
+                      wordpress_port='apache',
+                      page_cache_container=sidecar['container'],
+                      page_cache_volume=sidecar['volume'])
+    if performance_runtime(spec):
+        # nginx serves the static files and passes PHP to php-fpm, on Apache's port 80 (behind the
+        # page cache, if any)
+        config = render('wordpress/wordpress-runtime-config.yaml', **_runtime_values(name, spec))
+        runtime = render('wordpress/wordpress-runtime.yaml', name=name, image=RUNTIME_NGINX_IMAGE,
+                         port='wordpress' if page_cache is None else 'http')
+        digest = hashlib.sha256(json.dumps(config['data'], sort_keys=True).encode('utf-8')).hexdigest()[:16]
+        values.update(pod_annotations=dict(values['pod_annotations'] or {}, **{RUNTIME_ANNOTATION: digest}),
+                      wordpress_port='fastcgi',
+                      wordpress_container_port=9000,
+                      runtime_php_mount=runtime['php_mount'],
+                      runtime_pool_mount=runtime['pool_mount'],
+                      runtime_container=runtime['container'],
+                      runtime_volume=runtime['volume'])
+    return values
+
+
+# MySQL image of the Wordpress CRs with a MySQL Deployment of their own
+MYSQL_IMAGE = 'mysql:8.0'
+
+# The MySQL command on a data directory cloned from a golden snapshot (see golden.py): the image's
+# entrypoint only sets the passwords when it initializes an empty one, so the passwords it was
+# seeded with are replaced by the blog's on every start
+GOLDEN_MYSQL_COMMAND = ['bash', '-c', (
+    "printf \"ALTER USER IF EXISTS 'root'@'localhost' IDENTIFIED BY '%s', 'root'@'%%' IDENTIFIED BY '%s', "
+    "'%s'@'%%' IDENTIFIED BY '%s';\\n\" \"$MYSQL_ROOT_PASSWORD\" \"$MYSQL_ROOT_PASSWORD\" \"$MYSQL_USER\" "
+    "\"$MYSQL_PASSWORD\" > /tmp/golden-init.sql && exec docker-entrypoint.sh mysqld --init-file=/tmp/golden-init.sql"
+)]
+
+
+def _golden_values(key: str, golden) -> dict:
+    """The values depending on the golden snapshots the volumes of a Wordpress CR are cloned from."""
+    golden = golden or {}
+    snapshot = golden.get(key)
+    return dict(data_source={'apiGroup': 'snapshot.storage.k8s.io', 'kind': 'VolumeSnapshot', 'name': snapshot}
+                if snapshot else None,
+                mysql_command=GOLDEN_MYSQL_COMMAND if golden.get('mysql-volume') else None)
+
+
+def hostname(name: str, spec) -> str:
+    return spec.get('hostname', f"{name}.gdgitalia.com")
+
+
+# longest name of a Wordpress CR: its '<name>-activator' Service must be a DNS-1035 label (63)
+MAX_NAME_LENGTH = 53
+
+
+def blog_resource_name(hostname: str, blog_id) -> str:
+    """The name of the Wordpress CR of a blog: the first label of its hostname as a DNS-1035
+    label, suffixed with its id (the label alone may be taken, e.g. under another domain)."""
+    suffix = f"-{blog_id}"
+    label = re.sub(r'[^a-z0-9]+', '-', hostname.split('.', 1)[0].lower()).strip('-')
+    if not label[:1].isalpha():
+        label = f"blog-{label}".rstrip('-')
+    return label[:MAX_NAME_LENGTH - len(suffix)].rstrip('-') + suffix
+
+
+def _hibernation_values(key: str, name: str, spec, hibernated: bool) -> dict:
+    """The values of a Wordpress CR that hibernates (see hibernation.py): hibernated, no pods and the
+    Ingress to the activator; awake, one MySQL and cache pod, the count they were scaled down from."""
+    if hibernated:
+        return {'wordpress-deployment': dict(replicas=0),
+                'mysql-deployment': dict(mysql_replicas=0),
+                'object-cache-deployment': dict(cache_replicas=0),
+                'wordpress-ingress': dict(service=f"{name}-activator")}.get(key, {})
+    if hibernation.enabled(spec):
+        return {'mysql-deployment': dict(mysql_replicas=1),
+                'object-cache-deployment': dict(cache_replicas=1)}.get(key, {})
+    return {}
+
+
+def dedicated_database(name: str) -> dict:
+    """The database of a Wordpress CR on its own MySQL Deployment (see ``templates/mysql``)."""
+    return {'host': f"{name}-mysql", 'name': 'wordpress', 'user': 'wordpress'}
+
+
+# The manifests of one Wordpress CR: template and values derived from the CR spec and its database
+BLOG_MANIFESTS = {
+    'mysql-password': ('mysql/mysql-password.yaml',
+                       lambda name, spec, database: dict(name=name, mysql_password=_mysql_password())),
+    'mysql-volume': ('mysql/mysql-volume.yaml',
+                     lambda name, spec, database: dict(name=name, mysql_size=spec.get('mysql_size', '1Gi'))),
+    'mysql-deployment': ('mysql/mysql-deployment.yaml',
+                         lambda name, spec, database: dict(name=name, mysql_image=MYSQL_IMAGE, mysql_replicas=None)),
+    'mysql-service': ('mysql/mysql-service.yaml',
+                      lambda name, spec, database: dict(name=name)),
+    'wordpress-volume': ('wordpress/wordpress-volume.yaml',
+                         lambda name, spec, database: dict(name=name, wp_size=spec.get('wp_size', '1Gi'),
+                                                           wp_access_mode=spec.get('wp_access_mode', 'ReadWriteOnce'))),
+    'wordpress-deployment': ('wordpress/wordpress-deployment.yaml', _wordpress_values),
+    'wordpress-service': ('wordpress/wordpress-service.yaml',
+                          lambda name, spec, database: dict(name=name)),
+    'wordpress-ingress': ('wordpress/wordpress-ingress.yaml',
+                          lambda name, spec, database: dict(name=name, service=name, hostname=hostname(name, spec))),
+    'wordpress-activator': ('wordpress/wordpress-activator.yaml',
+                            lambda name, spec, database: dict(name=name, activator_host=hibernation.ACTIVATOR_HOST)),
+    'wordpress-autoscaler': ('wordpress/wordpress-autoscaler.yaml',
+                             lambda name, spec, database: _autoscaling_values(name, spec.get('autoscaling') or {})),
+    'object-cache-deployment': ('cache/object-cache-deployment.yaml',
+                                lambda name, spec, database: _object_cache_values(name, spec)),
+    'object-cache-service': ('cache/object-cache-service.yaml',
+                             lambda name, spec, database: dict(name=name, port=object_cache.resolve(
+                                 name, spec, spec.get('object_cache') or {})['port'])),
+    'page-cache-config': ('cache/page-cache-config.yaml',
+                          lambda name, spec, database: _page_cache_values(name, spec.get('page_cache') or {})),
+    'wordpress-runtime-config': ('wordpress/wordpress-runtime-config.yaml',
+                                 lambda name, spec, database: _runtime_values(name, spec)),
+}
+
+
+def manifest_values(key: str, name: str, spec, database: dict = None, golden: dict = None,
+                    hibernated: bool = False) -> dict:
+    """The values of one of the ``BLOG_MANIFESTS`` (see ``render_manifest``)."""
+    relpath, values = BLOG_MANIFESTS[key]
+    return dict(values(name, spec, database or dedicated_database(name)), **_golden_values(key, golden),
+                **_hibernation_values(key, name, spec, hibernated))
+
+
+def render_manifest(key: str, name: str, spec, database: dict = None, golden: dict = None,
+                    hibernated: bool = False) -> dict:
+    """Renders one of the ``BLOG_MANIFESTS`` for the Wordpress CR ``name`` with ``spec``.
+
+    ``database`` is the MySQL database WordPress connects to, by default ``dedicated_database``,
+    ``golden`` the snapshot each volume is cloned from, by manifest key (see golden.py), and
+    ``hibernated`` whether the blog is scaled to zero (see hibernation.py).
+    """
+    return render(BLOG_MANIFESTS[key][0], **manifest_values(key, name, spec, database, golden, hibernated))
+
+
+def render_blog(name: str, spec) -> dict:
+    """Renders all the manifests of one Wordpress CR, keyed like ``BLOG_MANIFESTS``."""
+    return {key: render_manifest(key, name, spec) for key in BLOG_MANIFESTS}
+
+
+def _render_blog_legacy(name: str, spec) -> dict:
+    """Renders like the handlers used to: read, ``str.format`` and parse on every call."""
+    manifests = {}
+    for key, (relpath, _) in BLOG_MANIFESTS.items():
+        with open(os.path.join(TEMPLATES_DIR, relpath), 'rt') as f:
+            manifests[key] = yaml.safe_load(f.read().format(**manifest_values(key, name, spec)))
+    return manifests
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Render the manifests of N blogs and report the per-blog cost.")
+    parser.add_argument('--blogs', type=int, default=1000, help="number of blogs to render")
+    parser.add_argument('--legacy', action='store_true', help="also time the read/format/safe_load path")
+    parser.add_argument('--dump', metavar='NAME', help="print the manifests of one blog as YAML and exit")
+    args = parser.parse_args(argv)
+
+    if args.dump:
+        spec = {'hostname': f"{args.dump}.gdgitalia.it", 'wp_size': '2Gi', 'mysql_size': '2Gi'}
+        print(yaml.safe_dump_all(render_blog(args.dump, spec).values(), sort_keys=False))
+        return
+
+    def timed(render_fn):
+        start = time.perf_counter()
+        for i in range(args.blogs):
+            render_fn(f"blog{i}", {'hostname': f"blog{i}.gdgitalia.it", 'wp_size': '2Gi', 'mysql_size': '2Gi'})
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    render_blog('warmup', {})
+    print(f"compile: {(time.perf_counter() - start) * 1e3:.2f} ms for {len(BLOG_MANIFESTS)} templates")
+    elapsed = timed(render_blog)
+    print(f"cached: {args.blogs} blogs in {elapsed:.3f} s, {elapsed / args.blogs * 1e6:.1f} us/blog")
+    if args.legacy:
+        legacy = timed(_render_blog_legacy)
+        print(f"legacy: {args.blogs} blogs in {legacy:.3f} s, {legacy / args.blogs * 1e6:.1f} us/blog"
+              f" ({legacy / elapsed:.1f}x)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,138 @@
+"""Operator-wide scheduling of the Kubernetes API calls: a QPS budget, a concurrency cap and priorities.
+
+Every call made through ``k8s.py`` first takes a token from a token bucket (``K8S_API_QPS``
+per second, up to ``K8S_API_BURST`` at once) and a slot among the ``K8S_API_WORKERS`` calls
+in flight. When they are short, the calls wait in a queue ordered by priority class (deletes
+first, then status reports, updates, creations and last the Wordpress resources created for
+new blogs), then by the ``priority`` of the Wordpress resource they are for, then first come
+first served. A call throttled (429) or refused by an overloaded API server is retried with
+exponential backoff, never sooner than its ``Retry-After``.
+
+The handlers set the priority of the calls they make with ``with scheduler.priority(...)``.
+"""
+import asyncio
+import contextlib
+import contextvars
+import heapq
+import itertools
+import os
+import random
+import time
+
+import metrics
+
+# the priority classes, most urgent first
+CLASSES = ('delete', 'status', 'update', 'create', 'provision')
+
+# token bucket: sustained API calls per second (0: unlimited) and burst size
+QPS = float(os.environ.get('K8S_API_QPS', '50'))
+BURST = int(os.environ.get('K8S_API_BURST', '100'))
+
+# retries of a throttled call, and its backoff: BACKOFF * 2**attempt seconds, up to MAX_BACKOFF
+RETRIES = int(os.environ.get('K8S_API_RETRIES', '8'))
+BACKOFF = 0.5
+MAX_BACKOFF = 60.0
+# the statuses retried: throttled, or the API server (or a proxy in front of it) overloaded
+RETRY_STATUSES = {429, 502, 503, 504}
+
+_priority = contextvars.ContextVar('api_priority', default=('update', 0))
+
+
+@contextlib.contextmanager
+def priority(cls: str, rank: int = 0):
+    """Runs the API calls made in the block (and in the tasks it starts) with a priority class.
+
+    Among the calls of one class, the higher ``rank`` goes first (e.g. the ``priority`` of the
+    Wordpress resource the calls are for).
+    """
+    token = _priority.set((cls, rank))
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+class Scheduler:
+    """A token bucket and a concurrency cap shared by all the API calls, with a priority queue."""
+
+    def __init__(self, concurrency: int, qps: float = QPS, burst: int = BURST):
+        self.qps = qps
+        self.burst = max(1, burst)
+        self.concurrency = concurrency
+        self._tokens = float(self.burst)
+        self._refilled = time.monotonic()
+        self._in_flight = 0
+        self._queue = []  # (class index, -rank, sequence, future)
+        self._sequence = itertools.count()
+        self._timer = None
+
+    def _refill(self, now: float):
+        if self.qps:
+            self._tokens = min(self.burst, self._tokens + (now - self._refilled) * self.qps)
+        self._refilled = now
+
+    def _ready(self) -> bool:
+        return self._in_flight < self.concurrency and (not self.qps or self._tokens >= 1)
+
+    def _take(self):
+        self._in_flight += 1
+        if self.qps:
+            self._tokens -= 1
+
+    def _dispatch(self):
+        """Starts the queued calls the budget allows, and a timer for the next token if short."""
+        self._refill(time.monotonic())
+        while self._queue and self._ready():
+            *_, waiter = heapq.heappop(self._queue)
+            if waiter.done():  # cancelled while queued
+                continue
+            self._take()
+            waiter.set_result(None)
+        metrics.API_QUEUE_DEPTH.set(len(self._queue))
+        if self._queue and self._in_flight < self.concurrency and self.qps and self._timer is None:
+            delay = (1 - self._tokens) / self.qps
+            self._timer = asyncio.get_running_loop().call_later(delay, self._on_timer)
+
+    def _on_timer(self):
+        self._timer = None
+        self._dispatch()
+
+    async def acquire(self):
+        """Waits for a token and a slot, in priority order."""
+        cls, rank = _priority.get()
+        start = time.monotonic()
+        self._refill(start)
+        if not self._queue and self._ready():
+            self._take()
+        else:
+            waiter = asyncio.get_running_loop().create_future()
+            heapq.heappush(self._queue, (CLASSES.index(cls), -rank, next(self._sequence), waiter))
+            self._dispatch()
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                if waiter.done() and not waiter.cancelled():
+                    self.release()  # granted just before the cancellation
+                raise
+        metrics.API_WAIT_SECONDS.labels(cls).observe(time.monotonic() - start)
+
+    def release(self):
+        self._in_flight -= 1
+        self._dispatch()
+
+    @contextlib.asynccontextmanager
+    async def slot(self):
+        await self.acquire()
+        try:
+            yield
+        finally:
+            self.release()
+
+
+def backoff(attempt: int, retry_after=None) -> float:
+    """Seconds to wait before retrying a call: exponential with jitter, at least ``Retry-After``."""
+    delay = min(MAX_BACKOFF, BACKOFF * 2 ** attempt) * random.uniform(0.5, 1.0)
+    try:
+        return max(delay, float(retry_after)) if retry_after else delay
+    except ValueError:  # an HTTP date: not sent by the API server
+        return delay
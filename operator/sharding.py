@@ -0,0 +1,203 @@
+"""Sharding: several operator replicas split the Wordpress resources and credentials Secrets.
+
+With ``WORDPRESS_SHARDING=true`` every replica keeps a Lease ``wordpress-operator-<id>`` in
+``OPERATOR_NAMESPACE`` (``<id>`` is ``WORDPRESS_SHARD_ID``, by default the pod's hostname)
+and renews it every ``RENEW_SECONDS``. The replicas with a live Lease are the members of a
+consistent-hash ring (``VNODES`` points each): a Wordpress resource or credentials Secret
+``<namespace>/<name>`` belongs to the member owning its hash, and the other replicas ignore
+it (see ``owns``). A replica joining or leaving only moves the objects of its own ring
+segments.
+
+Each replica puts its own kopf finalizer on the objects it handles (``FINALIZER_PREFIX<id>``).
+On every renewal a replica claims the objects it owns that another replica handled before
+(annotated by it, or with its finalizer): it annotates them with its own id
+(``SHARD_ANNOTATION``), which sends them to its handlers, and removes the finalizers of the
+replicas that are gone (and kopf's default one, from before sharding). A replica that could
+not renew its Lease for ``LEASE_SECONDS`` stops handling any object.
+"""
+import asyncio
+import bisect
+import datetime
+import hashlib
+import logging
+import os
+import socket
+import time
+
+import kubernetes
+
+import k8s
+
+ENABLED = os.environ.get('WORDPRESS_SHARDING', 'false').lower() in ('1', 'true', 'yes')
+SHARD_ID = os.environ.get('WORDPRESS_SHARD_ID') or socket.gethostname()
+NAMESPACE = os.environ.get('OPERATOR_NAMESPACE', 'default')
+
+LEASE_SECONDS = int(os.environ.get('WORDPRESS_SHARD_LEASE', '15'))
+RENEW_SECONDS = LEASE_SECONDS / 3
+# points of each replica on the ring: more points, more even shares
+VNODES = 64
+
+LEASE_LABEL = 'gdgitalia.dev/operator-shard'
+SHARD_ANNOTATION = 'gdgitalia.dev/shard'
+FINALIZER_PREFIX = 'gdgitalia.dev/shard-'
+# kopf's finalizer of an operator without sharding
+DEFAULT_FINALIZER = 'kopf.zalando.org/KopfFinalizerMarker'
+
+
+def _hash(key: str) -> int:
+    return int.from_bytes(hashlib.sha1(key.encode('utf-8')).digest()[:8], 'big')
+
+
+class Ring:
+    """A consistent-hash ring of the replicas."""
+
+    def __init__(self, members):
+        self.members = frozenset(members)
+        points = sorted((_hash(f"{member}#{i}"), member) for member in self.members for i in range(VNODES))
+        self._hashes = [point for point, _ in points]
+        self._owners = [member for _, member in points]
+
+    def owner(self, key: str):
+        if not self._owners:
+            return None
+        return self._owners[bisect.bisect(self._hashes, _hash(key)) % len(self._owners)]
+
+
+_ring = Ring([SHARD_ID])
+# monotonic time of the last renewal of this replica's Lease
+_renewed = None
+_task = None
+
+
+def owns(namespace: str, name: str) -> bool:
+    """Whether this replica handles the object ``<namespace>/<name>`` (always without sharding)."""
+    if not ENABLED:
+        return True
+    if _renewed is None or time.monotonic() - _renewed > LEASE_SECONDS:
+        return False  # the others may have taken over
+    return _ring.owner(f"{namespace}/{name}") == SHARD_ID
+
+
+def is_owned(namespace, name, **kwargs) -> bool:
+    """kopf filter of the Wordpress resources and credentials Secrets of this replica."""
+    return owns(namespace, name)
+
+
+def is_owned_child(namespace, labels, **kwargs) -> bool:
+    """kopf filter of the sub-resources (labelled ``app=<name>``) of this replica's Wordpress resources."""
+    return owns(namespace, labels.get('app', ''))
+
+
+def finalizer() -> str:
+    return f"{FINALIZER_PREFIX}{SHARD_ID}"
+
+
+def _lease_body() -> dict:
+    now = datetime.datetime.now(datetime.timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+    return {
+        'apiVersion': 'coordination.k8s.io/v1', 'kind': 'Lease',
+        'metadata': {'name': f"wordpress-operator-{SHARD_ID}", 'labels': {LEASE_LABEL: 'true'}},
+        'spec': {'holderIdentity': SHARD_ID, 'leaseDurationSeconds': LEASE_SECONDS, 'renewTime': now},
+    }
+
+
+async def renew() -> bool:
+    """Renews this replica's Lease and rebuilds the ring from the live ones.
+
+    Returns whether the members changed.
+    """
+    global _ring, _renewed
+    started = time.monotonic()
+    await k8s.apply(NAMESPACE, _lease_body())
+    _renewed = started
+    leases = await k8s.call(k8s.coordination_v1().list_namespaced_lease, NAMESPACE,
+                            label_selector=f"{LEASE_LABEL}=true")
+    now = datetime.datetime.now(datetime.timezone.utc)
+    members = {lease.spec.holder_identity for lease in leases.items
+               if lease.spec.renew_time is not None and lease.spec.holder_identity and
+               lease.spec.renew_time + datetime.timedelta(seconds=lease.spec.lease_duration_seconds or 0) > now}
+    members.add(SHARD_ID)
+    if members == _ring.members:
+        return False
+    _ring = Ring(members)
+    logging.info("Shard ring: %s (%s)", ', '.join(sorted(members)), SHARD_ID)
+    return True
+
+
+async def release():
+    """Deletes this replica's Lease, so the others take over its objects without waiting."""
+    try:
+        await k8s.call(k8s.coordination_v1().delete_namespaced_lease, f"wordpress-operator-{SHARD_ID}", NAMESPACE)
+    except kubernetes.client.rest.ApiException as e:
+        if e.status != 404:
+            raise e
+
+
+def _stale(finalizer: str) -> bool:
+    if finalizer.startswith(FINALIZER_PREFIX):
+        return finalizer[len(FINALIZER_PREFIX):] not in _ring.members
+    return finalizer == DEFAULT_FINALIZER
+
+
+def needs_claim(shard, finalizers) -> bool:
+    """Whether an object this replica owns was handled by another replica (or without sharding)."""
+    if shard == SHARD_ID:
+        return False
+    return shard is not None or any(f != finalizer() and (f.startswith(FINALIZER_PREFIX) or f == DEFAULT_FINALIZER)
+                                    for f in finalizers)
+
+
+async def claim(kind: str, namespace: str, name: str, resource_version: str, finalizers):
+    """Annotates an object this replica owns with its id, and drops the finalizers of departed replicas."""
+    metadata = {'annotations': {SHARD_ANNOTATION: SHARD_ID}}
+    kept = [f for f in finalizers if not _stale(f)]
+    if len(kept) != len(finalizers):
+        metadata.update(finalizers=kept, resourceVersion=resource_version)
+    body = {'metadata': metadata}
+    try:
+        if kind == 'Secret':
+            await k8s.call(k8s.core_v1().patch_namespaced_secret, name, namespace, body)
+        else:
+            await k8s.call(k8s.custom_objects().patch_namespaced_custom_object, 'gdgitalia.dev', 'v1',
+                           namespace, 'wordpress', name, body)
+    except kubernetes.client.rest.ApiException as e:
+        if e.status not in (404, 409):  # gone, or changed since indexed: claimed at the next renewal
+            raise e
+        return
+    logging.info("%s %s/%s claimed by shard %s", kind, namespace, name, SHARD_ID)
+
+
+async def run(sharded_objects):
+    """Renews the Lease and claims the newly owned objects until cancelled.
+
+    ``sharded_objects`` is the kopf index of the sharded objects: kind, namespace, name,
+    shard annotation, resourceVersion and finalizers.
+    """
+    while True:
+        try:
+            await renew()
+            await asyncio.gather(*(
+                claim(kind, namespace, name, resource_version, finalizers)
+                for objects in list(sharded_objects.values())
+                for kind, namespace, name, shard, resource_version, finalizers in list(objects)
+                if needs_claim(shard, finalizers) and owns(namespace, name)
+            ))
+        except kubernetes.client.rest.ApiException as e:
+            logging.warning("Shard %s renewal failed: %s", SHARD_ID, e)
+        await asyncio.sleep(RENEW_SECONDS)
+
+
+async def start(sharded_objects):
+    """Joins the ring, then keeps the Lease renewed in the background."""
+    global _task
+    await renew()
+    _task = asyncio.create_task(run(sharded_objects))
+
+
+async def stop():
+    """Leaves the ring."""
+    global _task
+    if _task is not None:
+        _task.cancel()
+        _task = None
+        await release()
@@ -0,0 +1,104 @@
+"""Shared MySQL tenancy: one database and user per blog on a pool of shared MySQL servers.
+
+A server of the pool is a Secret annotated ``blog-platform/mysql-server`` with its
+address and admin credentials (``MYSQL_HOST``, ``MYSQL_PORT``, ``MYSQL_USER``,
+``MYSQL_PASSWORD``, base64 encoded like any Secret data) and optionally its capacity:
+``MAX_TENANTS`` (number of blogs) and/or ``CAPACITY`` (a quantity such as ``200Gi``,
+filled with the ``mysql_size`` of its blogs). A new blog goes to the server it fills
+best (best-fit bin packing), so the servers are filled one after the other.
+
+PyMySQL is blocking: ``create_tenant`` and ``drop_tenant`` are meant to run on a thread.
+It is only imported by them, so operators without shared servers do not load it.
+"""
+import base64
+import hashlib
+
+import kubernetes
+
+SERVER_ANNOTATION = 'blog-platform/mysql-server'
+
+
+def _decode(data, key: str, default=None):
+    return base64.b64decode(data[key]).decode('utf-8') if key in data else default
+
+
+def read_server(server_id: str, data) -> dict:
+    """Decodes the address, admin credentials and capacity of a shared server Secret's data."""
+    capacity = _decode(data, 'CAPACITY')
+    return {
+        'id': server_id,
+        'host': _decode(data, 'MYSQL_HOST'),
+        'port': int(_decode(data, 'MYSQL_PORT', '3306')),
+        'user': _decode(data, 'MYSQL_USER', 'root'),
+        'password': _decode(data, 'MYSQL_PASSWORD'),
+        'max_tenants': int(_decode(data, 'MAX_TENANTS', '0')),
+        'capacity': int(kubernetes.utils.parse_quantity(capacity)) if capacity else 0,
+    }
+
+
+def tenant_names(namespace: str, name: str) -> tuple:
+    """The database and user of a blog: MySQL user names are limited to 32 characters."""
+    tenant = 'wp_' + hashlib.sha1(f"{namespace}/{name}".encode('utf-8')).hexdigest()[:16]
+    return tenant, tenant
+
+
+def size_of(spec) -> int:
+    return int(kubernetes.utils.parse_quantity(spec.get('mysql_size', '1Gi')))
+
+
+def choose_server(servers: list, tenants: dict, size: int):
+    """Best fit: the server with the smallest share of room left once the blog is placed on it.
+
+    ``tenants`` maps the server ids to the sizes of their blogs. Returns None when the blog
+    fits nowhere.
+    """
+    best = None
+    for server in servers:
+        sizes = tenants.get(server['id'], [])
+        room = 1.0  # unbounded servers are used last
+        if server['max_tenants']:
+            room = min(room, (server['max_tenants'] - len(sizes) - 1) / server['max_tenants'])
+        if server['capacity']:
+            room = min(room, (server['capacity'] - sum(sizes) - size) / server['capacity'])
+        if room < 0:
+            continue
+        if best is None or (room, server['id']) < best[0]:
+            best = ((room, server['id']), server)
+    return best[1] if best is not None else None
+
+
+def db_host(server: dict) -> str:
+    """The ``WORDPRESS_DB_HOST`` of a server."""
+    return server['host'] if server['port'] == 3306 else f"{server['host']}:{server['port']}"
+
+
+def _connect(server: dict):
+    import pymysql
+
+    return pymysql.connect(host=server['host'], port=server['port'], user=server['user'],
+                           password=server['password'], autocommit=True, connect_timeout=10)
+
+
+def create_tenant(server: dict, database: str, user: str, password: str):
+    """Creates the database and user of a blog, or resets the password of an existing user."""
+    conn = _connect(server)
+    try:
+        with conn.cursor() as cur:
+            cur.execute(f"CREATE DATABASE IF NOT EXISTS `{database}` "
+                        f"CHARACTER SET utf8mb4 COLLATE utf8mb4_unicode_ci;")
+            cur.execute("CREATE USER IF NOT EXISTS %s@'%%' IDENTIFIED BY %s;", (user, password))
+            cur.execute("ALTER USER %s@'%%' IDENTIFIED BY %s;", (user, password))
+            cur.execute(f"GRANT ALL PRIVILEGES ON `{database}`.* TO %s@'%%';", (user,))
+    finally:
+        conn.close()
+
+
+def drop_tenant(server: dict, database: str, user: str):
+    """Drops the database and user of a deleted blog."""
+    conn = _connect(server)
+    try:
+        with conn.cursor() as cur:
+            cur.execute(f"DROP DATABASE IF EXISTS `{database}`;")
+            cur.execute("DROP USER IF EXISTS %s@'%%';", (user,))
+    finally:
+        conn.close()
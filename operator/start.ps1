@@ -1,2 +1,2 @@
 .\.venv\Scripts\activate
-.\.venv\Scripts\kopf run -A wordpress_operator.py
\ No newline at end of file
+.\.venv\Scripts\kopf run -A --log-format=json wordpress_operator.py
\ No newline at end of file
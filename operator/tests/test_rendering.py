@@ -0,0 +1,181 @@
+import json
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import yaml
+
+import golden
+import rendering
+
+# filled in by the legacy rendering for a None value, and left out of its result
+_OMITTED = '__omitted__'
+
+SPECS = {
+    'defaults': {'hostname': 'blog.example.com', 'wp_size': '2Gi', 'mysql_size': '2Gi'},
+    'everything': {'hostname': 'blog.example.com', 'wp_size': '2Gi', 'mysql_size': '2Gi', 'priority': 3,
+                   'wp_access_mode': 'ReadWriteMany', 'autoscaling': {'max_replicas': 3},
+                   'resources': {'requests': {'cpu': '250m', 'memory': '512Mi'}},
+                   'object_cache': {'engine': 'redis', 'memory': '128Mi'}, 'page_cache': {'ttl': '5m'},
+                   'runtime': 'performance', 'hibernation': {'idle_after': '1h'}},
+    'memcached': {'hostname': 'blog.example.com', 'image': 'example/wordpress-memcache:6.2.1', 'replicas': 0,
+                  'object_cache': {'engine': 'memcached', 'host': 'memcached.cache', 'port': 11311}},
+}
+
+
+def _legacy_value(value) -> str:
+    if value is None:
+        return _OMITTED
+    if not isinstance(value, str):
+        return json.dumps(value)  # a YAML flow
+    if any(c in value for c in '\n"\\'):
+        return json.dumps(value)[1:-1]  # escaped for its double-quoted scalar
+    return value
+
+
+def legacy_render(relpath: str, values: dict):
+    """Renders like the handlers used to (``str.format`` and ``yaml.safe_load``), the values
+    written as YAML and the None ones left out."""
+    with open(os.path.join(rendering.TEMPLATES_DIR, relpath), 'rt') as f:
+        text = f.read()
+    return _prune(yaml.safe_load(text.format(**{key: _legacy_value(value) for key, value in values.items()})))
+
+
+def _prune(data):
+    if isinstance(data, dict):
+        return {key: _prune(value) for key, value in data.items() if value != _OMITTED}
+    if isinstance(data, list):
+        return [_prune(value) for value in data if value != _OMITTED]
+    return data
+
+
+def template_files() -> set:
+    return {os.path.relpath(os.path.join(root, f), rendering.TEMPLATES_DIR)
+            for root, _, files in os.walk(rendering.TEMPLATES_DIR) for f in files}
+
+
+class CompiledRenderingTests(unittest.TestCase):
+
+    def rendered_calls(self) -> list:
+        """The (template, values) of every render of the blog manifests and golden seeds."""
+        calls = []
+        render = rendering.render
+
+        def recording_render(relpath, **values):
+            calls.append((relpath, values))
+            return render(relpath, **values)
+
+        with mock.patch.object(rendering, 'render', recording_render):
+            for spec in SPECS.values():
+                for hibernated in (False, True):
+                    for key in rendering.BLOG_MANIFESTS:
+                        rendering.render_manifest(key, 'blog', spec, hibernated=hibernated,
+                                                  golden={'mysql-volume': 'golden-mysql', 'wordpress-volume': None})
+            for kind, (mount_path, command, security_context) in golden.SEEDS.items():
+                snapshot = golden.snapshot_name(kind, 'mysql:8.0')
+                rendering.render('golden/golden-seed-volume.yaml', name=snapshot, kind=kind, size=golden.SEED_SIZE)
+                rendering.render('golden/golden-seed-job.yaml', name=snapshot, kind=kind, image='mysql:8.0',
+                                 command=command, env=golden._seed_env(kind), mount_path=mount_path,
+                                 security_context=security_context)
+                rendering.render('golden/golden-snapshot.yaml', name=snapshot, kind=kind,
+                                 snapshot_class=golden.SNAPSHOT_CLASS)
+        return calls
+
+    def test_matches_legacy_rendering(self):
+        calls = self.rendered_calls()
+        self.assertEqual({relpath for relpath, _ in calls}, template_files())
+        for relpath, values in calls:
+            with self.subTest(relpath, name=values.get('name')):
+                self.assertEqual(rendering.render(relpath, **values), legacy_render(relpath, values))
+
+    def test_multiline_strings_kept(self):
+        # str.format would fold the lines of a double-quoted scalar into one
+        container, = rendering.dropin_init_containers('blog', SPECS['everything'])
+        env = {var['name']: var['value'] for var in container['env']}
+        self.assertEqual(env['DROPIN'], rendering.object_cache.DROPIN)
+        self.assertEqual(container['command'], ['sh', '-c', rendering.object_cache.DROPIN_SCRIPT])
+
+    def test_fresh_manifests(self):
+        first = rendering.render_manifest('wordpress-deployment', 'blog', SPECS['everything'])
+        first['spec']['template']['spec']['containers'][0]['env'].clear()
+        first['metadata']['labels']['extra'] = 'x'
+        second = rendering.render_manifest('wordpress-deployment', 'blog', SPECS['everything'])
+        self.assertTrue(second['spec']['template']['spec']['containers'][0]['env'])
+        self.assertNotIn('extra', second['metadata']['labels'])
+
+
+class TemplateTests(unittest.TestCase):
+
+    def render(self, text: str, **values):
+        return rendering.Template('test.yaml', text).render(**values)
+
+    def test_none_omits_key(self):
+        text = 'a: {a}\nb: {b}\nc:\n  d: {d}\n'
+        self.assertEqual(self.render(text, a=None, b=1, d=None), {'b': 1, 'c': {}})
+
+    def test_none_omits_list_item(self):
+        text = 'items:\n- {first}\n- fixed\n- {last}\n'
+        self.assertEqual(self.render(text, first=None, last={'k': 'v'}), {'items': ['fixed', {'k': 'v'}]})
+
+    def test_unquoted_keeps_yaml_typing(self):
+        text = 'a: {a}\nb: {b}\nc: {c}\nd: {d}\ne: {e}\n'
+        self.assertEqual(self.render(text, a='2', b='true', c='1Gi', d=3, e=['x', 1]),
+                         {'a': 2, 'b': True, 'c': '1Gi', 'd': 3, 'e': ['x', 1]})
+
+    def test_quoted_and_embedded_are_strings(self):
+        text = 'a: "{a}"\nb: pre-{b}\nc: "{c}-{d}"\n'
+        self.assertEqual(self.render(text, a='2', b=2, c='x', d=3), {'a': '2', 'b': 'pre-2', 'c': 'x-3'})
+
+    def test_placeholder_key(self):
+        self.assertEqual(self.render('"{key}": {value}\n', key='k', value='v'), {'k': 'v'})
+
+    def test_missing_values(self):
+        with self.assertRaises(KeyError):
+            self.render('a: {a}\nb: {b}\n', a=1)
+
+    def test_unsupported_placeholders(self):
+        for text in ('a: {}\n', 'a: {a!r}\n'):
+            with self.subTest(text), self.assertRaises(ValueError):
+                rendering.Template('test.yaml', text)
+
+
+class TemplateCacheTests(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        for patcher in (mock.patch.object(rendering, 'TEMPLATES_DIR', directory.name),
+                        mock.patch.dict(rendering._cache, clear=True)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.path = os.path.join(directory.name, 'test.yaml')
+
+    def write(self, text: str, mtime_ns: int):
+        with open(self.path, 'wt') as f:
+            f.write(text)
+        os.utime(self.path, ns=(mtime_ns, mtime_ns))
+
+    def test_compiled_once(self):
+        self.write('a: {a}\n', 10 ** 18)
+        template = rendering.get_template('test.yaml')
+        with mock.patch.object(rendering, 'Template') as compile_template:
+            self.assertIs(rendering.get_template('test.yaml'), template)
+            compile_template.assert_not_called()
+
+    def test_recompiled_when_changed(self):
+        self.write('a: {a}\n', 10 ** 18)
+        self.assertEqual(rendering.render('test.yaml', a=1), {'a': 1})
+        self.write('b: {a}\n', 10 ** 18 + 1)
+        self.assertEqual(rendering.render('test.yaml', a=1), {'b': 1})
+
+    def test_same_mtime_kept(self):
+        # the cache trusts the mtime: an edit keeping it is not seen
+        self.write('a: {a}\n', 10 ** 18)
+        rendering.get_template('test.yaml')
+        self.write('b: {a}\n', 10 ** 18)
+        self.assertEqual(rendering.render('test.yaml', a=1), {'a': 1})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,150 @@
+import asyncio
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+import kubernetes
+
+import k8s
+import scheduler
+
+
+class SchedulerTests(unittest.IsolatedAsyncioTestCase):
+
+    async def test_priority_order(self):
+        """Queued calls go by class, then by rank, then first come first served."""
+        sched = scheduler.Scheduler(concurrency=1, qps=0)
+        await sched.acquire()  # the only slot: every call below is queued
+        order = []
+
+        async def call(label, cls, rank=0):
+            with scheduler.priority(cls, rank):
+                async with sched.slot():
+                    order.append(label)
+
+        calls = [('provision', 'provision'), ('create', 'create'), ('update-1', 'update', 1),
+                 ('update-5', 'update', 5), ('update-1-later', 'update', 1), ('status', 'status'),
+                 ('delete', 'delete')]
+        tasks = []
+        for args in calls:
+            tasks.append(asyncio.create_task(call(*args)))
+            await asyncio.sleep(0)  # queued in this order
+        self.assertEqual(len(sched._queue), len(calls))
+        sched.release()
+        await asyncio.gather(*tasks)
+        self.assertEqual(order, ['delete', 'status', 'update-5', 'update-1', 'update-1-later', 'create', 'provision'])
+        self.assertEqual(sched._in_flight, 0)
+
+    async def test_concurrency_cap(self):
+        sched = scheduler.Scheduler(concurrency=2, qps=0)
+        in_flight = peak = 0
+
+        async def call():
+            nonlocal in_flight, peak
+            async with sched.slot():
+                in_flight += 1
+                peak = max(peak, in_flight)
+                await asyncio.sleep(0.01)
+                in_flight -= 1
+
+        await asyncio.gather(*(call() for _ in range(6)))
+        self.assertEqual(peak, 2)
+
+    async def test_qps_budget(self):
+        """A burst goes at once, then the calls are paced at the QPS."""
+        sched = scheduler.Scheduler(concurrency=100, qps=20, burst=2)
+        started = time.monotonic()
+        times = []
+
+        async def call():
+            async with sched.slot():
+                times.append(time.monotonic() - started)
+
+        await asyncio.gather(*(call() for _ in range(6)))
+        self.assertLess(max(times[:2]), 0.02)
+        # 4 calls beyond the burst at 20 per second
+        self.assertGreaterEqual(times[-1], 0.18)
+        self.assertLess(times[-1], 0.5)
+
+    async def test_cancelled_while_queued(self):
+        sched = scheduler.Scheduler(concurrency=1, qps=0)
+        await sched.acquire()
+        task = asyncio.create_task(sched.acquire())
+        await asyncio.sleep(0)
+        task.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await task
+        sched.release()
+        self.assertEqual(sched._in_flight, 0)
+        await asyncio.wait_for(sched.acquire(), 1)  # the slot is not leaked
+
+
+class BackoffTests(unittest.TestCase):
+
+    def test_exponential(self):
+        for attempt in range(4):
+            delay = scheduler.backoff(attempt)
+            self.assertGreaterEqual(delay, scheduler.BACKOFF * 2 ** attempt * 0.5)
+            self.assertLessEqual(delay, scheduler.BACKOFF * 2 ** attempt)
+        self.assertLessEqual(scheduler.backoff(30), scheduler.MAX_BACKOFF)
+
+    def test_retry_after(self):
+        self.assertGreaterEqual(scheduler.backoff(0, '7'), 7)
+        self.assertGreaterEqual(scheduler.backoff(0, 3), 3)
+        # a shorter Retry-After does not shorten the backoff
+        self.assertGreaterEqual(scheduler.backoff(4, '1'), scheduler.BACKOFF * 2 ** 4 * 0.5)
+        # an HTTP date is ignored
+        self.assertLessEqual(scheduler.backoff(0, 'Wed, 21 Oct 2026 07:28:00 GMT'), scheduler.BACKOFF)
+
+
+class RetryTests(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        executor = ThreadPoolExecutor(max_workers=1)
+        self.addCleanup(executor.shutdown)
+        for name, value in (('setup', lambda: None), ('_executor', executor),
+                            ('_scheduler', scheduler.Scheduler(concurrency=1, qps=0))):
+            patcher = mock.patch.object(k8s, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.sleep = mock.AsyncMock()
+        patcher = mock.patch('asyncio.sleep', self.sleep)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    @staticmethod
+    def failing(*statuses, headers=None):
+        """An API method answering each status in turn, then 'ok'."""
+        responses = iter(statuses)
+
+        def read_namespaced_secret(*args, **kwargs):
+            status = next(responses, None)
+            if status is None:
+                return 'ok'
+            error = kubernetes.client.rest.ApiException(status=status)
+            error.headers = headers
+            raise error
+        return read_namespaced_secret
+
+    async def test_retries_throttled_after_retry_after(self):
+        self.assertEqual(await k8s.call(self.failing(429, 503, headers={'Retry-After': '9'})), 'ok')
+        self.assertEqual(self.sleep.await_count, 2)
+        self.assertTrue(all(call.args[0] >= 9 for call in self.sleep.await_args_list))
+        self.assertEqual(k8s._scheduler._in_flight, 0)
+
+    async def test_other_errors_raised(self):
+        with self.assertRaises(kubernetes.client.rest.ApiException) as raised:
+            await k8s.call(self.failing(409))
+        self.assertEqual(raised.exception.status, 409)
+        self.sleep.assert_not_awaited()
+
+    async def test_gives_up_after_retries(self):
+        with mock.patch.object(scheduler, 'RETRIES', 2):
+            with self.assertRaises(kubernetes.client.rest.ApiException):
+                await k8s.call(self.failing(429, 429, 429, 429))
+        self.assertEqual(self.sleep.await_count, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
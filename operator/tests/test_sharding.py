@@ -0,0 +1,195 @@
+import asyncio
+import datetime
+import time
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+import kubernetes
+
+import k8s
+import sharding
+
+KEYS = [f"default/blog-{i}" for i in range(3000)]
+
+
+def owners(ring: sharding.Ring) -> dict:
+    return {key: ring.owner(key) for key in KEYS}
+
+
+def lease(holder: str, renewed_ago: float, duration: int = 15):
+    renew_time = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(seconds=renewed_ago)
+    return SimpleNamespace(spec=SimpleNamespace(holder_identity=holder, renew_time=renew_time,
+                                                lease_duration_seconds=duration))
+
+
+class RingTests(unittest.TestCase):
+
+    def test_empty(self):
+        self.assertIsNone(sharding.Ring([]).owner('default/blog'))
+
+    def test_stable(self):
+        self.assertEqual(owners(sharding.Ring(['a', 'b', 'c'])), owners(sharding.Ring(['c', 'a', 'b'])))
+
+    def test_even_shares(self):
+        shares = list(owners(sharding.Ring(['a', 'b', 'c'])).values())
+        for member in 'abc':
+            self.assertGreater(shares.count(member), len(KEYS) / 3 * 0.6)
+            self.assertLess(shares.count(member), len(KEYS) / 3 * 1.4)
+
+    def test_join_moves_only_to_new_member(self):
+        before = owners(sharding.Ring(['a', 'b', 'c']))
+        after = owners(sharding.Ring(['a', 'b', 'c', 'd']))
+        moved = {key for key in KEYS if before[key] != after[key]}
+        self.assertTrue(moved)
+        self.assertEqual({after[key] for key in moved}, {'d'})
+
+    def test_leave_moves_only_departed_keys(self):
+        before = owners(sharding.Ring(['a', 'b', 'c']))
+        after = owners(sharding.Ring(['a', 'c']))
+        moved = {key for key in KEYS if before[key] != after[key]}
+        self.assertEqual(moved, {key for key in KEYS if before[key] == 'b'})
+
+
+class ShardTestCase(unittest.IsolatedAsyncioTestCase):
+    """Runs as replica 'a', with sharding on and a Lease just renewed."""
+
+    def setUp(self):
+        for name, value in (('ENABLED', True), ('SHARD_ID', 'a'), ('_ring', sharding.Ring(['a'])),
+                            ('_renewed', time.monotonic())):
+            patcher = mock.patch.object(sharding, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def owned_by(self, member: str) -> str:
+        return next(key for key in KEYS if sharding._ring.owner(key) == member)
+
+
+class OwnsTests(ShardTestCase):
+
+    def test_owner(self):
+        sharding._ring = sharding.Ring(['a', 'b'])
+        namespace, name = self.owned_by('a').split('/')
+        self.assertTrue(sharding.owns(namespace, name))
+        namespace, name = self.owned_by('b').split('/')
+        self.assertFalse(sharding.owns(namespace, name))
+
+    def test_nothing_without_a_live_lease(self):
+        sharding._renewed = None
+        self.assertFalse(sharding.owns('default', 'blog'))
+        sharding._renewed = time.monotonic() - sharding.LEASE_SECONDS - 1
+        self.assertFalse(sharding.owns('default', 'blog'))
+
+    def test_everything_without_sharding(self):
+        sharding.ENABLED = False
+        sharding._renewed = None
+        self.assertTrue(sharding.owns('default', 'blog'))
+
+
+class NeedsClaimTests(ShardTestCase):
+
+    def test_own(self):
+        self.assertFalse(sharding.needs_claim('a', [sharding.finalizer()]))
+        self.assertFalse(sharding.needs_claim(None, [sharding.finalizer(), 'example.com/other']))
+        self.assertFalse(sharding.needs_claim(None, []))
+
+    def test_handled_elsewhere(self):
+        self.assertTrue(sharding.needs_claim('b', []))
+        self.assertTrue(sharding.needs_claim(None, [f"{sharding.FINALIZER_PREFIX}b"]))
+        self.assertTrue(sharding.needs_claim(None, [sharding.DEFAULT_FINALIZER]))
+
+
+class RenewTests(ShardTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.leases = []
+        self.apply = mock.AsyncMock()
+        for patcher in (mock.patch.object(k8s, 'apply', self.apply),
+                        mock.patch.object(k8s, 'coordination_v1'),
+                        mock.patch.object(k8s, 'call', mock.AsyncMock(
+                            side_effect=lambda *args, **kwargs: SimpleNamespace(items=self.leases)))):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    async def test_held_and_expired_leases(self):
+        self.leases = [lease('a', 0), lease('b', 5), lease('c', 20), lease('d', 20, duration=30),
+                       SimpleNamespace(spec=SimpleNamespace(holder_identity='e', renew_time=None,
+                                                            lease_duration_seconds=15))]
+        self.assertTrue(await sharding.renew())
+        self.assertEqual(sharding._ring.members, {'a', 'b', 'd'})
+        self.assertEqual(self.apply.await_args.args[1]['spec']['holderIdentity'], 'a')
+
+    async def test_unchanged(self):
+        self.leases = [lease('a', 0)]
+        self.assertFalse(await sharding.renew())
+        self.assertEqual(sharding._ring.members, {'a'})
+
+    async def test_own_lease_always_member(self):
+        self.leases = [lease('b', 1)]
+        await sharding.renew()
+        self.assertEqual(sharding._ring.members, {'a', 'b'})
+
+
+class ClaimTests(ShardTestCase):
+
+    def setUp(self):
+        super().setUp()
+        sharding._ring = sharding.Ring(['a', 'b'])
+        self.call = mock.AsyncMock()
+        for patcher in (mock.patch.object(k8s, 'call', self.call), mock.patch.object(k8s, 'core_v1'),
+                        mock.patch.object(k8s, 'custom_objects')):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def body(self) -> dict:
+        return self.call.await_args.args[-1]
+
+    async def test_drops_departed_finalizers(self):
+        finalizers = [f"{sharding.FINALIZER_PREFIX}gone", f"{sharding.FINALIZER_PREFIX}b",
+                      sharding.DEFAULT_FINALIZER, 'example.com/other']
+        await sharding.claim('Wordpress', 'default', 'blog', '42', finalizers)
+        self.assertEqual(self.call.await_args.args[0], k8s.custom_objects().patch_namespaced_custom_object)
+        self.assertEqual(self.body(), {'metadata': {
+            'annotations': {sharding.SHARD_ANNOTATION: 'a'},
+            'finalizers': [f"{sharding.FINALIZER_PREFIX}b", 'example.com/other'], 'resourceVersion': '42'}})
+
+    async def test_annotates_only(self):
+        await sharding.claim('Secret', 'default', 'credentials', '42', [f"{sharding.FINALIZER_PREFIX}b"])
+        self.assertEqual(self.call.await_args.args[0], k8s.core_v1().patch_namespaced_secret)
+        self.assertEqual(self.body(), {'metadata': {'annotations': {sharding.SHARD_ANNOTATION: 'a'}}})
+
+    async def test_gone_or_changed(self):
+        for status in (404, 409):
+            self.call.side_effect = kubernetes.client.rest.ApiException(status=status)
+            await sharding.claim('Wordpress', 'default', 'blog', '42', [])
+        self.call.side_effect = kubernetes.client.rest.ApiException(status=500)
+        with self.assertRaises(kubernetes.client.rest.ApiException):
+            await sharding.claim('Wordpress', 'default', 'blog', '42', [])
+
+
+class TakeoverTests(ShardTestCase):
+
+    async def test_departed_replica_objects_claimed(self):
+        """When 'b' stops renewing its Lease, 'a' claims the objects 'b' handled, and only those."""
+        sharding._ring = sharding.Ring(['a', 'b'])
+        of_b = self.owned_by('b').split('/')
+        of_a = self.owned_by('a').split('/')
+        finalizers = [f"{sharding.FINALIZER_PREFIX}b"]
+        index = {'objects': [('Wordpress', *of_b, 'b', '7', finalizers),
+                             ('Wordpress', *of_a, 'a', '8', [sharding.finalizer()])]}
+
+        async def renew():
+            sharding._ring = sharding.Ring(['a'])  # the Lease of 'b' expired
+            sharding._renewed = time.monotonic()
+
+        with mock.patch.object(sharding, 'renew', renew), \
+                mock.patch.object(sharding, 'claim', mock.AsyncMock()) as claim, \
+                mock.patch('asyncio.sleep', mock.AsyncMock(side_effect=asyncio.CancelledError)):
+            with self.assertRaises(asyncio.CancelledError):
+                await sharding.run(index)
+        claim.assert_awaited_once_with('Wordpress', *of_b, '7', finalizers)
+
+
+if __name__ == '__main__':
+    unittest.main()
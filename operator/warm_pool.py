@@ -0,0 +1,125 @@
+"""Warm pool: idle WordPress instances provisioned ahead of the blogs signing up.
+
+With ``WARM_POOL_SIZE`` above 0 the operator keeps, for each credentials Secret, that many
+idle Wordpress resources ``warm-<id>`` (labelled ``gdgitalia.dev/warm-pool: idle``) on the
+spec of a new blog and an unroutable hostname, so their images are pulled, their volumes
+bound and MySQL initialized before anyone needs them. A blog signing up claims one that is
+Ready instead of getting a new Wordpress resource: the instance is relabelled ``claimed``,
+annotated with the blog and given its ``hostname`` (and ``name``), which only re-applies its
+Ingress; the pool is refilled in the background. WordPress is not installed on the
+instances: its installer takes the site URL from the hostname the blog is first visited on.
+
+Every ``WARM_POOL_INTERVAL`` seconds the pool is also topped up, or trimmed when
+``WARM_POOL_SIZE`` was lowered.
+"""
+import asyncio
+import logging
+import os
+import secrets
+import time
+
+import kubernetes
+
+import k8s
+
+SIZE = int(os.environ.get('WARM_POOL_SIZE', '0'))
+ENABLED = SIZE > 0
+INTERVAL = float(os.environ.get('WARM_POOL_INTERVAL', '30'))
+
+LABEL = 'gdgitalia.dev/warm-pool'
+IDLE = 'idle'
+CLAIMED = 'claimed'
+PREFIX = 'warm-'
+# the hostname of an idle instance: never resolved (RFC 2606)
+HOST_DOMAIN = 'warm-pool.invalid'
+# seconds a created or claimed instance may take to show as such in the index
+PENDING_SECONDS = 60
+
+# (namespace, name) of the idle instances claimed by this process, by monotonic claim time
+_claimed = {}
+# (namespace, secret) -> the instances created by this process not indexed yet, by monotonic creation time
+_pending = {}
+_locks = {}
+
+
+def instance_name() -> str:
+    return f"{PREFIX}{secrets.token_hex(4)}"
+
+
+def idle(warm_pool, namespace: str, secret: str) -> list:
+    """The indexed idle instances of a credentials Secret: (name, ready, resourceVersion), the Ready first."""
+    now = time.monotonic()
+    instances = [instance for instance in warm_pool.get((IDLE, namespace, secret), [])
+                 if now - _claimed.get((namespace, instance[0]), -PENDING_SECONDS) > PENDING_SECONDS]
+    return sorted(instances, key=lambda instance: not instance[1])
+
+
+def claimed(warm_pool, namespace: str, blog_id) -> str:
+    """The name of the instance a blog claimed already, or None."""
+    for name in warm_pool.get((CLAIMED, namespace, str(blog_id)), []):
+        return name
+    return None
+
+
+async def claim(warm_pool, namespace: str, secret: str, annotations: dict, spec: dict) -> str:
+    """Hands a Ready idle instance to a blog: labels it claimed and sets its annotations and spec.
+
+    Only over the resourceVersion it was indexed with, so two replicas never claim the same one.
+    Returns its name, or None when no instance is Ready.
+    """
+    api = k8s.custom_objects()
+    for name, ready, resource_version in idle(warm_pool, namespace, secret):
+        if not ready:
+            break
+        _claimed[(namespace, name)] = time.monotonic()
+        body = {'metadata': {'resourceVersion': resource_version, 'labels': {LABEL: CLAIMED},
+                             'annotations': annotations},
+                'spec': spec}
+        try:
+            await k8s.call(api.patch_namespaced_custom_object, group="gdgitalia.dev", version="v1",
+                           namespace=namespace, plural="wordpress", name=name, body=body)
+        except kubernetes.client.rest.ApiException as e:
+            del _claimed[(namespace, name)]
+            if e.status not in (404, 409):  # deleted, or changed (e.g. claimed) since indexed
+                raise e
+            continue
+        return name
+    return None
+
+
+async def refill(warm_pool, namespace: str, secret: str, new_instance):
+    """Creates the instances missing from the pool of a credentials Secret, or deletes the surplus.
+
+    ``new_instance(name)`` returns the Wordpress resource of a new idle instance.
+    """
+    lock = _locks.setdefault((namespace, secret), asyncio.Lock())
+    async with lock:
+        instances = idle(warm_pool, namespace, secret)
+        indexed = {name for name, _, _ in instances}
+        now = time.monotonic()
+        pending = _pending.setdefault((namespace, secret), {})
+        for name, created in list(pending.items()):
+            if name in indexed or now - created > PENDING_SECONDS:
+                del pending[name]
+        for key, claimed_at in list(_claimed.items()):
+            if now - claimed_at > PENDING_SECONDS:
+                del _claimed[key]
+        api = k8s.custom_objects()
+        missing = SIZE - len(instances) - len(pending)
+        for _ in range(missing):
+            name = instance_name()
+            await k8s.call(api.create_namespaced_custom_object, group="gdgitalia.dev", version="v1",
+                           namespace=namespace, plural="wordpress", body=new_instance(name))
+            pending[name] = time.monotonic()
+        # the surplus, the least advanced (not Ready) ones
+        surplus = instances[SIZE:] if not pending else []
+        for name, _, _ in surplus:
+            try:
+                await k8s.call(api.delete_namespaced_custom_object, group="gdgitalia.dev", version="v1",
+                               namespace=namespace, plural="wordpress", name=name)
+            except kubernetes.client.rest.ApiException as e:
+                if e.status != 404:
+                    raise e
+        if missing > 0 or surplus:
+            logging.info("Warm pool of %s in %s: %d instances created, %d deleted", secret, namespace,
+                         max(missing, 0), len(surplus))
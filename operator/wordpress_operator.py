@@ -1,261 +1,817 @@
+import asyncio
 import base64
+import datetime
+import hashlib
+import json
 import kopf
 import logging
 import kubernetes
-import yaml
 import os
-import secrets
 import psycopg2
-
-# Define the function to create a MySQL PersistentVolumeClaim
-async def create_mysql_volume(name: str, spec: kopf.Spec, namespace: str, **kwargs):
-    """Creates a PersistentVolumeClaim for MySQL."""
-    api = kubernetes.client.CoreV1Api()
-    path = os.path.join(os.path.dirname(__file__), 'templates',"mysql", 'mysql-volume.yaml')
-    with open(path, 'rt') as f:
-        tmpl = f.read()
-    text = tmpl.format(
-        name=name,
-        mysql_size=spec.get('mysql_size','1Gi')
-    )
-    data = yaml.safe_load(text)
-    kopf.adopt(data)
-    obj = api.create_namespaced_persistent_volume_claim(namespace=namespace, body=data)
-    logging.info(f"MySQL PersistentVolumeClaim created: {obj.metadata.name}")
-    return str(obj.metadata.name)
-
-# Define the function to create a WordPress PersistentVolumeClaim
-async def create_wordpress_volume(name: str, spec: kopf.Spec, namespace: str, **kwargs):
-    """Creates a PersistentVolumeClaim for WordPress."""
-    api = kubernetes.client.CoreV1Api()
-    path = os.path.join(os.path.dirname(__file__), 'templates',"wordpress", 'wordpress-volume.yaml')
-    with open(path, 'rt') as f:
-        tmpl = f.read()
-    text = tmpl.format(
-        name=name,
-        wp_size=spec.get('wp_size','1Gi')
-    )
-    data = yaml.safe_load(text)
-    kopf.adopt(data)
-    obj = api.create_namespaced_persistent_volume_claim(namespace=namespace, body=data)
-    logging.info(f"WordPress PersistentVolumeClaim created: {obj.metadata.name}")
-    return str(obj.metadata.name)
-
-
-# Define the functions to create the MySQL and WordPress deployments
-async def create_mysql(name: str, spec: kopf.Spec, namespace: str, **kwargs):
-    """Creates a MySQL deployment."""
-    api = kubernetes.client.AppsV1Api()
-    path = os.path.join(os.path.dirname(__file__), 'templates','mysql', 'mysql-deployment.yaml')
-    with open(path, 'rt') as f:
-        tmpl = f.read()
-    text = tmpl.format(
-        name=name,
-    )
-    data = yaml.safe_load(text)
-    kopf.adopt(data)
-    obj = api.create_namespaced_deployment(namespace=namespace, body=data)
-    logging.info(f"MySQL deployment created: {obj.metadata.name}")
-    return str(obj.metadata.name)
-
-async def create_wordpress(name: str, spec: kopf.Spec, namespace: str, **kwargs):
-    """Creates a WordPress deployment."""
-    logging.info(f"Creating WordPress deployment: name:{name} {spec} namespace:{namespace}")
-    api = kubernetes.client.AppsV1Api()
-    path = os.path.join(os.path.dirname(__file__), 'templates',"wordpress", 'wordpress-deployment.yaml')
-    with open(path, 'rt') as f:
-        tmpl = f.read()
-    text = tmpl.format(
-        name=name,
-        image=spec.get('image', 'wordpress:latest'),
-        replicas=spec.get('replicas', 1)
-    )
-    data = yaml.safe_load(text)
-    kopf.adopt(data)
-    obj = api.create_namespaced_deployment(namespace=namespace, body=data)
-    logging.info(f"WordPress deployment created: {obj.metadata.name}")
-    return str(obj.metadata.name)
-
-# Define the functions to create the MySQL and WordPress services
-async def create_mysql_service(name: str, namespace: str, **kwargs):
-    """Creates a MySQL service."""
-    api = kubernetes.client.CoreV1Api()
-    path = os.path.join(os.path.dirname(__file__), 'templates','mysql', 'mysql-service.yaml')
-    with open(path, 'rt') as f:
-        tmpl = f.read()
-    text = tmpl.format(name=name)
-    data = yaml.safe_load(text)
-    kopf.adopt(data)
-    obj = api.create_namespaced_service(namespace=namespace, body=data)
-    logging.info(f"MySQL service created: {obj.metadata.name}")
-    return str(obj.metadata.name)
-
-async def create_wordpress_service(name: str, namespace: str, **kwargs):
-    """Creates a WordPress service."""
-    api = kubernetes.client.CoreV1Api()
-    path = os.path.join(os.path.dirname(__file__), 'templates','wordpress', 'wordpress-service.yaml')
-    with open(path, 'rt') as f:
-        tmpl = f.read()
-    text = tmpl.format(name=name)
-    data = yaml.safe_load(text)
-    kopf.adopt(data)
-    obj = api.create_namespaced_service(namespace=namespace, body=data)
-    logging.info(f"WordPress service created: {obj.metadata.name}")
-    return str(obj.metadata.name)
-
-# Define the function to create a Secret for MySQL password
-async def create_mysql_password(name: str, spec: kopf.Spec, namespace: str, **kwargs):
-    """Creates a Secret for MySQL root password."""
-    api = kubernetes.client.CoreV1Api()
-    path = os.path.join(os.path.dirname(__file__), 'templates','mysql', 'mysql-password.yaml')
-    with open(path, 'rt') as f:
-        tmpl = f.read()
-    text = tmpl.format(
-        name=name,
-        mysql_password=base64.b64encode(secrets.token_urlsafe(16).encode('ascii')).decode('ascii') # random secure password
-    )
-    data = yaml.safe_load(text)
-    kopf.adopt(data)
-    obj = api.create_namespaced_secret(namespace=namespace, body=data)
-    logging.info(f"MySQL password Secret created: {obj.metadata.name}")
-    return str(obj.metadata.name)
-
-# Define the function to create an Ingress for WordPress
-async def create_wordpress_ingress(name: str, spec: kopf.Spec, namespace: str, **kwargs):
-    """Creates an Ingress for WordPress."""
-    api = kubernetes.client.NetworkingV1Api()
-    path = os.path.join(os.path.dirname(__file__), 'templates','wordpress', 'wordpress-ingress.yaml')
-    with open(path, 'rt') as f:
-        tmpl = f.read()
-    text = tmpl.format(
-        name=name,
-        hostname=spec.get('hostname', f"{name}.gdgitalia.com")
-    )
-    data = yaml.safe_load(text)
-    kopf.adopt(data)
-    obj = api.create_namespaced_ingress(namespace=namespace, body=data)
-    logging.info(f"WordPress Ingress created: {obj.metadata.name}")
-    return str(obj.metadata.name)
-
-@kopf.on.create('wordpress')
-async def wordpress_create(body, spec, **kwargs):
+import time
+
+import db
+import golden
+import hibernation
+import k8s
+import listener
+import metrics
+import object_cache
+import rendering
+import scheduler
+import shared_mysql
+import sharding
+import warm_pool
+
+# set on the Wordpress resources created for a blogs_blog row, to report their status back
+BLOG_ID_ANNOTATION = 'blog-platform/blog-id'
+CREDENTIALS_ANNOTATION = 'blog-platform/credentials'
+
+# set on every sub-resource: hash of its rendered manifest, also recorded in the Wordpress status.applied
+SPEC_HASH_ANNOTATION = 'gdgitalia.dev/spec-hash'
+
+# The sub-resources of a WordPress installation (see rendering.BLOG_MANIFESTS), as named in the logs
+CHILDREN = {
+    'mysql-password': "MySQL password Secret",
+    'mysql-volume': "MySQL PersistentVolumeClaim",
+    'mysql-service': "MySQL service",
+    'mysql-deployment': "MySQL deployment",
+    'wordpress-volume': "WordPress PersistentVolumeClaim",
+    'wordpress-service': "WordPress service",
+    'wordpress-deployment': "WordPress deployment",
+    'wordpress-ingress': "WordPress Ingress",
+    'wordpress-autoscaler': "WordPress HorizontalPodAutoscaler",
+    'wordpress-activator': "WordPress activator Service",
+    'mysql-database': "MySQL database",
+    'object-cache-deployment': "object cache deployment",
+    'object-cache-service': "object cache service",
+    'page-cache-config': "page cache ConfigMap",
+    'wordpress-runtime-config': "WordPress runtime ConfigMap",
+}
+
+# created once and never updated: a new random password would lock WordPress out of its database
+CREATE_ONLY = {'mysql-password'}
+
+# the sub-resources each sub-resource has to wait for
+DEPENDENCIES = {
+    'mysql-password': (),
+    'mysql-volume': (),
+    'mysql-service': (),
+    'wordpress-volume': (),
+    'wordpress-service': (),
+    'mysql-deployment': ('mysql-password', 'mysql-volume'),
+    'wordpress-deployment': ('mysql-password', 'mysql-service', 'wordpress-volume'),
+    'wordpress-ingress': ('wordpress-service',),
+}
+
+# with mysql_tenancy: shared, the MySQL Deployment, volume and Service are replaced by a database
+# and user on a shared server ('mysql-database', see shared_mysql.py)
+SHARED_DEPENDENCIES = {
+    'mysql-password': (),
+    'wordpress-volume': (),
+    'wordpress-service': (),
+    'mysql-database': ('mysql-password',),
+    'wordpress-deployment': ('mysql-database', 'wordpress-volume'),
+    'wordpress-ingress': ('wordpress-service',),
+}
+
+def blog_steps(spec) -> dict:
+    """The sub-resources of a WordPress installation and their dependencies."""
+    steps = dict(SHARED_DEPENDENCIES if spec.get('mysql_tenancy') == 'shared' else DEPENDENCIES)
+    if spec.get('autoscaling'):
+        steps['wordpress-autoscaler'] = ('wordpress-deployment',)
+    if object_cache.dedicated(spec):
+        steps['object-cache-deployment'] = ()
+        steps['object-cache-service'] = ()
+    if spec.get('page_cache') is not None:
+        # the nginx sidecar mounts its configuration
+        steps['page-cache-config'] = ()
+        steps['wordpress-deployment'] += ('page-cache-config',)
+    if rendering.performance_runtime(spec):
+        # php-fpm and nginx mount their configuration
+        steps['wordpress-runtime-config'] = ()
+        steps['wordpress-deployment'] += ('wordpress-runtime-config',)
+    if hibernation.enabled(spec):
+        # the Ingress of a hibernated blog points to it
+        steps['wordpress-activator'] = ()
+        steps['wordpress-ingress'] += ('wordpress-activator',)
+    return steps
+
+# The sub-resources only some installations have, deleted when turned off in the spec:
+# kind, API, delete method and name
+OPTIONAL_CHILDREN = {
+    'wordpress-autoscaler': ('HorizontalPodAutoscaler', k8s.autoscaling_v2,
+                             'delete_namespaced_horizontal_pod_autoscaler', '{name}'),
+    'object-cache-deployment': ('Deployment', k8s.apps_v1, 'delete_namespaced_deployment', '{name}-cache'),
+    'object-cache-service': ('Service', k8s.core_v1, 'delete_namespaced_service', '{name}-cache'),
+    'page-cache-config': ('ConfigMap', k8s.core_v1, 'delete_namespaced_config_map', '{name}-page-cache'),
+    'wordpress-runtime-config': ('ConfigMap', k8s.core_v1, 'delete_namespaced_config_map', '{name}-runtime'),
+    'wordpress-activator': ('Service', k8s.core_v1, 'delete_namespaced_service', '{name}-activator'),
+}
+
+def spec_hash(manifest: dict) -> str:
+    return hashlib.sha256(json.dumps(manifest, sort_keys=True, default=str).encode('utf-8')).hexdigest()[:16]
+
+
+# The kinds of sub-resources, kept in memory by kopf's watches in the wordpress_children index
+CHILD_RESOURCES = (
+    ('apps', 'v1', 'deployments'),
+    ('v1', 'services'),
+    ('v1', 'persistentvolumeclaims'),
+    ('v1', 'secrets'),
+    ('v1', 'configmaps'),
+    ('networking.k8s.io', 'v1', 'ingresses'),
+    ('autoscaling', 'v2', 'horizontalpodautoscalers'),
+)
+
+def index_child(namespace, name, body, meta, labels, annotations, spec, status, **kwargs):
+    """Indexes a sub-resource under ('owner', <Wordpress uid>) and under ('app', <namespace>, <app label>)."""
+    available = True
+    if body['kind'] == 'Deployment':
+        replicas = spec.get('replicas', 1)
+        available = replicas > 0 and (status.get('availableReplicas') or 0) >= replicas
+    child = {'kind': body['kind'], 'name': name, 'hash': annotations.get(SPEC_HASH_ANNOTATION),
+             'available': available, 'replicas': spec.get('replicas')}
+    keys = {('app', namespace, labels['app']): child}
+    for ref in meta.get('ownerReferences', []):
+        if ref.get('kind') == 'Wordpress':
+            keys[('owner', ref['uid'])] = child
+    return keys
+
+for resource in CHILD_RESOURCES:
+    kopf.index(*resource, id='wordpress_children', labels={'app': kopf.PRESENT})(index_child)
+
+def owned_children(wordpress_children, uid: str) -> dict:
+    """The indexed sub-resources of a Wordpress resource, by (kind, name)."""
+    return {(child['kind'], child['name']): child for child in wordpress_children.get(('owner', uid), [])}
+
+@kopf.index('secrets', annotations={shared_mysql.SERVER_ANNOTATION: kopf.PRESENT})
+def mysql_servers(namespace, name, body, **kwargs):
+    """Indexes the shared MySQL servers."""
+    return {'servers': shared_mysql.read_server(f"{namespace}/{name}", body.get('data', {}))}
+
+@kopf.index('wordpress', field='status.mysql.server', value=kopf.PRESENT)
+def mysql_tenants(namespace, name, spec, status, **kwargs):
+    """Indexes the Wordpress resources placed on each shared MySQL server, with their size."""
+    return {status['mysql']['server']: (f"{namespace}/{name}", shared_mysql.size_of(spec))}
+
+@kopf.index('secrets', annotations={'blog-platform-credentials': kopf.PRESENT})
+def credentials_secrets(namespace, name, meta, body, **kwargs):
+    """Indexes the data of the credentials Secrets, to report the blogs status without reading them."""
+    return {(namespace, name): (meta.get('resourceVersion'), body.get('data', {}))}
+
+@kopf.index('wordpress', field='status.deployments', value=kopf.PRESENT)
+def reported_status(namespace, name, spec, annotations, status, **kwargs):
+    """Indexes the availability of the Deployments reported on the status, and whether the phase agrees."""
+    deployments = dict(status['deployments'])
+    return {(namespace, name): (deployments, status.get('phase') == blog_phase(name, spec, annotations, deployments))}
+
+def index_sharded(namespace, name, body, meta, annotations, **kwargs):
+    """Indexes the objects split between the replicas, with their shard and finalizers (see sharding.py)."""
+    return {body['kind']: (body['kind'], namespace, name, annotations.get(sharding.SHARD_ANNOTATION),
+                           meta.get('resourceVersion'), tuple(meta.get('finalizers', [])))}
+
+if sharding.ENABLED:
+    kopf.index('wordpress', id='sharded_objects')(index_sharded)
+    kopf.index('secrets', id='sharded_objects',
+               annotations={'blog-platform-credentials': kopf.PRESENT})(index_sharded)
+
+def index_golden_snapshot(namespace, name, status, **kwargs):
+    """Indexes the golden snapshots, with whether they are ready to be cloned and their size (see golden.py)."""
+    return {(namespace, name): {'ready': bool(status.get('readyToUse')), 'size': status.get('restoreSize')}}
+
+def index_warm_pool(namespace, name, meta, labels, annotations, status, **kwargs):
+    """Indexes the idle instances of the warm pool by credentials Secret, with whether they are Ready,
+    and the claimed ones by blog (see warm_pool.py)."""
+    if labels[warm_pool.LABEL] == warm_pool.IDLE:
+        return {(warm_pool.IDLE, namespace, annotations.get(CREDENTIALS_ANNOTATION)):
+                (name, status.get('phase') == 'Ready', meta.get('resourceVersion'))}
+    return {(warm_pool.CLAIMED, namespace, annotations.get(BLOG_ID_ANNOTATION)): name}
+
+if warm_pool.ENABLED:
+    kopf.index('wordpress', id='warm_instances', labels={warm_pool.LABEL: kopf.PRESENT})(index_warm_pool)
+
+def index_hibernating(namespace, name, spec, annotations, **kwargs):
+    """Indexes the blogs that hibernate, by hostname and by name (see hibernation.py)."""
+    blog = {'namespace': namespace, 'name': name, 'idle_after': hibernation.idle_after(spec),
+            'hibernated': hibernation.hibernated(spec, annotations),
+            'deployments': sorted(deployment_names(name, spec)),
+            # the page cache's nginx, or Apache (nginx on php-fpm): the Service is headless
+            'port': 8080 if spec.get('page_cache') is not None else 80}
+    return {('host', rendering.hostname(name, spec)): blog, ('blog', namespace, name): blog}
+
+if hibernation.ENABLED:
+    kopf.index('wordpress', id='hibernating_blogs', field='spec.hibernation', value=kopf.PRESENT)(index_hibernating)
+
+if golden.ENABLED:
+    kopf.index('snapshot.storage.k8s.io', 'v1', 'volumesnapshots', id='golden_snapshots',
+               labels={golden.LABEL: kopf.PRESENT})(index_golden_snapshot)
+
+async def apply_child(key: str, name: str, spec, namespace: str, applied: dict, existing: dict,
+                      database: dict = None, golden_sources: dict = None, hibernated: bool = False) -> str:
+    """Renders a sub-resource and applies it, unless it exists unchanged since the last apply.
+
+    ``applied`` maps the sub-resources to the spec hash they were last applied with,
+    ``existing`` is the indexed sub-resources (see ``owned_children``), ``database``
+    the MySQL database of a blog on a shared server, ``golden_sources`` the golden
+    snapshots its volumes are cloned from and ``hibernated`` whether it is scaled to zero.
+    Returns the spec hash of the sub-resource.
+    """
+    with metrics.CHILD_SECONDS.labels(resource=key).time():
+        data = rendering.render_manifest(key, name, spec, database, golden_sources, hibernated)
+        kopf.adopt(data)
+        # copied from a warm pool instance, and changed by its claim: only the Ingress is re-applied then
+        data['metadata'].get('labels', {}).pop(warm_pool.LABEL, None)
+        current = existing.get((data['kind'], data['metadata']['name']))
+        if key in CREATE_ONLY:
+            if current is not None:
+                return applied.get(key, 'created')
+            obj_name = await k8s.create(k8s.core_v1().create_namespaced_secret, namespace=namespace, body=data)
+            logging.info("%s created: %s", CHILDREN[key], obj_name)
+            return 'created'
+
+        digest = spec_hash(data)
+        if current is not None and current['hash'] == digest:
+            return digest  # unchanged, no API call
+        data['metadata'].setdefault('annotations', {})[SPEC_HASH_ANNOTATION] = digest
+        await k8s.apply(namespace, data)
+        logging.info("%s %s: %s", CHILDREN[key], 'updated' if key in applied else 'applied', data['metadata']['name'])
+        return digest
+
+async def run_steps(steps: dict, fn):
+    """Runs ``fn(key)`` for all the steps concurrently, each one as soon as the steps it depends on are done."""
+    tasks = {}
+
+    async def run(key):
+        await asyncio.gather(*(tasks[dep] for dep in steps[key]))
+        return await fn(key)
+
+    for key in steps:
+        tasks[key] = asyncio.ensure_future(run(key))
+    results = await asyncio.gather(*tasks.values(), return_exceptions=True)
+    for result in results:
+        if isinstance(result, BaseException):
+            raise result
+    return dict(zip(tasks, results))
+
+# Wordpress resource -> (shared server id, size) of the placements not in the mysql_tenants index yet
+_placements = {}
+
+def place_blog(name: str, spec, namespace: str, status, mysql_servers, mysql_tenants) -> dict:
+    """The database of a blog on a shared MySQL server: the one it is on, or the best fit."""
+    if status.get('mysql'):
+        return dict(status['mysql'])
+    servers = list(mysql_servers.get('servers', []))
+    tenants = {server['id']: dict(mysql_tenants.get(server['id'], [])) for server in servers}
+    for key, (server_id, size) in _placements.items():
+        tenants.setdefault(server_id, {})[key] = size
+    size = shared_mysql.size_of(spec)
+    server = shared_mysql.choose_server(servers, {server_id: list(sizes.values()) for server_id, sizes in tenants.items()}, size)
+    if server is None:
+        raise kopf.TemporaryError("No shared MySQL server has room for the blog", delay=60)
+    _placements[f"{namespace}/{name}"] = (server['id'], size)
+    database, user = shared_mysql.tenant_names(namespace, name)
+    logging.info("WordPress installation %s placed on MySQL server %s", name, server['id'])
+    return {'server': server['id'], 'host': shared_mysql.db_host(server), 'name': database, 'user': user}
+
+def shared_server(server_id: str, mysql_servers):
+    """The indexed shared MySQL server ``<namespace>/<name>``, or None."""
+    for server in mysql_servers.get('servers', []):
+        if server['id'] == server_id:
+            return server
+    return None
+
+async def create_database(name: str, namespace: str, database: dict, applied: dict, mysql_servers) -> str:
+    """Creates the database and user of a blog on its shared server, once."""
+    digest = spec_hash(database)
+    if applied.get('mysql-database') == digest:
+        return digest
+    server = shared_server(database['server'], mysql_servers)
+    if server is None:
+        raise kopf.TemporaryError(f"MySQL server {database['server']} not found", delay=60)
+    secret = await k8s.call(k8s.core_v1().read_namespaced_secret, f"{name}-mysql-pass", namespace)
+    password = base64.b64decode(secret.data['password']).decode('utf-8')
+    with metrics.CHILD_SECONDS.labels(resource='mysql-database').time():
+        await asyncio.to_thread(shared_mysql.create_tenant, server, database['name'], database['user'], password)
+    logging.info("%s created: %s on %s", CHILDREN['mysql-database'], database['name'], database['server'])
+    return digest
+
+def reconciled_digest(spec, hibernated: bool = False) -> str:
+    """Identifies a spec as reconciled by this operator: changes with the spec, the templates,
+    the sub-resources it has (the steps and optional children, which the golden and hibernation
+    modes change), the settings rendered into them or the hibernation."""
+    state = {'spec': spec, 'templates': rendering.templates_digest(), 'steps': blog_steps(spec),
+             'optional': {key: (kind, method, obj_name) for key, (kind, _, method, obj_name) in OPTIONAL_CHILDREN.items()},
+             'create_only': sorted(CREATE_ONLY), 'golden': golden.ENABLED, 'hibernation': hibernation.ENABLED,
+             'plugins': object_cache.PLUGINS}
+    if hibernation.ENABLED:
+        state['activator_host'] = hibernation.ACTIVATOR_HOST
+    if hibernated:
+        state['hibernated'] = True
+    return spec_hash(state)
+
+def converged(name: str, spec, status, existing: dict, hibernated: bool = False) -> bool:
+    """Whether a Wordpress resource was last reconciled with this spec and these templates, and
+    all the sub-resources applied then are still there unchanged (see ``owned_children``)."""
+    if status.get('reconciled') != reconciled_digest(spec, hibernated):
+        return False
+    hashes = {child['hash'] for child in existing.values()}
+    for key, digest in (status.get('applied') or {}).items():
+        if key in CREATE_ONLY:
+            if ('Secret', f"{name}-mysql-pass") not in existing:
+                return False
+        elif key != 'mysql-database' and digest is not None and digest not in hashes:
+            return False
+    return True
+
+async def reconcile(name: str, uid: str, spec, namespace: str, status, patch,
+                    wordpress_children, mysql_servers, mysql_tenants, golden_snapshots=None, hibernated=False):
+    """Brings all the sub-resources in line with the spec, skipping the unchanged ones."""
+    try:
+        object_cache.validate(spec)
+    except object_cache.CacheError as e:
+        raise kopf.PermanentError(str(e))
+    applied = dict(status.get('applied') or {})
+    existing = owned_children(wordpress_children, uid)
+    database = None
+    if spec.get('mysql_tenancy') == 'shared':
+        database = place_blog(name, spec, namespace, status, mysql_servers, mysql_tenants)
+        if status.get('mysql') != database:
+            patch.status['mysql'] = database
+    steps = blog_steps(spec)
+    # kept once chosen, golden mode or not: the dataSource of a PVC cannot change
+    golden_sources = status.get('golden')
+    if golden.ENABLED:
+        golden_sources, missing = golden.choose(namespace, name, spec, status, steps, existing, golden_snapshots)
+        if status.get('golden') != golden_sources:
+            patch.status['golden'] = golden_sources
+        for kind, image in missing:
+            await golden.seed(namespace, kind, image)
+
+    async def step(key):
+        if key == 'mysql-database':
+            return await create_database(name, namespace, database, applied, mysql_servers)
+        return await apply_child(key, name, spec, namespace, applied, existing, database, golden_sources, hibernated)
+
+    hashes = await run_steps(steps, step)
+    for key, (kind, api, method, obj_name) in OPTIONAL_CHILDREN.items():
+        obj_name = obj_name.format(name=name)
+        if key not in hashes and (kind, obj_name) in existing:
+            # e.g. autoscaling turned off: the Deployment is back to spec.replicas
+            await k8s.call(getattr(api(), method), obj_name, namespace)
+            logging.info("%s deleted: %s", CHILDREN[key], obj_name)
+    deployment = existing.get(('Deployment', name))
+    if spec.get('autoscaling') and not hibernated and deployment is not None and deployment['replicas'] == 0:
+        # woken up: the HorizontalPodAutoscaler does not scale a Deployment up from zero
+        await k8s.call(k8s.apps_v1().patch_namespaced_deployment, name, namespace,
+                       {'spec': {'replicas': spec['autoscaling'].get('min_replicas', 1)}})
+    changed = [key for key, digest in hashes.items() if applied.get(key) != digest]
+    removed = [key for key in applied if key not in hashes]
+    if changed or removed:
+        patch.status['applied'] = dict(hashes, **dict.fromkeys(removed))
+    digest = reconciled_digest(spec, hibernated)
+    if status.get('reconciled') != digest:
+        patch.status['reconciled'] = digest
+    return changed + removed
+
+@kopf.on.create('wordpress', when=sharding.is_owned)
+async def wordpress_create(body, spec, name, uid, namespace, status, patch, annotations,
+                           wordpress_children, mysql_servers, mysql_tenants, golden_snapshots=None, **kwargs):
     """Handles creation of a WordPress installation."""
-    logging.info(f"Creating WordPress installation: name:{body.metadata.name} {spec} namespace:{body.metadata.namespace}")
+    logging.info("Creating WordPress installation: name:%s %s namespace:%s", name, spec, namespace)
 
     # Create the MySQL and WordPress deployments and services
-    await kopf.execute(fns={
-        'mysql-deployment': create_mysql,
-        'mysql-volume': create_mysql_volume,
-        'mysql-service': create_mysql_service,
-        'mysql-password': create_mysql_password,
-        'wordpress-deployment': create_wordpress,
-        'wordpress-volume': create_wordpress_volume,
-        'wordpress-service': create_wordpress_service,
-        'wordpress-ingress': create_wordpress_ingress
-    })
-    logging.info(f"WordPress installation: {body.metadata.name} {spec} completed")
-
-
-
-
-@kopf.on.delete('wordpress')
-async def wordpress_delete(body, **kwargs):
+    with metrics.HANDLER_SECONDS.labels(handler='create').time(), \
+            scheduler.priority('create', spec.get('priority', 0)):
+        await reconcile(name, uid, spec, namespace, status, patch, wordpress_children, mysql_servers, mysql_tenants,
+                        golden_snapshots, hibernation.hibernated(spec, annotations))
+    logging.info("WordPress installation: %s %s completed", name, spec)
+
+@kopf.on.update('wordpress', when=sharding.is_owned)
+@kopf.on.resume('wordpress', when=sharding.is_owned)
+async def wordpress_update(reason, spec, name, uid, namespace, status, patch, labels, annotations,
+                           wordpress_children, mysql_servers, mysql_tenants, credentials_secrets,
+                           golden_snapshots=None, **kwargs):
+    """Handles changes of a WordPress installation, and resumes it on operator restarts.
+
+    A resumed installation already converged is left as is, without rendering anything. An
+    instance of the warm pool just claimed by a blog is reported ready once its Ingress is.
+    """
+    hibernated = hibernation.hibernated(spec, annotations)
+    if reason == 'resume':
+        existing = owned_children(wordpress_children, uid)
+        outcome = 'converged' if converged(name, spec, status, existing, hibernated) else 'reconciled'
+        metrics.RESUMED.labels(outcome).inc()
+        metrics.STARTUP_SECONDS.labels('resync').set(metrics.uptime())
+        if outcome == 'converged':
+            logging.debug("WordPress installation %s resumed: converged", name)
+            return
+    with metrics.HANDLER_SECONDS.labels(handler='update').time(), \
+            scheduler.priority('update', spec.get('priority', 0)):
+        changed = await reconcile(name, uid, spec, namespace, status, patch,
+                                  wordpress_children, mysql_servers, mysql_tenants, golden_snapshots, hibernated)
+    if reason == 'resume':
+        metrics.STARTUP_SECONDS.labels('resync').set(metrics.uptime())
+    logging.info("WordPress installation %s %s: %s", name, reason, ', '.join(changed) or 'unchanged')
+    if (labels.get(warm_pool.LABEL) == warm_pool.CLAIMED and 'wordpress-ingress' in changed and
+            status.get('phase') == 'Ready'):
+        await report_blog_ready(namespace, annotations, credentials_secrets)
+
+
+# safety net for the Wordpress resources kopf left unprocessed (e.g. its own PATCH throttled)
+RESYNC_INTERVAL = float(os.environ.get('WORDPRESS_RESYNC_INTERVAL', '300'))
+RESYNC_ANNOTATION = 'gdgitalia.dev/resync'
+
+@kopf.on.timer('wordpress', interval=RESYNC_INTERVAL, idle=RESYNC_INTERVAL, when=sharding.is_owned)
+async def wordpress_resync(spec, name, namespace, meta, status, annotations, **kwargs):
+    """Touches a Wordpress resource not reconciled with its current spec after a quiet interval.
+
+    When one of kopf's own requests fails (e.g. a 429 on the finalizer or on the handler
+    progress), kopf only processes the resource again on its next event; the annotation is it.
+    """
+    if meta.get('deletionTimestamp') or status.get('reconciled') == reconciled_digest(
+            spec, hibernation.hibernated(spec, annotations)):
+        return
+    logging.info("WordPress installation %s not reconciled for %.0fs: resyncing", name, RESYNC_INTERVAL)
+    with scheduler.priority('update', spec.get('priority', 0)):
+        await k8s.call(k8s.custom_objects().patch_namespaced_custom_object, group="gdgitalia.dev", version="v1",
+                       namespace=namespace, plural="wordpress", name=name,
+                       body={'metadata': {'annotations': {RESYNC_ANNOTATION: str(int(time.time()))}}})
+    metrics.RESYNCED.inc()
+
+
+# The kinds of sub-resources of a WordPress installation, all labelled app=<name>
+TEARDOWN = (
+    ('Deployment', k8s.apps_v1, 'delete_collection_namespaced_deployment'),
+    ('Service', k8s.core_v1, 'delete_collection_namespaced_service'),
+    ('PersistentVolumeClaim', k8s.core_v1, 'delete_collection_namespaced_persistent_volume_claim'),
+    ('Secret', k8s.core_v1, 'delete_collection_namespaced_secret'),
+    ('ConfigMap', k8s.core_v1, 'delete_collection_namespaced_config_map'),
+    ('Ingress', k8s.networking_v1, 'delete_collection_namespaced_ingress'),
+    ('HorizontalPodAutoscaler', k8s.autoscaling_v2, 'delete_collection_namespaced_horizontal_pod_autoscaler'),
+)
+
+# 'labels' deletes the sub-resources by label selector, 'owner' leaves them to the
+# garbage collector through the ownerReferences set by kopf.adopt
+TEARDOWN_MODE = os.environ.get('WORDPRESS_TEARDOWN', 'labels')
+
+@kopf.on.delete('wordpress', when=sharding.is_owned)
+async def wordpress_delete(body, spec, status, wordpress_children, mysql_servers, **kwargs):
     """Handles deletion of a WordPress installation."""
-    logging.info(f"Deleting WordPress installation: {body.metadata.name}")
-    name= body.metadata.name
+    logging.info("Deleting WordPress installation: %s", body.metadata.name)
+    name = body.metadata.name
     namespace = body.metadata.namespace
-    # ignore 404 error
-    
-    safe_delete(lambda:kubernetes.client.AppsV1Api().delete_namespaced_deployment(name=f"{name}-mysql", namespace=namespace))
-   
-    safe_delete(lambda:kubernetes.client.CoreV1Api().delete_namespaced_persistent_volume_claim(name=f"{name}-mysql-pv", namespace=namespace))
-    safe_delete(lambda:kubernetes.client.CoreV1Api().delete_namespaced_service(name=f"{name}-mysql", namespace=namespace))
-    safe_delete(lambda:kubernetes.client.CoreV1Api().delete_namespaced_secret(name=f"{name}-mysql-pass", namespace=namespace))
-    safe_delete(lambda:kubernetes.client.AppsV1Api().delete_namespaced_deployment(name=f"{name}", namespace=namespace))
-    safe_delete(lambda:kubernetes.client.CoreV1Api().delete_namespaced_persistent_volume_claim(name=f"{name}-pv", namespace=namespace))
-    safe_delete(lambda:kubernetes.client.CoreV1Api().delete_namespaced_service(name=f"{name}", namespace=namespace))
-    safe_delete(lambda:kubernetes.client.NetworkingV1Api().delete_namespaced_ingress(name=f"{name}-ingress", namespace=namespace))
-
-    logging.info(f"WordPress installation deleted: {body.metadata.name}")
-
-def safe_delete(delete_op):
+    start = time.monotonic()
+
+    if TEARDOWN_MODE == 'owner':
+        logging.info("WordPress installation %s sub-resources left to the garbage collector", name)
+    else:
+        # one delete_collection per kind left, all at once
+        kinds = {child['kind'] for child in wordpress_children.get(('app', namespace, name), [])}
+        with metrics.HANDLER_SECONDS.labels(handler='delete').time(), \
+                scheduler.priority('delete', spec.get('priority', 0)):
+            await asyncio.gather(*(
+                k8s.call(getattr(api(), method), namespace=namespace,
+                         label_selector=f"app={name}", propagation_policy='Background')
+                for kind, api, method in TEARDOWN if kind in kinds
+            ))
+
+    database = status.get('mysql')
+    if database:
+        server = shared_server(database['server'], mysql_servers)
+        if server is None:
+            logging.warning("MySQL server %s not found, database %s left", database['server'], database['name'])
+        else:
+            await asyncio.to_thread(shared_mysql.drop_tenant, server, database['name'], database['user'])
+            logging.info("%s dropped: %s on %s", CHILDREN['mysql-database'], database['name'], database['server'])
+    _placements.pop(f"{namespace}/{name}", None)
+
+    cache = object_cache.settings(name, spec)
+    if cache is not None and not object_cache.dedicated(spec):
+        try:
+            deleted = await object_cache.flush(cache)
+            logging.info("%d object cache keys of %s deleted from %s", deleted, name, cache['host'])
+        except (OSError, asyncio.TimeoutError, object_cache.CacheError) as e:
+            logging.warning("Object cache keys of %s left on %s: %s", name, cache['host'], e)
+
+    logging.info("WordPress installation deleted: %s in %.3fs", name, time.monotonic() - start)
+
+
+def deployment_names(name: str, spec) -> set:
+    """The Deployments a WordPress installation needs available to be ready."""
+    names = {name} if spec.get('mysql_tenancy') == 'shared' else {name, f"{name}-mysql"}
+    if object_cache.dedicated(spec):
+        names.add(f"{name}-cache")
+    return names
+
+def blog_phase(name: str, spec, annotations, deployments: dict) -> str:
+    """The phase of a WordPress installation, from the availability of its Deployments."""
+    if all(deployments.get(dep) for dep in deployment_names(name, spec)):
+        return 'Ready'
+    return 'Hibernated' if hibernation.hibernated(spec, annotations) else 'Provisioning'
+
+def wordpress_owner(meta):
+    """The name of the Wordpress resource owning an object, if any."""
+    for ref in meta.get('ownerReferences', []):
+        if ref.get('kind') == 'Wordpress' and ref.get('apiVersion', '').startswith('gdgitalia.dev/'):
+            return ref['name']
+    return None
+
+# (namespace, deployment) -> availability last reported on the owner's status
+_deployments_available = {}
+
+@kopf.on.event('apps', 'v1', 'deployments', labels={'app': kopf.PRESENT}, when=sharding.is_owned_child)
+async def deployment_event(event, name, namespace, meta, wordpress_children, credentials_secrets, reported_status,
+                           **kwargs):
+    """Reports the availability of the Deployments on the status of their Wordpress resource."""
+    owner = wordpress_owner(meta)
+    if owner is None:
+        return
+    # the index is updated with this event before the handler runs (and a deleted Deployment is gone)
+    available_deployments = {child['name']: child['available']
+                             for child in wordpress_children.get(('app', namespace, owner), [])
+                             if child['kind'] == 'Deployment'}
+    available = available_deployments.get(name, False)
+    if _deployments_available.get((namespace, name)) == available:
+        return
+    if (namespace, name) not in _deployments_available and event['type'] != 'DELETED':
+        # first seen since the operator started: the status may say so already
+        for reported, consistent in reported_status.get((namespace, owner), []):
+            if consistent and reported.get(name) == available:
+                _deployments_available[(namespace, name)] = available
+                return
+
+    api = k8s.custom_objects()
+    with scheduler.priority('status'):
+        try:
+            obj = await k8s.call(api.patch_namespaced_custom_object, group="gdgitalia.dev", version="v1",
+                                 namespace=namespace, plural="wordpress", name=owner,
+                                 body={'status': {'deployments': {name: available}}})
+            while True:
+                # from the availabilities on the status, not the index: the events of the other
+                # Deployments may be handled concurrently and report theirs in between
+                wp_status = obj.get('status', {})
+                reported = wp_status.get('deployments', {})
+                phase = blog_phase(owner, obj['spec'], obj['metadata'].get('annotations', {}), reported)
+                ready = phase == 'Ready'
+                if wp_status.get('phase') == phase:
+                    break
+                patch = {'phase': phase}
+                if ready:
+                    patch['readyAt'] = datetime.datetime.now(datetime.timezone.utc).isoformat()
+                try:
+                    # only over the status it was decided from: else decided again from the new one
+                    await k8s.call(api.patch_namespaced_custom_object, group="gdgitalia.dev", version="v1",
+                                   namespace=namespace, plural="wordpress", name=owner,
+                                   body={'metadata': {'resourceVersion': obj['metadata']['resourceVersion']},
+                                         'status': patch})
+                    break
+                except kubernetes.client.rest.ApiException as e:
+                    if e.status != 409:
+                        raise e
+                obj = await k8s.call(api.get_namespaced_custom_object, group="gdgitalia.dev", version="v1",
+                                     namespace=namespace, plural="wordpress", name=owner)
+        except kubernetes.client.rest.ApiException as e:
+            if e.status != 404:  # the Wordpress resource is being deleted
+                raise e
+            _deployments_available.pop((namespace, name), None)
+            return
+    # remembered once reported: after a failure the next event reports it again
+    if event['type'] == 'DELETED':
+        _deployments_available.pop((namespace, name), None)
+    else:
+        _deployments_available[(namespace, name)] = available
+    if wp_status.get('phase') == phase:
+        return
+    logging.info("WordPress installation %s is %s", owner, phase)
+    if ready:
+        await report_blog_ready(namespace, obj['metadata'].get('annotations', {}), credentials_secrets)
+
+async def golden_seed_event(event, name, namespace, labels, status, golden_snapshots, **kwargs):
+    """Snapshots a golden volume once its seed Job succeeded, or drops the seed if it failed."""
+    if event['type'] == 'DELETED' or not name.endswith(golden.SEED_SUFFIX):
+        return
+    snapshot = name[:-len(golden.SEED_SUFFIX)]
+    if status.get('succeeded'):
+        if (namespace, snapshot) not in golden_snapshots:
+            await golden.snapshot(namespace, snapshot, labels[golden.LABEL])
+    elif any(c.get('type') == 'Failed' and c.get('status') == 'True' for c in status.get('conditions') or []):
+        logging.warning("Golden volume %s seeding failed in %s: new blogs start from empty volumes", snapshot, namespace)
+        await golden.clean_up(namespace, snapshot, failed=True)
+
+async def golden_snapshot_event(event, name, namespace, status, **kwargs):
+    """Deletes the seed of a golden snapshot once the snapshot is ready to be cloned."""
+    if event['type'] != 'DELETED' and status.get('readyToUse'):
+        await golden.clean_up(namespace, name)
+
+if golden.ENABLED:
+    kopf.on.event('batch', 'v1', 'jobs', labels={golden.LABEL: kopf.PRESENT})(golden_seed_event)
+    kopf.on.event('snapshot.storage.k8s.io', 'v1', 'volumesnapshots',
+                  labels={golden.LABEL: kopf.PRESENT})(golden_snapshot_event)
+
+def mark_ready(cur, blog_id: int):
+    cur.execute("UPDATE blogs_blog SET status = 'ready', ready_at = now() WHERE id = %s AND status <> 'ready' "
+                "RETURNING title, extract(epoch from ready_at - created_at);", (blog_id,))
+    return cur.fetchone()
+
+async def report_blog_ready(namespace: str, annotations, credentials_secrets):
+    """Moves the blogs_blog row of a ready Wordpress resource to 'ready'."""
+    if BLOG_ID_ANNOTATION not in annotations:
+        return
+    secret = annotations[CREDENTIALS_ANNOTATION]
+    for resource_version, data in credentials_secrets.get((namespace, secret), []):
+        pool = db.get_pool(namespace, secret, resource_version, data, read_credentials)
+        break
+    else:
+        logging.warning("Credentials Secret %s of blog %s not found", secret, annotations[BLOG_ID_ANNOTATION])
+        return
+    row = await pool.run(mark_ready, int(annotations[BLOG_ID_ANNOTATION]))
+    if row is not None:
+        logging.info("Blog %s live %.1fs after signup", row[0], row[1])
+
+
+@kopf.on.startup()
+async def configure(settings: kopf.OperatorSettings, **kwargs):
+    """Loads the cluster configuration once for the shared API client and serves the metrics.
+
+    With sharding, the replicas run side by side instead of pausing each other (kopf peering),
+    each with a finalizer of its own, and the replica joins the ring before handling anything.
+    With hibernation, the replica also serves the activator.
+    """
+    k8s.setup()
+    metrics.start_server()
+    if sharding.ENABLED:
+        settings.peering.standalone = True
+        settings.persistence.finalizer = sharding.finalizer()
+        await sharding.start(kwargs['sharded_objects'])
+    if hibernation.ENABLED:
+        await hibernation.start(kwargs['hibernating_blogs'], kwargs['wordpress_children'])
+    metrics.STARTUP_SECONDS.labels('startup').set(metrics.uptime())
+    logging.info("Operator started in %.2fs", metrics.uptime())
+
+@kopf.on.cleanup()
+async def shutdown(**kwargs):
+    """Leaves the shard ring, stops the activator and releases the pooled API and database connections."""
+    await sharding.stop()
+    await hibernation.stop()
+    k8s.close()
+    db.close_all()
+
+
+def read_credentials(data) -> dict:
+    """Decodes the PostgreSQL connection details of a credentials Secret's data."""
+    credentials = dict(
+        host=base64.b64decode(data['DB_HOST']).decode('utf-8'),
+        database=base64.b64decode(data['DB_NAME']).decode('utf-8'),
+        user=base64.b64decode(data['DB_USER']).decode('utf-8'),
+        password=base64.b64decode(data['DB_PASSWORD']).decode('utf-8'),
+    )
+    if 'DB_PORT' in data:
+        credentials['port'] = base64.b64decode(data['DB_PORT']).decode('utf-8')
+    return credentials
+
+# maximum number of blogs claimed (and provisioned concurrently) at once
+CLAIM_BATCH = int(os.environ.get('BLOG_CLAIM_BATCH', '50'))
+# seconds after which a blog claimed by a replica that never reported back is claimed again
+CLAIM_TIMEOUT = int(os.environ.get('BLOG_CLAIM_TIMEOUT', '300'))
+
+def claim_blogs(cur, limit: int, blog_ids=None, exclude=(), retry=False) -> list:
+    """Moves up to ``limit`` blogs to 'claimed'; rows locked by another replica are skipped.
+
+    Claims the 'pending' blogs (only those of ``blog_ids`` if given), or with ``retry`` the
+    'failed' ones and those claimed more than ``CLAIM_TIMEOUT`` seconds ago.
+    """
+    if blog_ids is not None:
+        where, params = "id = ANY(%s) AND status = 'pending'", [list(blog_ids)]
+    elif retry:
+        where = ("(status = 'failed' OR (status = 'claimed' AND claimed_at < now() - make_interval(secs => %s)))"
+                 " AND NOT id = ANY(%s)")
+        params = [CLAIM_TIMEOUT, list(exclude)]
+    else:
+        where, params = "status = 'pending' AND NOT id = ANY(%s)", [list(exclude)]
+    cur.execute(f"UPDATE blogs_blog SET status = 'claimed', claimed_at = now() WHERE id IN ("
+                f"SELECT id FROM blogs_blog WHERE {where} ORDER BY id LIMIT %s FOR UPDATE SKIP LOCKED"
+                f") RETURNING id, title, hostname;", params + [limit])
+    return cur.fetchall()
+
+def record_provisioning(cur, provisioned: list, failed: dict):
+    """Moves the claimed blogs to 'provisioning' or 'failed', one statement each.
+
+    Only the blogs still 'claimed': one reported ready in the meantime (e.g. on a claimed
+    warm pool instance) stays 'ready'.
+    """
+    if provisioned:
+        cur.execute("UPDATE blogs_blog SET status = 'provisioning', provisioning_at = now(), status_message = '' "
+                    "WHERE id = ANY(%s) AND status = 'claimed';", (provisioned,))
+    if failed:
+        cur.execute("UPDATE blogs_blog AS b SET status = 'failed', failed_at = now(), status_message = f.message "
+                    "FROM unnest(%s::bigint[], %s::text[]) AS f(id, message) WHERE b.id = f.id "
+                    "AND b.status = 'claimed';",
+                    (list(failed), list(failed.values())))
+
+async def provision_blogs(pool: db.Pool, namespace: str, secret: str, blog_ids=None, exclude=(), retry=False,
+                          warm_pool_index=None):
+    """Claims a batch of blogs, creates their WordPress resources concurrently and records the outcome.
+
+    Claiming moves the rows to 'claimed' with ``FOR UPDATE SKIP LOCKED``, so several operator
+    replicas can drain the backlog at once without provisioning a blog twice. With the warm
+    pool (``warm_pool_index``), the blogs take its Ready instances first and the pool is
+    refilled in the background. Returns the claimed and provisioned rows.
+    """
+    claimed = await pool.run(claim_blogs, CLAIM_BATCH, blog_ids, exclude, retry)
+    if not claimed:
+        return [], []
+    results = await asyncio.gather(*(
+        create_wordpress_resource(title, hostname, namespace, blog_id=claimed_id, secret=secret,
+                                  warm_pool_index=warm_pool_index)
+        for claimed_id, title, hostname in claimed
+    ), return_exceptions=True)
+    if warm_pool_index is not None:
+        start_refill(warm_pool_index, namespace, secret)
+    provisioned = [row for row, result in zip(claimed, results) if not isinstance(result, BaseException)]
+    failed = {row[0]: getattr(result, 'reason', None) or str(result)
+              for row, result in zip(claimed, results) if isinstance(result, BaseException)}
+    await pool.run(record_provisioning, [row[0] for row in provisioned], failed)
+    logging.info("Provisioned %d of %d claimed blogs in %s", len(provisioned), len(claimed), namespace)
+    return claimed, provisioned
+
+
+# provision each blog as soon as the database notifies its signup
+@kopf.daemon('secrets', annotations={'blog-platform-credentials': kopf.PRESENT},
+             when=sharding.is_owned, cancellation_timeout=1.0, backoff=10.0)
+async def listen_for_blogs(namespace, name, body, meta, warm_instances=None, **kwargs):
+    """Listens for the blogs signed up in the database of a credentials Secret."""
     try:
-        delete_op()
-    except kubernetes.client.rest.ApiException as e:
-        if e.status != 404:
-            raise e
-
-
-
-
-# every minute use the secret to query the postgres database
-@kopf.on.timer('secrets', interval=60.0, annotations={'blog-platform-credentials': kopf.PRESENT})
-async def check_secrets_timer(namespace,name, **kwargs):
+        pool = db.get_pool(namespace, name, meta.get('resourceVersion'), body['data'], read_credentials)
+    except KeyError as e:
+        logging.error("Missing key in Secret data: %s", e)
+        return
+    async with listener.BlogListener(pool.credentials, batch=CLAIM_BATCH) as blogs:
+        logging.info("Listening for new blogs with secret %s %s", name, namespace)
+        async for batch in blogs:
+            # one claim for the blogs notified meanwhile; those missing were claimed by the sweep
+            # or another replica
+            _, provisioned = await provision_blogs(pool, namespace, name, blog_ids=[blog['id'] for blog in batch],
+                                                   warm_pool_index=warm_instances)
+            notified = {blog['id']: blog for blog in batch}
+            for blog_id, _, _ in provisioned:
+                blog = notified[blog_id]
+                logging.info("WordPress resource created for blog %s %.3fs after signup",
+                             blog['title'], time.time() - blog['created'])
+
+
+# low-frequency safety sweep for the blogs the listener missed (e.g. while the operator was down)
+@kopf.on.timer('secrets', interval=float(os.environ.get('BLOG_SWEEP_INTERVAL', '600')),
+               annotations={'blog-platform-credentials': kopf.PRESENT}, when=sharding.is_owned)
+async def check_secrets_timer(namespace, name, body, meta, warm_instances=None, **kwargs):
     """Periodically checks for Secrets with the specified annotation."""
     try:
-        logging.info(f"Polling with secret {name} {namespace}")
-        # Extract PostgreSQL connection details from the Secret
-        kubernetes.config.load_kube_config()  # Loads from your default kubeconfig
-        api_instance = kubernetes.client.CoreV1Api()
-
-        # Fetch the Secret
-        secret = api_instance.read_namespaced_secret(name, namespace)
-        spec = secret.data
-    
-        db_host = base64.b64decode(spec['DB_HOST']).decode('utf-8')
-        db_name = base64.b64decode(spec['DB_NAME']).decode('utf-8')
-        db_user = base64.b64decode(spec['DB_USER']).decode('utf-8')
-        db_password = base64.b64decode(spec['DB_PASSWORD']).decode('utf-8')
-        logging.info(f"Login with {db_host} {db_name} {db_user}")
-        # Create a PostgreSQL connection
-        conn = psycopg2.connect(
-            host=db_host,
-            database=db_name,
-            user=db_user,
-            password=db_password
-        )
-        logging.info(f"Successfully connected to PostgreSQL database: {db_name}")
-
-        # Check for records with 'init=false' in the 'postgres' table
-        with conn.cursor() as cur:
-            cur.execute("SELECT title,hostname FROM blogs_blog WHERE init = false;")
-            uninitialized_records = cur.fetchall()
-
-            for record in uninitialized_records:
-                name, hostname = record
-                logging.info(f"Creating WordPress resource for blog: {name} ({hostname})")
-
-                # Create WordPress resource using the name and hostname
-                try:
-                    await create_wordpress_resource(name, hostname,namespace)
-
-                    # Update the 'init' column to True after successful creation
-                    cur.execute("UPDATE blogs_blog SET init = true WHERE title = %s;", (name,))
-                    conn.commit()
-                    logging.info(f"WordPress resource created and initialized for blog: {name}")
+        logging.info("Polling with secret %s %s", name, namespace)
+        # PostgreSQL connection details from the Secret delivered by kopf, decoded once per resourceVersion
+        pool = db.get_pool(namespace, name, meta.get('resourceVersion'), body['data'], read_credentials)
+
+        # Drain the pending blogs batch by batch, then retry the failed and abandoned ones once
+        with metrics.SWEEP_SECONDS.time():
+            for retry in (False, True):
+                attempted = set()
+                while True:
+                    claimed, provisioned = await provision_blogs(pool, namespace, name, exclude=attempted, retry=retry,
+                                                                 warm_pool_index=warm_instances)
+                    metrics.SWEEP_BLOGS_FOUND.inc(len(claimed))
+                    metrics.SWEEP_BLOGS_PROVISIONED.inc(len(provisioned))
+                    attempted.update(row[0] for row in claimed)
+                    if len(claimed) < CLAIM_BATCH:
+                        break
 
-                except Exception as e:
-                    logging.error(f"Error creating WordPress resource for blog {name}: {e}")
+    except psycopg2.Error as e:
+        logging.error("Error connecting to PostgreSQL database: %s", e)
+    except KeyError as e:
+        logging.error("Missing key in Secret data: %s", e)
 
+async def warm_pool_timer(namespace, name, warm_instances, **kwargs):
+    """Tops up (or trims) the warm pool of a credentials Secret."""
+    await refill_warm_pool(warm_instances, namespace, name)
 
-        conn.close()
+if warm_pool.ENABLED:
+    kopf.on.timer('secrets', interval=warm_pool.INTERVAL, annotations={'blog-platform-credentials': kopf.PRESENT},
+                  when=sharding.is_owned)(warm_pool_timer)
 
-    except psycopg2.Error as e:
-        logging.error(f"Error connecting to PostgreSQL database: {e}")
-    except KeyError as e:
-        logging.error(f"Missing key in Secret data: {e}")   
+@kopf.on.delete('secrets', annotations={'blog-platform-credentials': kopf.PRESENT}, optional=True,
+                when=sharding.is_owned)
+async def forget_secret(namespace, name, **kwargs):
+    """Closes the connection pool of a deleted credentials Secret."""
+    db.forget(namespace, name)
 
 
-async def create_wordpress_resource(name, hostname,namespace):
-    """Creates a WordPress resource in Kubernetes."""
-    api = kubernetes.client.CustomObjectsApi()
-    # Define the WordPress resource YAML
-    wordpress_resource = {
+def new_wordpress_resource(name, hostname, namespace) -> dict:
+    """The Wordpress resource of a new blog."""
+    return {
         "apiVersion": "gdgitalia.dev/v1",
         "kind": "Wordpress",
         "metadata": {
             "name": name,
-            "namespace": namespace  # Replace with your desired namespace
+            "namespace": namespace,  # Replace with your desired namespace
+            "annotations": {}
         },
         "spec": {
             "hostname": hostname,
@@ -265,15 +821,82 @@ async def create_wordpress_resource(name, hostname,namespace):
         }
     }
 
+def warm_pool_instance(name, namespace, secret) -> dict:
+    """An idle instance of the warm pool of a credentials Secret."""
+    instance = new_wordpress_resource(name, f"{name}.{warm_pool.HOST_DOMAIN}", namespace)
+    instance["metadata"]["labels"] = {warm_pool.LABEL: warm_pool.IDLE}
+    instance["metadata"]["annotations"][CREDENTIALS_ANNOTATION] = secret
+    return instance
+
+async def refill_warm_pool(warm_pool_index, namespace, secret):
+    with scheduler.priority('provision'):
+        await warm_pool.refill(warm_pool_index, namespace, secret,
+                               lambda name: warm_pool_instance(name, namespace, secret))
+
+# the refills started after claims, running in the background
+_refills = set()
+
+def start_refill(warm_pool_index, namespace, secret):
+    task = asyncio.create_task(refill_warm_pool(warm_pool_index, namespace, secret))
+    _refills.add(task)
+    task.add_done_callback(_refills.discard)
+
+async def create_wordpress_resource(name, hostname,namespace, blog_id=None, secret=None, warm_pool_index=None):
+    """Creates a WordPress resource in Kubernetes (an existing one of the same blog is left as is).
+
+    The resource of a blog is named after its hostname and id (see
+    ``rendering.blog_resource_name``), its title being neither unique nor a valid name. A
+    blog takes a Ready instance of the warm pool instead, if there is one (see warm_pool.py).
+    """
+    api = k8s.custom_objects()
+    resource_name = name if blog_id is None else rendering.blog_resource_name(hostname, blog_id)
+    # Define the WordPress resource YAML
+    wordpress_resource = new_wordpress_resource(resource_name, hostname, namespace)
+    wordpress_resource["spec"]["name"] = name
+    # the blogs_blog row to report the status back to
+    if blog_id is not None:
+        wordpress_resource["metadata"]["annotations"][BLOG_ID_ANNOTATION] = str(blog_id)
+        wordpress_resource["metadata"]["annotations"][CREDENTIALS_ANNOTATION] = secret
+
+    if warm_pool_index is not None and blog_id is not None:
+        instance = warm_pool.claimed(warm_pool_index, namespace, blog_id)
+        if instance is not None:
+            logging.info("WordPress instance %s already claimed by blog: %s", instance, name)
+            return
+        with scheduler.priority('create'):
+            instance = await warm_pool.claim(warm_pool_index, namespace, secret,
+                                             wordpress_resource["metadata"]["annotations"],
+                                             {"hostname": hostname, "name": name})
+        metrics.WARM_POOL_CLAIMS.labels('claimed' if instance else 'empty').inc()
+        if instance is not None:
+            logging.info("WordPress instance %s of the warm pool claimed by blog: %s", instance, name)
+            return
+
     try:
-        # Create the resource
-        api.create_namespaced_custom_object(
-            group="gdgitalia.dev",
-            version="v1",
-            namespace=namespace,  # Replace with your desired namespace
-            plural="wordpress",
-            body=wordpress_resource
-        )
-        logging.info(f"WordPress resource created for blog: {name}")
+        # Create the resource, after the calls for the existing installations
+        with scheduler.priority('provision'):
+            await k8s.call(
+                api.create_namespaced_custom_object,
+                group="gdgitalia.dev",
+                version="v1",
+                namespace=namespace,  # Replace with your desired namespace
+                plural="wordpress",
+                body=wordpress_resource
+            )
+        logging.info("WordPress resource %s created for blog: %s", resource_name, name)
     except kubernetes.client.rest.ApiException as e:
-        logging.error(f"Error creating WordPress resource: {e}")
\ No newline at end of file
+        if e.status != 409:
+            logging.error("Error creating WordPress resource: %s", e)
+            raise
+        existing = await k8s.call(api.get_namespaced_custom_object, group="gdgitalia.dev", version="v1",
+                                  namespace=namespace, plural="wordpress", name=resource_name)
+        owner = ((existing.get('metadata') or {}).get('annotations') or {}).get(BLOG_ID_ANNOTATION)
+        if blog_id is not None and owner != str(blog_id):
+            logging.error("WordPress resource %s exists for another blog (%s), not for blog: %s",
+                          resource_name, owner, name)
+            raise
+        logging.info("WordPress resource %s already exists for blog: %s", resource_name, name)
+
+
+# the operator is loaded: the rest of the startup is kopf's and the startup handlers'
+metrics.STARTUP_SECONDS.labels('import').set(metrics.uptime())